@@ -0,0 +1,186 @@
+import asyncio
+import os
+import threading
+import time
+
+
+class CaptureRejected(Exception):
+    """Raised when a capture frame is not admitted"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class CaptureAdmission:
+    """
+    Admission control for /api/capture-face
+    Each session gets at most one frame in detection and one frame waiting.
+    A newer frame from the same session supersedes the waiting one, so a
+    slow server never works through a backlog of obsolete frames. A global
+    cap bounds how many detections run at once across all sessions.
+    State is per process; with several workers the cap applies per worker.
+    """
+
+    def __init__(self, max_concurrent=None, queue_timeout=2.0, session_ttl=600):
+        self.max_concurrent = max_concurrent or os.cpu_count() or 1
+        self.queue_timeout = queue_timeout
+        self.session_ttl = session_ttl
+        self.cond = threading.Condition()
+        self.sessions = {}
+        self.active = 0
+        # Exponential moving average of detection time, for retry hints
+        self.avg_latency = 0.5
+        self.last_prune = time.monotonic()
+        self.stats = {'admitted': 0, 'superseded': 0, 'rejected_busy': 0, 'completed': 0}
+
+    def retry_after(self):
+        """Suggested client back-off in seconds"""
+        with self.cond:
+            return self._retry_after()
+
+    def _retry_after(self):
+        backlog = self.active / float(self.max_concurrent)
+        return round(max(0.2, self.avg_latency * (1 + backlog)), 2)
+
+    def _prune(self, now):
+        if now - self.last_prune < 60:
+            return
+        self.last_prune = now
+        expired = [key for key, state in self.sessions.items()
+                   if not state['busy'] and state['waiting'] == 0 and now - state['seen'] > self.session_ttl]
+        for key in expired:
+            del self.sessions[key]
+
+    def _arrive(self, key, now):
+        """Register a new frame of the session, returns (state, its sequence number)"""
+        self._prune(now)
+        state = self.sessions.get(key)
+        if state is None:
+            state = self.sessions[key] = {'latest': 0, 'busy': False, 'waiting': 0, 'seen': now}
+        state['latest'] += 1
+        state['seen'] = now
+        state['waiting'] += 1
+        return state, state['latest']
+
+    def _admissible(self, state, seq, deadline):
+        """Whether the frame may start now; raises CaptureRejected once it should give up"""
+        if state['latest'] != seq:
+            self.stats['superseded'] += 1
+            raise CaptureRejected('superseded', self._retry_after())
+        if not state['busy'] and self.active < self.max_concurrent:
+            return True
+        if time.monotonic() >= deadline:
+            self.stats['rejected_busy'] += 1
+            raise CaptureRejected('busy', self._retry_after())
+        return False
+
+    def _admit(self, state):
+        state['busy'] = True
+        self.active += 1
+        self.stats['admitted'] += 1
+        return time.monotonic()
+
+    def _finish(self, key, started):
+        elapsed = time.monotonic() - started
+        state = self.sessions.get(key)
+        if state is not None:
+            state['busy'] = False
+            state['seen'] = time.monotonic()
+        self.active -= 1
+        self.stats['completed'] += 1
+        self.avg_latency = 0.8 * self.avg_latency + 0.2 * elapsed
+
+    def acquire(self, key):
+        """Wait for a detection slot for this session's newest frame"""
+        now = time.monotonic()
+        deadline = now + self.queue_timeout
+        with self.cond:
+            state, seq = self._arrive(key, now)
+            # Wake an older waiting frame of this session so it can give up
+            self.cond.notify_all()
+            try:
+                while not self._admissible(state, seq, deadline):
+                    self.cond.wait(max(0.0, deadline - time.monotonic()))
+            finally:
+                state['waiting'] -= 1
+            return self._admit(state)
+
+    def release(self, key, started):
+        """Free the session's slot and record how long detection took"""
+        with self.cond:
+            self._finish(key, started)
+            self.cond.notify_all()
+
+    def slot(self, key):
+        """Context manager around acquire/release"""
+        return _Slot(self, key)
+
+    def snapshot(self):
+        """Current counters for monitoring"""
+        with self.cond:
+            return dict(self.stats, active=self.active, max_concurrent=self.max_concurrent,
+                        sessions=len(self.sessions), avg_latency_ms=round(self.avg_latency * 1000, 1))
+
+
+class AsyncCaptureAdmission(CaptureAdmission):
+    """
+    CaptureAdmission for an asyncio app
+    Frames wait for their slot on the event loop instead of in a thread,
+    so queued frames never hold the executor threads that run detection,
+    cache lookups and matching. Use it from a single event loop.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.changed = asyncio.Condition()
+
+    async def acquire(self, key):
+        now = time.monotonic()
+        deadline = now + self.queue_timeout
+        async with self.changed:
+            state, seq = self._arrive(key, now)
+            self.changed.notify_all()
+            try:
+                while not self._admissible(state, seq, deadline):
+                    try:
+                        await asyncio.wait_for(self.changed.wait(), max(0.0, deadline - time.monotonic()))
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                state['waiting'] -= 1
+            return self._admit(state)
+
+    async def release(self, key, started):
+        async with self.changed:
+            self._finish(key, started)
+            self.changed.notify_all()
+
+    def slot(self, key):
+        return _AsyncSlot(self, key)
+
+
+class _Slot:
+    def __init__(self, admission, key):
+        self.admission = admission
+        self.key = key
+        self.started = None
+
+    def __enter__(self):
+        self.started = self.admission.acquire(self.key)
+        return self
+
+    def __exit__(self, *exc):
+        self.admission.release(self.key, self.started)
+        return False
+
+
+class _AsyncSlot(_Slot):
+    async def __aenter__(self):
+        self.started = await self.admission.acquire(self.key)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.admission.release(self.key, self.started)
+        return False
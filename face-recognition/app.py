@@ -7,9 +7,28 @@ import numpy as np
 from io import BytesIO
 import os
 import json
+import uuid
+from admission import CaptureAdmission, CaptureRejected
+from face_hints import FaceBoxHints, parse_face_bounds
+from capture_cache import CaptureCache
+from coarse_matcher import prefilter_stats
+from gallery_cache import gallery_snapshot
+from capture_profile import CAPTURE_MAX_UPLOAD_BYTES, FrameIntervalGuard, capture_profile
+import profiling
+import time
+from audit import record_login
 
 app = Flask(__name__)
 app.secret_key = 'face_recognition_secret_key_12345'
+profiling.init_app(app)
+
+capture_admission = CaptureAdmission(
+    max_concurrent=int(os.getenv('CAPTURE_MAX_CONCURRENT', '0')) or None,
+    queue_timeout=float(os.getenv('CAPTURE_QUEUE_TIMEOUT', '2.0'))
+)
+face_hints = FaceBoxHints()
+capture_cache = CaptureCache()
+frame_guard = FrameIntervalGuard()
 
 @app.route('/')
 def index():
@@ -72,13 +91,17 @@ def login():
         if not username or not password:
             return render_template('login.html', error='Please enter username and password')
         
+        started = time.perf_counter()
         if not db.user_exists(username):
+            record_login(username, 'password', 'unknown_user', started=started, ip=request.remote_addr)
             return render_template('login.html', error='Username does not exist!')
         
         if db.verify_password(username, password):
+            record_login(username, 'password', 'success', started=started, ip=request.remote_addr)
             session['username'] = username
             return redirect(url_for('dashboard'))
         else:
+            record_login(username, 'password', 'bad_password', started=started, ip=request.remote_addr)
             return render_template('login.html', error='Invalid password!')
     
     return render_template('login.html')
@@ -93,10 +116,15 @@ def login_face():
         if not username:
             return render_template('login_face.html', error='Please enter username')
         
+        started = time.perf_counter()
         if not db.user_exists(username):
+            if face_data:
+                record_login(username, 'face', 'unknown_user', started=started, ip=request.remote_addr)
             return render_template('login_face.html', error='Username does not exist!')
         
         if not db.user_has_face(username):
+            if face_data:
+                record_login(username, 'face', 'no_face', started=started, ip=request.remote_addr)
             return render_template('login_face.html', error='This account does not have face recognition enabled')
         
         if face_data:
@@ -104,12 +132,16 @@ def login_face():
                 current_encoding = json.loads(face_data)
                 stored_encoding = db.get_user_face_encoding(username)
 
-                if frm.verify_face(stored_encoding, current_encoding):
+                matched, distance = frm.verify_face_distance(stored_encoding, current_encoding)
+                if matched:
+                    record_login(username, 'face', 'success', distance, started, ip=request.remote_addr)
                     session['username'] = username
                     return redirect(url_for('dashboard'))
                 else:
+                    record_login(username, 'face', 'no_match', distance, started, ip=request.remote_addr)
                     return render_template('login_face.html', error='Face does not match!', username=username)
             except Exception:
+                record_login(username, 'face', 'error', started=started, ip=request.remote_addr)
                 return render_template('login_face.html', error='Failed to process face data')
         
         return render_template('login_face.html', username=username)
@@ -196,109 +228,80 @@ def logout():
     session.clear()
     return redirect(url_for('login'))
 
+def capture_session_key():
+    """Identify the browser session sending capture frames"""
+    if 'capture_id' not in session:
+        session['capture_id'] = uuid.uuid4().hex
+    return session['capture_id']
+
 @app.route('/api/capture-face', methods=['POST'])
 def capture_face():
     """API endpoint to capture face via JavaScript"""
     try:
+        # Enforce the advertised capture profile before parsing the body
+        if (request.content_length or 0) > CAPTURE_MAX_UPLOAD_BYTES:
+            return jsonify({'error': 'Frame too large, see /api/capture-profile', 'success': False}), 413
         data = request.get_json()
         if not data or 'image' not in data:
             return jsonify({'error': 'No image data', 'success': False}), 400
         
-        # Decode base64 image
-        try:
-            image_data = data['image'].split(',')[1]
-            image_bytes = base64.b64decode(image_data)
-            nparr = np.frombuffer(image_bytes, np.uint8)
-            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        except Exception as e:
-            return jsonify({'error': f'Failed to decode image: {str(e)}', 'success': False}), 400
-        
-        if frame is None:
-            return jsonify({'error': 'Failed to decode image', 'success': False}), 400
-        
-        # Detect face and create encoding
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        gray = cv2.equalizeHist(gray)
-        
-        # Try multiple cascade classifiers for better detection
-        cascades = [
-            cv2.data.haarcascades + 'haarcascade_frontalface_default.xml',
-            cv2.data.haarcascades + 'haarcascade_frontalface_alt.xml',
-            cv2.data.haarcascades + 'haarcascade_frontalface_alt2.xml',
-        ]
-        
-        faces = []
-        for cascade_path in cascades:
-            face_cascade = cv2.CascadeClassifier(cascade_path)
-            # Try different parameters
-            for scale in [1.1, 1.05, 1.2]:
-                for neighbors in [5, 3, 4]:
-                    detected = face_cascade.detectMultiScale(
-                        gray, 
-                        scaleFactor=scale, 
-                        minNeighbors=neighbors, 
-                        minSize=(60, 60),
-                        flags=cv2.CASCADE_SCALE_IMAGE
-                    )
-                    if len(detected) > 0:
-                        faces = detected
-                        break
-                if len(faces) > 0:
-                    break
-            if len(faces) > 0:
-                break
-        
-        if len(faces) == 0:
-            return jsonify({
-                'error': 'No face detected. Please ensure good lighting and face the camera directly.',
-                'success': False
-            }), 400
-        
-        # Get largest face (most likely the main subject)
-        faces = sorted(faces, key=lambda x: x[2] * x[3], reverse=True)
-        x, y, w, h = faces[0]
-        
-        # Validate face size (must be reasonably large)
-        min_face_size = min(frame.shape[0], frame.shape[1]) * 0.1
-        if w < min_face_size or h < min_face_size:
-            return jsonify({
-                'error': 'Face too small. Please move closer to the camera.',
-                'success': False
-            }), 400
-        
-        # Add padding to face region
-        padding = int(min(w, h) * 0.2)
-        x = max(0, x - padding)
-        y = max(0, y - padding)
-        w = min(frame.shape[1] - x, w + 2 * padding)
-        h = min(frame.shape[0] - y, h + 2 * padding)
-        
-        face_roi = frame[y:y+h, x:x+w]
-        
-        if face_roi.size == 0:
-            return jsonify({'error': 'Failed to extract face region', 'success': False}), 400
-        
-        face_data = cv2.resize(face_roi, (100, 100))
-        encoding = face_data.flatten().tolist()
-
-        # Create preview image
+        key = capture_session_key()
+        # Repeats of an already processed frame skip admission and OpenCV
+        cached = capture_cache.get(data['image'])
+        if cached is not None:
+            face_hints.put(key, cached['face_bounds'])
+            return jsonify(cached), 200
+        wait = frame_guard.check(key)
+        if wait is not None:
+            return retry_response('Frames sent too fast, please slow down', 429, wait)
+        # Only the newest frame per session is processed, and only a
+        # bounded number of detections run at once
         try:
-            _, jpg = cv2.imencode('.jpg', face_data)
-            preview_b64 = base64.b64encode(jpg.tobytes()).decode('utf-8')
-            preview_dataurl = f'data:image/jpeg;base64,{preview_b64}'
-        except Exception:
-            preview_dataurl = None
-
-        return jsonify({
-            'success': True, 
-            'encoding': encoding, 
-            'preview': preview_dataurl,
-            'face_bounds': {'x': int(x), 'y': int(y), 'w': int(w), 'h': int(h)}
-        })
+            with capture_admission.slot(key):
+                return detect_face(data, key)
+        except CaptureRejected as e:
+            if e.reason == 'superseded':
+                return retry_response('Frame superseded by a newer frame', 429, e.retry_after)
+            return retry_response('Server busy, please retry', 503, e.retry_after)
     
     except Exception as e:
         return jsonify({'error': str(e), 'success': False}), 500
 
+def retry_response(message, status, retry_after):
+    """Error response telling the client when to send its next frame"""
+    response = jsonify({
+        'error': message,
+        'success': False,
+        'retry': True,
+        'retry_after_ms': int(retry_after * 1000)
+    })
+    response.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+    return response, status
+
+@app.route('/api/capture-profile')
+def capture_profile_settings():
+    """Frame size, quality and rate the capture pages should upload"""
+    return jsonify(capture_profile())
+
+def detect_face(data, key=None):
+    """Decode an uploaded frame and extract the face encoding"""
+    # Look where the face was in this session's previous frame first
+    hint = parse_face_bounds(data.get('face_bounds')) or face_hints.get(key)
+    payload, status = frm.process_capture_image(data['image'], hint, cache=capture_cache, cache_scope=key)
+    if payload.get('success'):
+        face_hints.put(key, payload['face_bounds'])
+    else:
+        face_hints.discard(key)
+    return jsonify(payload), status
+
+@app.route('/api/detection-stats')
+def detection_stats():
+    """Adaptive face detection order and per-combination statistics"""
+    if 'username' not in session:
+        return jsonify({'success': False, 'message': 'Authentication required'}), 401
+    return jsonify(dict(frm.detection_snapshot(), capture_admission=capture_admission.snapshot(),
+                        capture_cache=capture_cache.snapshot(),
+                        match_prefilter=prefilter_stats.snapshot(), gallery_cache=gallery_snapshot()))
 
 
 @app.route('/admin')
@@ -310,9 +313,27 @@ def admin_panel():
 
     current_user = session['username']
 
-    users = db.get_all_users()
-    total_users = len(users)
-    users_with_face = len([u for u in users if u.get('has_face')])
+    search = request.args.get('q', '').strip()
+    sort = request.args.get('sort', 'username')
+    if sort not in db.PAGE_SORT_FIELDS:
+        sort = 'username'
+    order = 'desc' if request.args.get('order') == 'desc' else 'asc'
+    try:
+        per_page = min(100, max(1, int(request.args.get('per_page', 25))))
+    except ValueError:
+        per_page = 25
+
+    users, prev_cursor, next_cursor = db.get_users_page(
+        sort=sort,
+        descending=order == 'desc',
+        prefix=search or None,
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        limit=per_page
+    )
+    counts = db.get_user_counts()
+    total_users = counts['total']
+    users_with_face = counts['with_face']
     
     # Format users for display
     formatted_users = []
@@ -329,7 +350,13 @@ def admin_panel():
                          users=formatted_users,
                          total_users=total_users,
                          users_with_face=users_with_face,
-                         current_user=current_user)
+                         current_user=current_user,
+                         search=search,
+                         sort=sort,
+                         order=order,
+                         per_page=per_page,
+                         prev_cursor=prev_cursor,
+                         next_cursor=next_cursor)
 
 @app.route('/admin/delete/<username>', methods=['GET', 'POST'])
 def delete_user(username):
@@ -355,20 +382,21 @@ def delete_user(username):
 @app.route('/admin/find-duplicates', methods=['GET'])
 def find_duplicates():
     """Find all duplicate faces in database"""
-    users = db.get_all_users()
     duplicates = []
     checked = set()
     
-    for i, user1 in enumerate(users):
-        if not user1.get('face_encoding') or user1['username'] in checked:
+    # get_all_users() leaves out face_encoding, so stream the faces instead
+    for username, face_encoding in db.iter_face_encodings():
+        if username in checked:
             continue
         
-        similar = db.find_similar_faces(user1.get('face_encoding'))
+        similar = db.find_similar_faces(face_encoding)
         if len(similar) > 1:
+            primary = next((s for s in similar if s['username'] == username), {})
             duplicates.append({
-                'primary_user': user1['username'],
-                'face_id': user1.get('face_id', 'N/A'),
-                'similar_users': [s for s in similar if s['username'] != user1['username']],
+                'primary_user': username,
+                'face_id': primary.get('face_id', 'N/A'),
+                'similar_users': [s for s in similar if s['username'] != username],
                 'total_matches': len(similar)
             })
             for sim in similar:
@@ -0,0 +1,443 @@
+"""
+Asyncio variant of app.py
+
+Same routes and templates, served by Quart on an event loop. MongoDB I/O
+goes through the async driver (async_database.py), so waiting on the
+database does not hold a thread, and CPU-bound face detection and matching
+run in a thread pool. Run with:
+
+    python async_app.py                      # development, localhost:5000
+    hypercorn async_app:app --workers 4 -b 0.0.0.0:5000
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# This process talks to MongoDB through the async client only
+os.environ.setdefault('MONGODB_AUTOCONNECT', '0')
+
+from quart import Quart, render_template, request, redirect, url_for, session, jsonify
+
+import async_database as adb
+import database as db
+import face_recognition_module as frm
+from admission import AsyncCaptureAdmission, CaptureRejected
+from face_hints import FaceBoxHints, parse_face_bounds
+from capture_cache import CaptureCache
+from coarse_matcher import prefilter_stats
+from gallery_cache import gallery_snapshot
+from capture_profile import CAPTURE_MAX_UPLOAD_BYTES, FrameIntervalGuard, capture_profile
+from audit import record_login
+
+app = Quart(__name__)
+app.secret_key = 'face_recognition_secret_key_12345'
+# No profiling.init_app here: cProfile follows a single thread, which in
+# this app is the event loop. It interleaves every in-flight request, while
+# detection and matching run on executor threads it does not see, so a
+# per-request profile would mix requests and miss their real cost. Profile
+# handlers through app.py, which runs the same code.
+
+capture_admission = AsyncCaptureAdmission(
+    max_concurrent=int(os.getenv('CAPTURE_MAX_CONCURRENT', '0')) or None,
+    queue_timeout=float(os.getenv('CAPTURE_QUEUE_TIMEOUT', '2.0'))
+)
+face_hints = FaceBoxHints()
+capture_cache = CaptureCache()
+frame_guard = FrameIntervalGuard()
+# Frames wait for admission on the event loop, so at most max_concurrent
+# threads detect and the rest stay free for cache hits and face logins
+cpu_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv('ASYNC_CPU_THREADS', '0')) or capture_admission.max_concurrent * 2,
+    thread_name_prefix='face-cpu'
+)
+
+
+async def run_cpu(func, *args):
+    """Run CPU-bound work off the event loop"""
+    return await asyncio.get_running_loop().run_in_executor(cpu_pool, func, *args)
+
+
+@app.before_serving
+async def startup():
+    await adb.connect()
+
+
+@app.after_serving
+async def shutdown():
+    await adb.close()
+    cpu_pool.shutdown(wait=False)
+
+
+@app.route('/')
+async def index():
+    """Home page - redirect to login if not authenticated"""
+    if 'username' in session:
+        return redirect(url_for('dashboard'))
+    return redirect(url_for('login'))
+
+
+@app.route('/register', methods=['GET', 'POST'])
+async def register():
+    """Register new user"""
+    if request.method == 'POST':
+        form = await request.form
+        username = form.get('username', '').strip()
+        password = form.get('password', '').strip()
+        confirm_password = form.get('confirm_password', '').strip()
+        register_face = form.get('register_face', 'off') == 'on'
+
+        if len(username) < 3:
+            return await render_template('register.html', error='Username must be at least 3 characters')
+        if len(password) < 4:
+            return await render_template('register.html', error='Password must be at least 4 characters')
+        if password != confirm_password:
+            return await render_template('register.html', error='Passwords do not match!')
+
+        face_encoding = None
+        if register_face:
+            face_data = form.get('face_encoding')
+            if not face_data:
+                return await render_template('register.html', error='Please capture your face before registering')
+            try:
+                face_encoding = await run_cpu(json.loads, face_data)
+            except Exception:
+                return await render_template('register.html', error='Failed to process face data')
+
+        # add_user checks the username and the face concurrently
+        success, message = await adb.add_user(username, password, face_encoding)
+
+        if success:
+            session['username'] = username
+            return redirect(url_for('dashboard'))
+        return await render_template('register.html', error=message)
+
+    return await render_template('register.html')
+
+
+@app.route('/login', methods=['GET', 'POST'])
+async def login():
+    """Login user"""
+    if request.method == 'POST':
+        form = await request.form
+        username = form.get('username', '').strip()
+        password = form.get('password', '').strip()
+
+        if not username or not password:
+            return await render_template('login.html', error='Please enter username and password')
+
+        started = time.perf_counter()
+        user = await adb.get_user(username, {'password': 1})
+        if user is None:
+            record_login(username, 'password', 'unknown_user', started=started, source='async', ip=request.remote_addr)
+            return await render_template('login.html', error='Username does not exist!')
+
+        if user['password'] == db.hash_password(password):
+            record_login(username, 'password', 'success', started=started, source='async', ip=request.remote_addr)
+            session['username'] = username
+            return redirect(url_for('dashboard'))
+        record_login(username, 'password', 'bad_password', started=started, source='async', ip=request.remote_addr)
+        return await render_template('login.html', error='Invalid password!')
+
+    return await render_template('login.html')
+
+
+@app.route('/login-face', methods=['GET', 'POST'])
+async def login_face():
+    """Face recognition login"""
+    if request.method == 'POST':
+        form = await request.form
+        username = form.get('username', '').strip()
+        face_data = form.get('face_encoding')
+
+        if not username:
+            return await render_template('login_face.html', error='Please enter username')
+
+        started = time.perf_counter()
+        ip = request.remote_addr
+        exists, has_face, stored_encoding = await adb.get_face_login_state(username)
+        if not exists:
+            if face_data:
+                record_login(username, 'face', 'unknown_user', started=started, source='async', ip=ip)
+            return await render_template('login_face.html', error='Username does not exist!')
+        if not has_face:
+            if face_data:
+                record_login(username, 'face', 'no_face', started=started, source='async', ip=ip)
+            return await render_template('login_face.html', error='This account does not have face recognition enabled')
+
+        if face_data:
+            try:
+                current_encoding = await run_cpu(json.loads, face_data)
+                matched, distance = await run_cpu(frm.verify_face_distance, stored_encoding, current_encoding)
+                if matched:
+                    record_login(username, 'face', 'success', distance, started, source='async', ip=ip)
+                    session['username'] = username
+                    return redirect(url_for('dashboard'))
+                record_login(username, 'face', 'no_match', distance, started, source='async', ip=ip)
+                return await render_template('login_face.html', error='Face does not match!', username=username)
+            except Exception:
+                record_login(username, 'face', 'error', started=started, source='async', ip=ip)
+                return await render_template('login_face.html', error='Failed to process face data')
+
+        return await render_template('login_face.html', username=username)
+
+    return await render_template('login_face.html')
+
+
+@app.route('/dashboard')
+async def dashboard():
+    """User dashboard - requires login"""
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    username = session['username']
+    has_face = await adb.user_has_face(username)
+    return await render_template('dashboard.html', username=username, has_face=has_face)
+
+
+@app.route('/change-password', methods=['GET', 'POST'])
+async def change_password():
+    """Change password"""
+    if 'username' not in session:
+        return redirect(url_for('login'))
+
+    username = session['username']
+
+    if request.method == 'POST':
+        form = await request.form
+        current_password = form.get('current_password', '').strip()
+        new_password = form.get('new_password', '').strip()
+        confirm_password = form.get('confirm_password', '').strip()
+
+        if not await adb.verify_password(username, current_password):
+            return await render_template('change_password.html', error='Current password is incorrect!')
+        if len(new_password) < 4:
+            return await render_template('change_password.html', error='New password must be at least 4 characters')
+        if new_password == current_password:
+            return await render_template('change_password.html', error='New password cannot be same as current password!')
+        if new_password != confirm_password:
+            return await render_template('change_password.html', error='Passwords do not match!')
+
+        if await adb.update_password(username, new_password):
+            return await render_template('change_password.html', success='Password changed successfully!')
+        return await render_template('change_password.html', error='Error changing password!')
+
+    return await render_template('change_password.html')
+
+
+@app.route('/register-face', methods=['GET', 'POST'])
+async def register_face():
+    """Register face for user"""
+    if 'username' not in session:
+        return redirect(url_for('login'))
+
+    username = session['username']
+
+    if request.method == 'POST':
+        form = await request.form
+        face_data = form.get('face_encoding')
+
+        if face_data:
+            try:
+                face_encoding = await run_cpu(json.loads, face_data)
+
+                existing_user = await adb.face_exists(face_encoding)
+                if existing_user and existing_user != username:
+                    return await render_template('register_face.html', error=f'This face is already registered to user: {existing_user}', username=username)
+
+                if await adb.update_face_encoding(username, face_encoding):
+                    return await render_template('register_face.html', success='Face registered successfully!', username=username)
+                return await render_template('register_face.html', error='Error registering face!', username=username)
+            except Exception as e:
+                return await render_template('register_face.html', error=f'Failed to process face data: {str(e)}', username=username)
+
+    return await render_template('register_face.html', username=username)
+
+
+@app.route('/logout')
+async def logout():
+    """Logout user"""
+    session.clear()
+    return redirect(url_for('login'))
+
+
+def detect_capture(key, data):
+    """Runs in the CPU pool once the frame holds a detection slot"""
+    # Look where the face was in this session's previous frame first
+    hint = parse_face_bounds(data.get('face_bounds')) or face_hints.get(key)
+    payload, status = frm.process_capture_image(data['image'], hint, cache=capture_cache, cache_scope=key)
+    if payload.get('success'):
+        face_hints.put(key, payload['face_bounds'])
+    else:
+        face_hints.discard(key)
+    return payload, status
+
+
+@app.route('/api/capture-face', methods=['POST'])
+async def capture_face():
+    """API endpoint to capture face via JavaScript"""
+    try:
+        # Enforce the advertised capture profile before reading the body
+        if (request.content_length or 0) > CAPTURE_MAX_UPLOAD_BYTES:
+            return jsonify({'error': 'Frame too large, see /api/capture-profile', 'success': False}), 413
+        data = await request.get_json()
+        if not data or 'image' not in data:
+            return jsonify({'error': 'No image data', 'success': False}), 400
+
+        if 'capture_id' not in session:
+            session['capture_id'] = uuid.uuid4().hex
+        # Repeats of an already processed frame skip admission and OpenCV
+        cached = await run_cpu(capture_cache.get, data['image'])
+        if cached is not None:
+            face_hints.put(session['capture_id'], cached['face_bounds'])
+            return jsonify(cached), 200
+        wait = frame_guard.check(session['capture_id'])
+        if wait is not None:
+            return retry_response('Frames sent too fast, please slow down', 429, wait)
+        try:
+            async with capture_admission.slot(session['capture_id']):
+                payload, status = await run_cpu(detect_capture, session['capture_id'], data)
+            return jsonify(payload), status
+        except CaptureRejected as e:
+            if e.reason == 'superseded':
+                return retry_response('Frame superseded by a newer frame', 429, e.retry_after)
+            return retry_response('Server busy, please retry', 503, e.retry_after)
+    except Exception as e:
+        return jsonify({'error': str(e), 'success': False}), 500
+
+
+def retry_response(message, status, retry_after):
+    """Error response telling the client when to send its next frame"""
+    response = jsonify({
+        'error': message,
+        'success': False,
+        'retry': True,
+        'retry_after_ms': int(retry_after * 1000)
+    })
+    response.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+    return response, status
+
+
+@app.route('/api/capture-profile')
+async def capture_profile_settings():
+    """Frame size, quality and rate the capture pages should upload"""
+    return jsonify(capture_profile())
+
+
+@app.route('/api/detection-stats')
+async def detection_stats():
+    """Adaptive face detection order and per-combination statistics"""
+    if 'username' not in session:
+        return jsonify({'success': False, 'message': 'Authentication required'}), 401
+    return jsonify(dict(frm.detection_snapshot(), capture_admission=capture_admission.snapshot(),
+                        capture_cache=capture_cache.snapshot(),
+                        match_prefilter=prefilter_stats.snapshot(), gallery_cache=gallery_snapshot()))
+
+
+@app.route('/admin')
+async def admin_panel():
+    """Admin panel to view all users and manage accounts"""
+    if 'username' not in session:
+        return redirect(url_for('login'))
+
+    current_user = session['username']
+
+    search = request.args.get('q', '').strip()
+    sort = request.args.get('sort', 'username')
+    if sort not in db.PAGE_SORT_FIELDS:
+        sort = 'username'
+    order = 'desc' if request.args.get('order') == 'desc' else 'asc'
+    try:
+        per_page = min(100, max(1, int(request.args.get('per_page', 25))))
+    except ValueError:
+        per_page = 25
+
+    # The page and the counts are independent queries
+    (users, prev_cursor, next_cursor), counts = await asyncio.gather(
+        adb.get_users_page(
+            sort=sort,
+            descending=order == 'desc',
+            prefix=search or None,
+            after=request.args.get('after'),
+            before=request.args.get('before'),
+            limit=per_page
+        ),
+        adb.get_user_counts()
+    )
+
+    formatted_users = []
+    for user in users:
+        formatted_users.append({
+            'username': user.get('username'),
+            'has_face': user.get('has_face', False),
+            'face_id': user.get('face_id', 'N/A'),
+            'created_at': str(user.get('created_at', 'N/A'))[:19],
+            'updated_at': str(user.get('updated_at', 'N/A'))[:19]
+        })
+
+    return await render_template('admin.html',
+                                 users=formatted_users,
+                                 total_users=counts['total'],
+                                 users_with_face=counts['with_face'],
+                                 current_user=current_user,
+                                 search=search,
+                                 sort=sort,
+                                 order=order,
+                                 per_page=per_page,
+                                 prev_cursor=prev_cursor,
+                                 next_cursor=next_cursor)
+
+
+@app.route('/admin/delete/<username>', methods=['GET', 'POST'])
+async def delete_user(username):
+    """Delete a user account"""
+    if 'username' not in session:
+        return jsonify({'success': False, 'message': 'Authentication required'}), 401
+
+    requester = session['username']
+    if requester != username:
+        return jsonify({'success': False, 'message': 'You do not have permission to delete this user'}), 403
+
+    if request.method == 'POST':
+        if await adb.delete_user(username):
+            session.clear()
+            return jsonify({'success': True, 'message': f'User {username} deleted successfully'})
+        return jsonify({'success': False, 'message': 'Failed to delete user'})
+
+    return jsonify({'error': 'Invalid request'}), 400
+
+
+@app.route('/admin/find-duplicates', methods=['GET'])
+async def find_duplicates():
+    """Find all duplicate faces in database"""
+    duplicates = []
+    checked = set()
+
+    async for user in adb.iter_face_users():
+        if not user.get('face_encoding') or user['username'] in checked:
+            continue
+
+        similar = await adb.find_similar_faces(user['face_encoding'])
+        if len(similar) > 1:
+            duplicates.append({
+                'primary_user': user['username'],
+                'face_id': user.get('face_id', 'N/A'),
+                'similar_users': [s for s in similar if s['username'] != user['username']],
+                'total_matches': len(similar)
+            })
+            for sim in similar:
+                checked.add(sim['username'])
+
+    return await render_template('duplicates.html', duplicates=duplicates, total_duplicates=len(duplicates))
+
+
+if __name__ == '__main__':
+    print("\n" + "="*60)
+    print("FACE RECOGNITION LOGIN SYSTEM - ASYNC WEB VERSION")
+    print("="*60)
+    print("\nServer is running at: http://localhost:5000")
+    print("\nPress Ctrl+C to stop the server")
+    print("="*60 + "\n")
+
+    app.run(host='localhost', port=5000)
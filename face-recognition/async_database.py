@@ -0,0 +1,310 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+
+from pymongo import AsyncMongoClient
+from pymongo.errors import DuplicateKeyError
+
+import database as db
+import lsh
+from coarse_matcher import face_thumbnail, prefilter, prefilter_stats
+from gallery_cache import process_gallery
+
+# Async counterpart of database.py for async_app. Document building,
+# hashing and cursor encoding are shared with database.py; only the I/O is
+# async, and lookups that do not depend on each other run concurrently.
+
+client = None
+users_collection = None
+_user_counts_cache = {'value': None, 'expires': 0.0}
+
+
+async def ensure_indexes(database):
+    """Async counterpart of database.ensure_indexes, over the same INDEXES"""
+    for name, keys, options in db.INDEXES:
+        await database[name].create_index(keys, **options)
+
+
+async def connect():
+    """Connect with the async driver and create the indexes database.py defines"""
+    global client, users_collection
+    if not db.MONGODB_URL:
+        print("❌ No MongoDB URI found. Please set MONGODB_URI in a .env file or environment variables.")
+        return False
+    try:
+        client = AsyncMongoClient(
+            db.MONGODB_URL,
+            serverSelectionTimeoutMS=5000,
+            maxPoolSize=int(os.getenv('MONGODB_MAX_POOL_SIZE', '200'))
+        )
+        await client.server_info()
+        database = client[db.DB_NAME]
+        users_collection = database[db.USERS_COLLECTION]
+        # The unique username index is what turns a concurrent duplicate
+        # registration into the DuplicateKeyError add_user handles
+        await ensure_indexes(database)
+        print("✅ MongoDB (async) connected successfully!")
+        return True
+    except Exception as e:
+        print(f"❌ MongoDB connection failed: {e}")
+        client = None
+        users_collection = None
+        return False
+
+
+async def close():
+    global client, users_collection
+    if client is not None:
+        await client.close()
+    client = None
+    users_collection = None
+
+
+async def get_user(username, projection=None):
+    """Fetch one user document, or None"""
+    if users_collection is None:
+        return None
+    try:
+        return await users_collection.find_one({'username': username}, projection)
+    except Exception as e:
+        print(f"Error getting user: {e}")
+        return None
+
+
+async def user_exists(username):
+    """Check if username already exists"""
+    return await get_user(username, {'_id': 1}) is not None
+
+
+async def verify_password(username, password):
+    """Verify password for user"""
+    user = await get_user(username, {'password': 1})
+    return user is not None and user['password'] == db.hash_password(password)
+
+
+async def get_face_login_state(username):
+    """
+    Everything face login needs in a single round trip
+    Returns (exists, has_face, face_encoding) instead of chaining
+    user_exists, user_has_face and get_user_face_encoding. With the gallery
+    cache enabled the round trip fetches the face_hash instead of the
+    encoding, and only a cache miss loads the encoding in a second one.
+    """
+    gallery = process_gallery()
+    if gallery is None:
+        user = await get_user(username, {'has_face': 1, 'face_encoding': 1})
+        if user is None:
+            return False, False, None
+        return True, user.get('has_face', False), user.get('face_encoding')
+
+    user = await get_user(username, {'has_face': 1, 'face_hash': 1})
+    if user is None:
+        return False, False, None
+    if not user.get('has_face', False):
+        return True, False, None
+    loop = asyncio.get_running_loop()
+    encoding = await loop.run_in_executor(None, gallery.get, username, lambda: user.get('face_hash'))
+    if encoding is None:
+        user = await get_user(username, {'face_encoding': 1, 'face_hash': 1})
+        if user is None or user.get('face_encoding') is None:
+            return True, True, None
+        encoding = await loop.run_in_executor(None, gallery.put, username, user['face_encoding'], user.get('face_hash'))
+    return True, True, encoding
+
+
+async def user_has_face(username):
+    """Check if user has face data registered"""
+    user = await get_user(username, {'has_face': 1})
+    return bool(user and user.get('has_face', False))
+
+
+async def face_exists(face_encoding):
+    """Check if face is already registered by another user"""
+    if users_collection is None or face_encoding is None:
+        return None
+    try:
+        result = await users_collection.find_one({'face_hash': db.hash_face_encoding(face_encoding)}, {'username': 1})
+        return result['username'] if result else None
+    except Exception as e:
+        print(f"Error checking face: {e}")
+        return None
+
+
+async def find_similar_faces(face_encoding, threshold=5000, exact=False):
+    """
+    Find similar faces from LSH candidates; distances run off the event loop
+    Like database.find_similar_faces, full encodings are only loaded for
+    candidates their thumbnail cannot rule out.
+    """
+    if users_collection is None or face_encoding is None:
+        return []
+    if exact:
+        query = {'face_encoding': {'$exists': True, '$ne': None}}
+    else:
+        query = {'$or': [
+            {'lsh_bands': {'$in': lsh.lsh_bands(face_encoding)}},
+            {'lsh_bands': None, 'face_encoding': {'$ne': None}}
+        ]}
+    loop = asyncio.get_running_loop()
+    try:
+        candidates = await users_collection.find(
+            query, {'username': 1, 'face_id': 1, 'created_at': 1, 'face_thumb': 1}).to_list(None)
+        query_thumb = await loop.run_in_executor(None, face_thumbnail, face_encoding)
+        survivors, pruned = await loop.run_in_executor(None, prefilter, query_thumb, candidates, threshold)
+        encodings = {}
+        for start in range(0, len(survivors), 500):
+            ids = [user['_id'] for user in survivors[start:start + 500]]
+            async for user in users_collection.find({'_id': {'$in': ids}}, {'face_encoding': 1}):
+                encodings[user['_id']] = user.get('face_encoding')
+    except Exception as e:
+        print(f"Error finding similar faces: {e}")
+        return []
+
+    def compare():
+        return [
+            {
+                'username': user['username'],
+                'face_id': user.get('face_id', 'N/A'),
+                'created_at': user.get('created_at', 'N/A')
+            }
+            for user in survivors
+            if db.compare_faces(face_encoding, encodings.get(user['_id']), threshold)
+        ]
+    similar_faces = await loop.run_in_executor(None, compare)
+    prefilter_stats.add(
+        candidates=len(candidates),
+        pruned=pruned,
+        unsigned=sum(1 for user in candidates if user.get('face_thumb') is None),
+        compared=len(survivors),
+        matched=len(similar_faces)
+    )
+    return similar_faces
+
+
+async def add_user(username, password, face_encoding=None):
+    """Add new user to database"""
+    if users_collection is None:
+        return False, "Database connection failed"
+
+    if face_encoding is not None:
+        exists, existing_user, similar_faces = await asyncio.gather(
+            user_exists(username), face_exists(face_encoding), find_similar_faces(face_encoding))
+    else:
+        exists, existing_user, similar_faces = await user_exists(username), None, []
+
+    if exists:
+        return False, "Username already exists"
+    if existing_user:
+        return False, f"This face is already registered with username: {existing_user}"
+    if similar_faces:
+        usernames = ', '.join([f.get('username') for f in similar_faces])
+        return False, f"Similar face found! Already registered to: {usernames}"
+
+    try:
+        user_data = db.build_user_document(username, db.hash_password(password), face_encoding)
+        await users_collection.insert_one(user_data)
+        return True, "User created successfully"
+    except DuplicateKeyError:
+        return False, "Username already exists"
+    except Exception as e:
+        return False, f"Error creating user: {str(e)}"
+
+
+async def update_face_encoding(username, face_encoding):
+    """Update face encoding for user"""
+    if users_collection is None:
+        return False
+    existing_user = await face_exists(face_encoding)
+    if existing_user and existing_user != username:
+        print(f"Face already registered to {existing_user}")
+        return False
+    try:
+        fields = {
+            'face_encoding': face_encoding,
+            'has_face': True,
+            'updated_at': datetime.utcnow()
+        }
+        fields.update(db.face_signature_fields(face_encoding))
+        result = await users_collection.update_one({'username': username}, {'$set': fields})
+        gallery = process_gallery()
+        if gallery is not None:
+            gallery.discard(username)
+        return result.modified_count > 0
+    except Exception as e:
+        print(f"Error updating face encoding: {e}")
+        return False
+
+
+async def update_password(username, new_password):
+    """Update password for user"""
+    if users_collection is None:
+        return False
+    try:
+        result = await users_collection.update_one(
+            {'username': username},
+            {'$set': {'password': db.hash_password(new_password), 'updated_at': datetime.utcnow()}}
+        )
+        return result.modified_count > 0
+    except Exception as e:
+        print(f"Error updating password: {e}")
+        return False
+
+
+async def get_users_page(sort='username', descending=False, prefix=None, after=None, before=None, limit=25):
+    """Async version of database.get_users_page"""
+    if users_collection is None:
+        return [], None, None
+    query, sort_spec, sort, backwards, has_position = db.build_users_page_query(
+        sort, descending, prefix, after, before)
+    try:
+        users = await (users_collection.find(query, {'password': 0, 'face_encoding': 0, 'lsh_bands': 0, 'face_thumb': 0})
+                       .sort(sort_spec).limit(limit + 1).to_list(None))
+    except Exception as e:
+        print(f"Error getting users page: {e}")
+        return [], None, None
+    return db.finish_users_page(users, limit, sort, backwards, has_position)
+
+
+async def get_user_counts(use_cache=True):
+    """Total users and users with face, cached like database.get_user_counts"""
+    if users_collection is None:
+        return {'total': 0, 'with_face': 0}
+    now = time.monotonic()
+    if use_cache and _user_counts_cache['value'] is not None and now < _user_counts_cache['expires']:
+        return _user_counts_cache['value']
+    try:
+        total, with_face = await asyncio.gather(
+            users_collection.estimated_document_count(),
+            users_collection.count_documents({'has_face': True}))
+    except Exception as e:
+        print(f"Error counting users: {e}")
+        return {'total': 0, 'with_face': 0}
+    counts = {'total': total, 'with_face': with_face}
+    _user_counts_cache['value'] = counts
+    _user_counts_cache['expires'] = now + db.USER_COUNTS_TTL
+    return counts
+
+
+async def iter_face_users():
+    """Yield users with a stored face, streaming from the cursor"""
+    if users_collection is None:
+        return
+    cursor = users_collection.find({'has_face': True}, {'username': 1, 'face_id': 1, 'face_encoding': 1})
+    async for user in cursor:
+        yield user
+
+
+async def delete_user(username):
+    """Delete a user"""
+    if users_collection is None:
+        return False
+    try:
+        result = await users_collection.delete_one({'username': username})
+        gallery = process_gallery()
+        if gallery is not None:
+            gallery.discard(username)
+        return result.deleted_count > 0
+    except Exception as e:
+        print(f"Error deleting user: {e}")
+        return False
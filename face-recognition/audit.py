@@ -0,0 +1,396 @@
+import atexit
+import glob
+import hashlib
+import json
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, DESCENDING, MongoClient
+from pymongo.errors import BulkWriteError, CollectionInvalid
+
+import database as db
+
+AUDIT_COLLECTION = 'auth_audit'
+AUDIT_QUEUE_SIZE = int(os.getenv('AUDIT_QUEUE_SIZE', '10000'))
+AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', '500'))
+AUDIT_FLUSH_INTERVAL = float(os.getenv('AUDIT_FLUSH_INTERVAL', '1.0'))
+AUDIT_RETENTION_DAYS = int(os.getenv('AUDIT_RETENTION_DAYS', '180'))
+# What to do with events when the queue is full: 'spill' to disk or 'drop'
+AUDIT_OVERFLOW = os.getenv('AUDIT_OVERFLOW', 'spill')
+AUDIT_SPILL_DIR = os.getenv('AUDIT_SPILL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audit_spill'))
+# Spill files of all workers together; the oldest are dropped beyond this
+AUDIT_SPILL_BYTES = int(os.getenv('AUDIT_SPILL_BYTES', str(64 * 2**20)))
+# Spill files of live workers are replayed by others once this old
+AUDIT_SPILL_STALE_SECONDS = float(os.getenv('AUDIT_SPILL_STALE_SECONDS', '300'))
+# Spill files rotate at this share of the budget, so dropping the oldest
+# data never means dropping everything
+SPILL_SEGMENTS = 8
+# audit-<pid>[-<n>].jsonl, with .replay-<pid> while a worker replays it
+SPILL_NAME = re.compile(r'audit-(\d+)(?:-\d+)?\.jsonl(?:\.replay-(\d+))?$')
+AUDIT_ENABLED = os.getenv('AUDIT_ENABLED', '1') != '0'
+
+
+def ensure_collection(database):
+    """
+    Create the audit collection as a time-series collection
+    MongoDB buckets time-series data by time, which keeps inserts and time
+    range queries cheap; events expire after AUDIT_RETENTION_DAYS. Servers
+    without time-series support get a plain collection with a TTL index.
+    """
+    if AUDIT_COLLECTION not in database.list_collection_names():
+        try:
+            database.create_collection(
+                AUDIT_COLLECTION,
+                timeseries={'timeField': 'ts', 'metaField': 'meta', 'granularity': 'seconds'},
+                expireAfterSeconds=AUDIT_RETENTION_DAYS * 86400
+            )
+        except CollectionInvalid:
+            pass
+        except Exception:
+            database[AUDIT_COLLECTION].create_index('ts', expireAfterSeconds=AUDIT_RETENTION_DAYS * 86400)
+    collection = database[AUDIT_COLLECTION]
+    collection.create_index([('meta.username', ASCENDING), ('ts', DESCENDING)])
+    collection.create_index([('meta.method', ASCENDING), ('outcome', ASCENDING), ('ts', DESCENDING)])
+    return collection
+
+
+def _pid_alive(pid):
+    """Whether a process still exists; assumed alive where signals cannot tell"""
+    if os.name == 'nt':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def _count_lines(path):
+    try:
+        with open(path, 'rb') as f:
+            return sum(1 for _ in f)
+    except OSError:
+        return 0
+
+
+def _read_spill(path):
+    events = []
+    with open(path) as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+                event['ts'] = datetime.fromisoformat(event['ts'])
+            except (ValueError, KeyError):
+                continue
+            # Spills written before events had an _id get one from their content
+            event.setdefault('_id', hashlib.blake2b(line.encode('utf-8'), digest_size=16).hexdigest())
+            events.append(event)
+    return events
+
+
+class AuditLog:
+    """
+    Authentication audit log with asynchronous batched writes
+    record() only appends to a bounded in-memory queue; a background
+    thread writes batches with insert_many. When the queue is full, or the
+    database is unreachable, events are spilled to JSON-lines files (at
+    most spill_bytes across all workers, oldest dropped first) and replayed
+    later. Without a database configured, or with AUDIT_OVERFLOW=drop,
+    they are dropped instead. Every event carries a random _id, so a
+    retried replay does not write it twice. The thread and its MongoDB
+    client are created lazily in each process, so the log also works in
+    preforked workers.
+    """
+
+    def __init__(self, queue_size=AUDIT_QUEUE_SIZE, batch_size=AUDIT_BATCH_SIZE,
+                 flush_interval=AUDIT_FLUSH_INTERVAL, overflow=AUDIT_OVERFLOW, spill_dir=AUDIT_SPILL_DIR,
+                 spill_bytes=AUDIT_SPILL_BYTES, stale_seconds=AUDIT_SPILL_STALE_SECONDS):
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.spill_dir = spill_dir
+        self.spill_bytes = spill_bytes
+        self.stale_seconds = stale_seconds
+        self.spill_segment = 0
+        self.lock = threading.Lock()
+        self.spill_lock = threading.Lock()
+        self.pid = None
+        self.queue = None
+        self.thread = None
+        self.client = None
+        self.collection = None
+        self.stopping = False
+        self.stats = {'recorded': 0, 'written': 0, 'spilled': 0, 'dropped': 0, 'spill_evicted': 0,
+                      'replayed': 0, 'errors': 0}
+
+    def _ensure_started(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            # Fresh state after fork(): threads and sockets are not inherited
+            self.queue = queue.Queue(maxsize=self.queue_size)
+            self.client = None
+            self.collection = None
+            self.stopping = False
+            self.thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self.pid = os.getpid()
+            self.thread.start()
+
+    def record(self, username, method, outcome, distance=None, latency_ms=None, source='web', ip=None):
+        """Queue one login attempt; never blocks the caller on the database"""
+        if not AUDIT_ENABLED:
+            return
+        self._ensure_started()
+        event = {
+            '_id': uuid.uuid4().hex,
+            'ts': datetime.utcnow(),
+            'meta': {'username': username, 'method': method, 'source': source},
+            'outcome': outcome,
+            'success': outcome == 'success',
+            'distance': round(distance, 2) if distance is not None else None,
+            'latency_ms': round(latency_ms, 2) if latency_ms is not None else None,
+            'ip': ip
+        }
+        self.stats['recorded'] += 1
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            if self.overflow == 'spill' and db.MONGODB_URL:
+                self._spill([event])
+            else:
+                self.stats['dropped'] += 1
+
+    def _connect(self):
+        if self.collection is not None:
+            return self.collection
+        if not db.MONGODB_URL:
+            return None
+        try:
+            self.client = MongoClient(db.MONGODB_URL, serverSelectionTimeoutMS=5000)
+            self.collection = ensure_collection(self.client[db.DB_NAME])
+        except Exception as e:
+            print(f"❌ Audit log could not connect: {e}")
+            self.client = None
+            self.collection = None
+        return self.collection
+
+    def _write(self, events):
+        collection = self._connect()
+        if collection is None:
+            # Spilled events are only ever replayed into a configured database
+            if db.MONGODB_URL:
+                self._spill(events)
+            else:
+                self.stats['dropped'] += len(events)
+            return False
+        try:
+            collection.insert_many(events, ordered=False)
+            self.stats['written'] += len(events)
+            return True
+        except Exception as e:
+            print(f"Error writing audit events: {e}")
+            self.stats['errors'] += 1
+            self.collection = None
+            self._spill(events)
+            return False
+
+    def _spill(self, events):
+        """Append events to this process's spill file, within the spill budget"""
+        lines = [json.dumps(dict(event, ts=event['ts'].isoformat())) + '\n' for event in events]
+        size = sum(len(line.encode('utf-8')) for line in lines)
+        if size > self.spill_bytes:
+            self.stats['dropped'] += len(events)
+            return
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with self.spill_lock:
+                self._make_room(size)
+                with open(self._spill_path(size), 'a') as f:
+                    f.writelines(lines)
+            self.stats['spilled'] += len(events)
+        except OSError as e:
+            print(f"Error spilling audit events: {e}")
+            self.stats['dropped'] += len(events)
+
+    def _spill_path(self, incoming):
+        # Rotate once the current file holds its share of the budget, so
+        # dropping the oldest file never drops everything
+        path = os.path.join(self.spill_dir, f'audit-{os.getpid()}-{self.spill_segment}.jsonl')
+        try:
+            if os.path.getsize(path) + incoming > self.spill_bytes // SPILL_SEGMENTS:
+                self.spill_segment += 1
+                path = os.path.join(self.spill_dir, f'audit-{os.getpid()}-{self.spill_segment}.jsonl')
+        except OSError:
+            pass
+        return path
+
+    def _make_room(self, incoming):
+        """
+        Delete the oldest spill files until incoming bytes fit the budget
+        Sizes come from the directory itself, so the budget holds for all
+        workers together. Files being replayed count but are left alone.
+        """
+        files = []
+        for path in glob.glob(os.path.join(self.spill_dir, 'audit-*.jsonl*')):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        used = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if used + incoming <= self.spill_bytes:
+                break
+            if '.replay-' in path:
+                continue
+            lost = _count_lines(path)
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            used -= size
+            self.stats['dropped'] += lost
+            self.stats['spill_evicted'] += lost
+
+    def _claimable(self, path, now):
+        """
+        Whether this process may replay a spill file without racing its owner
+        Files of this process or of exited ones are taken at once; those of
+        live workers only once untouched for stale_seconds (a claimed
+        file's mtime is the time it was claimed).
+        """
+        match = SPILL_NAME.search(os.path.basename(path))
+        if match is None:
+            return False
+        owner = int(match.group(2) or match.group(1))
+        if owner == os.getpid() or not _pid_alive(owner):
+            return True
+        try:
+            return now - os.path.getmtime(path) > self.stale_seconds
+        except OSError:
+            return False
+
+    def _insert_new(self, events):
+        """Insert replayed events, skipping those an earlier attempt already wrote"""
+        # Time-series collections do not enforce a unique _id, so look first
+        existing = {doc['_id'] for doc in self.collection.find(
+            {'_id': {'$in': [event['_id'] for event in events]},
+             'ts': {'$gte': min(event['ts'] for event in events), '$lte': max(event['ts'] for event in events)}},
+            {'_id': 1}
+        )}
+        fresh = [event for event in events if event['_id'] not in existing]
+        if not fresh:
+            return 0
+        try:
+            self.collection.insert_many(fresh, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            if e.details.get('writeConcernErrors') or any(error.get('code') != 11000 for error in errors):
+                raise
+            return len(fresh) - len(errors)
+        return len(fresh)
+
+    def _replay_spilled(self):
+        """Insert spilled events once the database is reachable again"""
+        if self._connect() is None:
+            return
+        # Claim the files under the lock, then insert without holding it
+        claimed = []
+        now = time.time()
+        with self.spill_lock:
+            for path in glob.glob(os.path.join(self.spill_dir, 'audit-*.jsonl*')):
+                if not self._claimable(path, now):
+                    continue
+                target = path.split('.replay-')[0] + f'.replay-{os.getpid()}'
+                try:
+                    if target != path:
+                        os.rename(path, target)
+                    os.utime(target)
+                    claimed.append(target)
+                except OSError:
+                    continue
+        for index, target in enumerate(claimed):
+            try:
+                batch = _read_spill(target)
+                for i in range(0, len(batch), self.batch_size):
+                    self.stats['replayed'] += self._insert_new(batch[i:i + self.batch_size])
+                os.remove(target)
+            except Exception as e:
+                # Put the unfinished files back under fresh names for the next attempt
+                print(f"Error replaying audit events: {e}")
+                for path in claimed[index:]:
+                    try:
+                        os.rename(path, os.path.join(self.spill_dir, f'audit-{os.getpid()}-{time.time_ns()}.jsonl'))
+                    except OSError:
+                        pass
+                self.collection = None
+                return
+
+    def _run(self):
+        last_replay = 0.0
+        while True:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+            now = time.monotonic()
+            if now - last_replay > 60:
+                last_replay = now
+                if os.path.isdir(self.spill_dir):
+                    self._replay_spilled()
+            if self.stopping and self.queue.empty():
+                return
+
+    def flush(self, timeout=5.0):
+        """Write everything queued so far (used at exit)"""
+        if self.pid != os.getpid():
+            return
+        self.stopping = True
+        self.thread.join(timeout)
+
+    def snapshot(self):
+        return dict(self.stats, queued=self.queue.qsize() if self.queue else 0)
+
+
+audit_log = AuditLog()
+atexit.register(audit_log.flush)
+
+
+def record_login(username, method, outcome, distance=None, started=None, source='web', ip=None):
+    """
+    Record a password or face login attempt
+    outcome: 'success', 'bad_password', 'no_match', 'unknown_user',
+    'no_face' or 'error'; started is a time.perf_counter() value.
+    """
+    latency_ms = (time.perf_counter() - started) * 1000 if started is not None else None
+    audit_log.record(username, method, outcome, distance=distance, latency_ms=latency_ms, source=source, ip=ip)
+
+
+def recent_events(username=None, since=None, limit=100):
+    """Read back audit events, newest first"""
+    collection = audit_log._connect()
+    if collection is None:
+        return []
+    query = {}
+    if username:
+        query['meta.username'] = username
+    query['ts'] = {'$gte': since or datetime.utcnow() - timedelta(days=1)}
+    return list(collection.find(query, {'_id': 0}).sort('ts', DESCENDING).limit(limit))
@@ -1,5 +1,8 @@
+import time
+
 import database as db
 import face_recognition_module as frm
+from audit import record_login
 
 def register_user():
     """Register new user with username and password, optionally with face"""
@@ -104,13 +107,16 @@ def password_login(username):
     """Login with password"""
     password = input("Enter password: ").strip()
     
+    started = time.perf_counter()
     if db.verify_password(username, password):
+        record_login(username, 'password', 'success', started=started, source='cli')
         print("\n" + "="*50)
         print(f"Welcome {username}!")
         print("Login successful with password")
         print("="*50)
         return username
     else:
+        record_login(username, 'password', 'bad_password', started=started, source='cli')
         print("Invalid password!")
         return None
 
@@ -128,7 +134,11 @@ def face_login(username):
         print(f"Error: {msg}")
         return None
     
-    if frm.verify_face(stored_encoding, current_encoding):
+    # Latency covers matching only, not the interactive camera session
+    started = time.perf_counter()
+    matched, distance = frm.verify_face_distance(stored_encoding, current_encoding)
+    record_login(username, 'face', 'success' if matched else 'no_match', distance, started, source='cli')
+    if matched:
         print("\n" + "="*50)
         print(f"Face matched! Welcome {username}!")
         print("Login successful with face recognition")
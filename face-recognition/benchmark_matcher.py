@@ -0,0 +1,139 @@
+import argparse
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import database as db
+from coarse_matcher import BOUND_SCALE, BOUND_SLACK, face_thumbnail
+from face_matcher import DEFAULT_THRESHOLD, QuantizedGallery
+
+DIMENSION = 100 * 100 * 3
+
+
+def synthetic_encodings(count, rng, frames=5, smooth=False):
+    """
+    Random encodings averaged over a few uint8 frames, like real captures
+    smooth=True builds them from upscaled 5x5 images instead of per-pixel
+    noise; like real faces, most of their energy is in low frequencies.
+    """
+    if smooth:
+        base = np.stack([
+            cv2.resize(rng.uniform(0, 255, (5, 5, 3)), (100, 100), interpolation=cv2.INTER_CUBIC).reshape(-1)
+            for _ in range(count)
+        ])
+        base = np.clip(base + rng.normal(0, 12, base.shape), 0, 255)
+    else:
+        base = rng.integers(0, 256, (count, DIMENSION)).astype(np.float64)
+    jitter = rng.integers(-3, 4, (count, frames, DIMENSION)).mean(axis=1)
+    return np.clip(base + jitter, 0, 255)
+
+
+def near_queries(gallery, count, rng, threshold):
+    """Queries at distances spread around the threshold from gallery rows"""
+    queries = []
+    for _ in range(count):
+        row = gallery[rng.integers(len(gallery))]
+        noise = rng.standard_normal(DIMENSION)
+        noise *= rng.uniform(0.6, 1.4) * threshold / np.linalg.norm(noise)
+        # Keep the 1/5 steps of an average over five frames
+        queries.append(np.clip(np.round((row + noise) * 5) / 5, 0, 255))
+    return queries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the uint8 face matcher against the float64 path")
+    parser.add_argument('--gallery', type=int, default=2000, help="Enrolled faces")
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--block-size', type=int, default=32)
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--smooth', action='store_true', help="Low-frequency encodings instead of pixel noise")
+    parser.add_argument('--shards', type=int, default=0, help="Also benchmark the sharded matcher with this many processes")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    print(f"Building gallery of {args.gallery} encodings...")
+    encodings = synthetic_encodings(args.gallery, rng, smooth=args.smooth)
+    stored = {f'user{i}': encodings[i].tolist() for i in range(args.gallery)}
+    keys = list(stored)
+    queries = near_queries(encodings, args.queries, rng, args.threshold)
+    query_lists = [q.tolist() for q in queries]
+
+    # Current path: compare_faces per stored list, as find_similar_faces does
+    start = time.perf_counter()
+    baseline = []
+    for query in query_lists:
+        baseline.append({key for key, enc in stored.items() if db.compare_faces(query, enc, args.threshold)})
+    list_time = (time.perf_counter() - start) / len(queries)
+
+    # Same comparisons, skipping faces their 25x25 thumbnail rules out
+    thumbs = np.stack([face_thumbnail(e) for e in encodings])
+    start = time.perf_counter()
+    prefiltered = []
+    pruned = 0
+    for query in query_lists:
+        bounds = BOUND_SCALE * np.linalg.norm(thumbs - face_thumbnail(query), axis=1) - BOUND_SLACK
+        survivors = np.nonzero(bounds < args.threshold)[0]
+        pruned += len(encodings) - len(survivors)
+        prefiltered.append({keys[i] for i in survivors if db.compare_faces(query, stored[keys[i]], args.threshold)})
+    prefilter_time = (time.perf_counter() - start) / len(queries)
+
+    # Best case float64: a resident matrix and one vectorized norm per query
+    matrix = np.asarray(encodings, dtype=np.float64)
+    start = time.perf_counter()
+    for query in queries:
+        np.linalg.norm(matrix - query, axis=1)
+    matrix_time = (time.perf_counter() - start) / len(queries)
+
+    gallery = QuantizedGallery(block_size=args.block_size, exact_loader=stored.get)
+    for key in keys:
+        gallery.add(key, stored[key])
+    start = time.perf_counter()
+    results = [{key for key, _ in gallery.search(query, args.threshold)} for query in query_lists]
+    quantized_time = (time.perf_counter() - start) / len(queries)
+
+    mismatches = sum(1 for a, b in zip(baseline, results) if a != b)
+    mismatches += sum(1 for a, b in zip(baseline, prefiltered) if a != b)
+
+    sharded_time = None
+    if args.shards:
+        from sharded_matcher import ShardedMatcher
+        matcher = ShardedMatcher(args.shards, exact_loader=stored.get)
+        try:
+            matcher.add_many(stored.items())
+            start = time.perf_counter()
+            sharded = [{key for key, _ in matcher.search(query, args.threshold)} for query in query_lists]
+            sharded_time = (time.perf_counter() - start) / len(queries)
+            shard_sizes = {name: s['size'] for name, s in matcher.snapshot()['shards'].items()}
+        finally:
+            matcher.close()
+        mismatches += sum(1 for a, b in zip(baseline, sharded) if a != b)
+    stats = gallery.snapshot()
+    matches = sum(len(r) for r in baseline)
+
+    print(f"\n{'='*60}")
+    print(f"{'path':<28}{'ms/query':>12}{'resident MB':>16}")
+    print(f"{'-'*60}")
+    print(f"{'float64 lists (current)':<28}{list_time * 1000:>12.1f}{'n/a':>16}")
+    print(f"{'thumbnail prefilter + lists':<28}{prefilter_time * 1000:>12.1f}{thumbs.nbytes / 2**20:>16.1f}")
+    print(f"{'float64 matrix':<28}{matrix_time * 1000:>12.1f}{matrix.nbytes / 2**20:>16.1f}")
+    print(f"{'uint8 blocked + re-rank':<28}{quantized_time * 1000:>12.1f}{gallery.nbytes() / 2**20:>16.1f}")
+    if sharded_time is not None:
+        label = f'{args.shards} shards scatter-gather'
+        print(f"{label:<28}{sharded_time * 1000:>12.1f}{gallery.nbytes() / 2**20 / args.shards:>13.1f}/sh")
+    print(f"{'-'*60}")
+    print(f"speedup vs lists: {list_time / quantized_time:.1f}x, vs matrix: {matrix_time / quantized_time:.1f}x, "
+          f"memory: {matrix.nbytes / max(gallery.nbytes(), 1):.1f}x smaller")
+    print(f"thumbnail prune rate: {pruned / (len(queries) * len(encodings)):.1%}")
+    print(f"matches: {matches}, re-ranked: {stats['reranked']} of {stats['compared']} comparisons")
+    if sharded_time is not None:
+        print(f"shard sizes: {shard_sizes}")
+    print(f"decision mismatches vs float64: {mismatches}")
+    print(f"{'='*60}")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
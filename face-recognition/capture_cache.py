@@ -0,0 +1,132 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+CAPTURE_CACHE_SIZE = int(os.getenv('CAPTURE_CACHE_SIZE', '256'))
+# Near-identical frames (a few bits of a 256-bit difference hash apart)
+# reuse a cached result too; off by default since they are not
+# byte-identical. Sensor noise flips ~0 bits, a 4px shift ~3, a different
+# frame of a similar scene 13 or more.
+CAPTURE_CACHE_PHASH = os.getenv('CAPTURE_CACHE_PHASH', '0') == '1'
+CAPTURE_CACHE_PHASH_BITS = int(os.getenv('CAPTURE_CACHE_PHASH_BITS', '4'))
+PHASH_SIZE = 16
+
+
+def image_digest(image_data_url):
+    """Fast content key of an uploaded data URL, computed without decoding it"""
+    return hashlib.blake2b(image_data_url.encode('ascii', 'replace'), digest_size=16).digest()
+
+
+def difference_hash(gray, size=PHASH_SIZE):
+    """dHash of size*size bits: horizontal brightness gradients of a thumbnail"""
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+class CaptureCache:
+    """
+    Bounded LRU of successful /api/capture-face results
+    Keyed by a hash of the uploaded data URL, so an exact repeat is served
+    without base64 decoding, imdecode or any cascade pass. Entries hold the
+    encoding as uint8 (30 KB rather than a list of Python ints), the preview
+    and the face box. With perceptual=True a decoded frame whose difference
+    hash is within max_distance bits of a cached one reuses its result, but
+    only within the same scope (capture session): a similar looking frame
+    must never hand out another user's encoding.
+    """
+
+    def __init__(self, max_entries=CAPTURE_CACHE_SIZE, perceptual=CAPTURE_CACHE_PHASH,
+                 max_distance=CAPTURE_CACHE_PHASH_BITS):
+        self.max_entries = max_entries
+        self.perceptual = perceptual
+        self.max_distance = max_distance
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.stats = {'hits': 0, 'near_hits': 0, 'misses': 0, 'evictions': 0, 'stored': 0}
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def _payload(entry, kind):
+        encoding, preview, bounds, detect_mode = entry[:4]
+        return {
+            'success': True,
+            'encoding': encoding.tolist(),
+            'preview': preview,
+            'face_bounds': dict(bounds),
+            'detect_mode': detect_mode,
+            'cached': kind
+        }
+
+    def get(self, image_data_url):
+        """Payload for a byte-identical frame seen before, or None"""
+        if not self.max_entries:
+            return None
+        digest = image_digest(image_data_url)
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is None:
+                if not self.perceptual:
+                    self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(digest)
+            self.stats['hits'] += 1
+        return self._payload(entry, 'exact')
+
+    def get_near(self, phash, scope=None):
+        """Payload for a decoded frame close to one cached by the same scope, or None"""
+        if not self.max_entries:
+            return None
+        with self.lock:
+            if phash is None or scope is None:
+                self.stats['misses'] += 1
+                return None
+            best = None
+            for digest, entry in self.entries.items():
+                if entry[4] is None or entry[5] != scope:
+                    continue
+                distance = bin(entry[4] ^ phash).count('1')
+                if distance <= self.max_distance and (best is None or distance < best[0]):
+                    best = (distance, digest, entry)
+            if best is None:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(best[1])
+            self.stats['near_hits'] += 1
+            entry = best[2]
+        return self._payload(entry, 'near')
+
+    def put(self, image_data_url, payload, phash=None, scope=None):
+        """Store a successful payload under the frame's content hash"""
+        if not self.max_entries or not payload.get('success'):
+            return
+        entry = (
+            np.asarray(payload['encoding'], dtype=np.uint8),
+            payload.get('preview'),
+            dict(payload['face_bounds']),
+            payload.get('detect_mode'),
+            phash,
+            scope
+        )
+        digest = image_digest(image_data_url)
+        with self.lock:
+            self.entries[digest] = entry
+            self.entries.move_to_end(digest)
+            self.stats['stored'] += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def snapshot(self):
+        with self.lock:
+            lookups = self.stats['hits'] + self.stats['near_hits'] + self.stats['misses']
+            resident = sum(entry[0].nbytes + len(entry[1] or '') for entry in self.entries.values())
+            return dict(self.stats, size=len(self.entries), max_entries=self.max_entries,
+                        perceptual=self.perceptual, resident_bytes=resident,
+                        hit_rate=round((self.stats['hits'] + self.stats['near_hits']) / lookups, 3) if lookups else None)
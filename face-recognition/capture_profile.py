@@ -0,0 +1,82 @@
+import os
+import threading
+import time
+
+import cv2
+
+# What /api/capture-face needs from a browser frame. Encodings are 100x100
+# crops of a face at least 10% of the frame (60px minimum), so 640x480
+# leaves a wide margin while cutting upload and decode cost ~3x from 720p.
+CAPTURE_MAX_WIDTH = int(os.getenv('CAPTURE_MAX_WIDTH', '640'))
+CAPTURE_MAX_HEIGHT = int(os.getenv('CAPTURE_MAX_HEIGHT', '480'))
+CAPTURE_JPEG_QUALITY = float(os.getenv('CAPTURE_JPEG_QUALITY', '0.8'))
+# Frames are turned gray on the server as well, so every encoding of a
+# deployment is computed the same way whatever the client sends. Only
+# enable this before faces are enrolled: color and gray encodings differ.
+CAPTURE_GRAYSCALE = os.getenv('CAPTURE_GRAYSCALE', '0') == '1'
+CAPTURE_FRAME_INTERVAL_MS = int(os.getenv('CAPTURE_FRAME_INTERVAL_MS', '1200'))
+# Data URL length accepted by /api/capture-face (base64 of a large JPEG)
+CAPTURE_MAX_UPLOAD_BYTES = int(os.getenv('CAPTURE_MAX_UPLOAD_BYTES', str(512 * 1024)))
+
+
+def capture_profile():
+    """Settings served to the capture pages by /api/capture-profile"""
+    return {
+        'max_width': CAPTURE_MAX_WIDTH,
+        'max_height': CAPTURE_MAX_HEIGHT,
+        'jpeg_quality': CAPTURE_JPEG_QUALITY,
+        'grayscale': CAPTURE_GRAYSCALE,
+        'frame_interval_ms': CAPTURE_FRAME_INTERVAL_MS,
+        'max_upload_bytes': CAPTURE_MAX_UPLOAD_BYTES
+    }
+
+
+def fit_frame(frame):
+    """Downscale a frame larger than the profile and apply its grayscale setting"""
+    height, width = frame.shape[:2]
+    scale = min(1.0, CAPTURE_MAX_WIDTH / float(width), CAPTURE_MAX_HEIGHT / float(height))
+    if scale < 1.0:
+        frame = cv2.resize(frame, (max(1, int(width * scale)), max(1, int(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    if CAPTURE_GRAYSCALE:
+        frame = cv2.cvtColor(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), cv2.COLOR_GRAY2BGR)
+    return frame
+
+
+def scale_box(box, scale_x, scale_y):
+    """(x, y, w, h) face box multiplied by per-axis scale factors"""
+    x, y, w, h = box
+    return (int(round(x * scale_x)), int(round(y * scale_y)),
+            max(1, int(round(w * scale_x))), max(1, int(round(h * scale_y))))
+
+
+class FrameIntervalGuard:
+    """
+    Rejects frames a session sends much faster than the advertised interval
+    Allows bursts down to a third of the interval (manual captures right
+    after an automatic one) and answers faster senders with a retry delay.
+    """
+
+    def __init__(self, interval_ms=CAPTURE_FRAME_INTERVAL_MS, ttl=600):
+        self.min_interval = interval_ms / 3000.0
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.last = {}
+        self.last_prune = time.monotonic()
+        self.rejected = 0
+
+    def check(self, key):
+        """Returns None when the frame may proceed, else seconds to wait"""
+        if not self.min_interval:
+            return None
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_prune > 60:
+                self.last_prune = now
+                self.last = {k: t for k, t in self.last.items() if now - t < self.ttl}
+            previous = self.last.get(key)
+            if previous is not None and now - previous < self.min_interval:
+                self.rejected += 1
+                return round(self.min_interval - (now - previous), 3)
+            self.last[key] = now
+            return None
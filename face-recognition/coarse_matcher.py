@@ -0,0 +1,98 @@
+import math
+import threading
+
+import numpy as np
+
+# Encodings are 100x100 BGR crops flattened row by row
+FACE_SIZE = 100
+CHANNELS = 3
+THUMB_SIZE = 25
+BLOCK = FACE_SIZE // THUMB_SIZE
+# Values averaged into one thumbnail pixel (4x4 pixels x 3 channels)
+BLOCK_VALUES = BLOCK * BLOCK * CHANNELS
+# Cauchy-Schwarz over each block: (sum of n diffs)^2 <= n * (sum of squared
+# diffs), so sqrt(n) * thumbnail distance never exceeds the full distance
+BOUND_SCALE = math.sqrt(BLOCK_VALUES)
+# Thumbnails are stored rounded to 3 decimals; this covers the rounding of
+# both sides (sqrt(48) * 2 * 0.0005 * 25 ~= 0.09) with room to spare
+BOUND_SLACK = 1.0
+
+
+def face_thumbnail(face_encoding):
+    """
+    25x25 gray thumbnail of an encoding as a flat float array
+    Each value is the plain mean of a 4x4 block over all three channels
+    (not luma weighted), which keeps the distance bound exact. Returns None
+    for encodings of another shape.
+    """
+    vector = np.asarray(face_encoding, dtype=np.float64)
+    if vector.size != FACE_SIZE * FACE_SIZE * CHANNELS:
+        return None
+    blocks = vector.reshape(THUMB_SIZE, BLOCK, THUMB_SIZE, BLOCK, CHANNELS)
+    return blocks.mean(axis=(1, 3, 4)).reshape(-1)
+
+
+def thumbnail_field(face_encoding):
+    """Thumbnail as stored next to the encoding (a list of rounded floats)"""
+    thumb = face_thumbnail(face_encoding)
+    if thumb is None:
+        return None
+    return np.round(thumb, 3).tolist()
+
+
+def distance_lower_bound(thumb_a, thumb_b):
+    """A distance the full encodings are guaranteed to be at least as far apart as"""
+    diff = np.asarray(thumb_a, dtype=np.float64) - np.asarray(thumb_b, dtype=np.float64)
+    return BOUND_SCALE * float(np.sqrt(np.dot(diff, diff))) - BOUND_SLACK
+
+
+class PrefilterStats:
+    """Counts how many candidates the thumbnail check saves a full comparison"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {'queries': 0, 'candidates': 0, 'pruned': 0, 'unsigned': 0, 'compared': 0, 'matched': 0}
+
+    def add(self, **counts):
+        with self.lock:
+            self.counts['queries'] += 1
+            for key, value in counts.items():
+                self.counts[key] += value
+
+    def snapshot(self):
+        with self.lock:
+            counts = dict(self.counts)
+        candidates = counts['candidates']
+        counts['prune_rate'] = round(counts['pruned'] / candidates, 3) if candidates else None
+        return counts
+
+
+prefilter_stats = PrefilterStats()
+
+
+def prefilter(query_thumb, candidates, threshold):
+    """
+    Split candidate documents by the thumbnail bound
+    Returns (survivors, pruned count). Documents without a face_thumb
+    (stored before thumbnails existed) always survive.
+    """
+    survivors = []
+    pruned = 0
+    if query_thumb is None:
+        return list(candidates), 0
+    thumbs = []
+    for doc in candidates:
+        if doc.get('face_thumb') is None:
+            survivors.append(doc)
+        else:
+            thumbs.append(doc)
+    if thumbs:
+        matrix = np.asarray([doc['face_thumb'] for doc in thumbs], dtype=np.float64)
+        diff = matrix - query_thumb
+        bounds = BOUND_SCALE * np.sqrt(np.einsum('ij,ij->i', diff, diff)) - BOUND_SLACK
+        for doc, bound in zip(thumbs, bounds):
+            if bound >= threshold:
+                pruned += 1
+            else:
+                survivors.append(doc)
+    return survivors, pruned
@@ -1,11 +1,18 @@
 import hashlib
-from pymongo import MongoClient
+import base64
+import json
+import re
+import time
+from pymongo import MongoClient, ASCENDING, DESCENDING, UpdateOne
 from pymongo.errors import ConnectionFailure, DuplicateKeyError
 import os
 from datetime import datetime
 import numpy as np
 import uuid
 from dotenv import load_dotenv
+import lsh
+from coarse_matcher import face_thumbnail, prefilter, prefilter_stats, thumbnail_field
+from gallery_cache import process_gallery
 
 # Load environment variables from .env
 load_dotenv()
@@ -15,13 +22,45 @@ MONGODB_URL = os.getenv('MONGODB_URI') or os.getenv('MONGODB_URL')
 DB_NAME = 'face_recognition_db'
 USERS_COLLECTION = 'users'
 FACE_INDEX_COLLECTION = 'face_index'
+# Matcher shard processes behind find_similar_faces, 0 queries LSH candidates
+FACE_MATCH_SHARDS = int(os.getenv('FACE_MATCH_SHARDS', '0'))
+# Shards of a shard host shared by every worker on the machine (see
+# sharded_matcher.py); serve.py starts one and sets these before forking
+FACE_MATCH_SHARD_ADDRESSES = os.getenv('FACE_MATCH_SHARD_ADDRESSES', '')
+FACE_MATCH_SHARD_AUTHKEY = os.getenv('FACE_MATCH_SHARD_AUTHKEY', '')
 
-if not MONGODB_URL:
-    print("❌ No MongoDB URI found. Please set MONGODB_URI in a .env file or environment variables.")
-    db = None
-    users_collection = None
-    face_index_collection = None
-else:
+# (collection, keys, options) of every index the app relies on, created by
+# both database.connect() and async_database.connect()
+INDEXES = [
+    (USERS_COLLECTION, 'username', {'unique': True}),
+    (USERS_COLLECTION, 'face_id', {}),
+    (USERS_COLLECTION, 'has_face', {}),
+    (USERS_COLLECTION, 'face_hash', {}),
+    # Multikey index over the LSH band signatures of enrolled faces
+    (USERS_COLLECTION, 'lsh_bands', {}),
+    # Keyset pagination for the admin panel, username breaks ties
+    (USERS_COLLECTION, [('created_at', ASCENDING), ('username', ASCENDING)], {}),
+    (USERS_COLLECTION, [('updated_at', ASCENDING), ('username', ASCENDING)], {}),
+    (FACE_INDEX_COLLECTION, 'face_hash', {'unique': True}),
+]
+
+client = None
+db = None
+users_collection = None
+face_index_collection = None
+
+def ensure_indexes(database):
+    """Create the indexes in INDEXES (a no-op for ones that already exist)"""
+    for name, keys, options in INDEXES:
+        database[name].create_index(keys, **options)
+
+def connect():
+    """Connect to MongoDB and set the module level collections"""
+    global client, db, users_collection, face_index_collection
+    
+    if not MONGODB_URL:
+        print("❌ No MongoDB URI found. Please set MONGODB_URI in a .env file or environment variables.")
+        return False
     try:
         client = MongoClient(MONGODB_URL, serverSelectionTimeoutMS=5000)
         # Test connection
@@ -31,17 +70,37 @@ else:
         face_index_collection = db[FACE_INDEX_COLLECTION]
         
         # Create indexes
-        users_collection.create_index('username', unique=True)
-        users_collection.create_index('face_id')
-        face_index_collection.create_index('face_hash', unique=True)
+        ensure_indexes(db)
         
         print("✅ MongoDB connected successfully!")
+        return True
     except (ConnectionFailure, Exception) as e:
         print(f"❌ MongoDB connection failed: {e}")
         print("Make sure MongoDB is running or provide MONGODB_URI environment variable")
+        client = None
         db = None
         users_collection = None
         face_index_collection = None
+        return False
+
+def reconnect():
+    """
+    Open a fresh client after fork()
+    MongoClient connection pools are not fork-safe, so each worker process
+    must create its own instead of inheriting the parent's.
+    """
+    global client
+    if client is not None:
+        try:
+            client.close()
+        except Exception:
+            pass
+        client = None
+    return connect()
+
+# Entry points that bring their own client (async_app) set this to 0
+if os.getenv('MONGODB_AUTOCONNECT', '1') != '0':
+    connect()
 
 def hash_password(password):
     """Hash password using SHA256"""
@@ -51,8 +110,20 @@ def hash_face_encoding(face_encoding):
     """Create hash of face encoding to prevent duplicates"""
     if face_encoding is None:
         return None
-    encoding_str = str(face_encoding)
-    return hashlib.md5(encoding_str.encode()).hexdigest()
+    return lsh.content_hash(face_encoding)
+
+def face_signature_fields(face_encoding):
+    """Fields derived from a face encoding that are stored with it for lookups"""
+    if face_encoding is None:
+        # An empty array keeps faceless users out of the lsh_bands index
+        # lookups, while documents without the field are pre-LSH legacy ones
+        return {'face_hash': None, 'lsh_bands': [], 'face_thumb': None}
+    return {
+        'face_hash': hash_face_encoding(face_encoding),
+        'lsh_bands': lsh.lsh_bands(face_encoding),
+        # 25x25 thumbnail that rules out distant faces without loading them
+        'face_thumb': thumbnail_field(face_encoding)
+    }
 def generate_face_id():
     """Generate unique face ID"""
     return f"face_{str(uuid.uuid4())[:8]}"
@@ -69,20 +140,77 @@ def compare_faces(encoding1, encoding2, threshold=5000):
     except:
         return False
 
-def find_similar_faces(face_encoding, threshold=5000):
-    """Find all similar faces in database"""
+def get_face_matcher():
+    """
+    The sharded in-memory matcher, or None when disabled
+    Connects to the host's shared shards when FACE_MATCH_SHARD_ADDRESSES
+    is set, otherwise starts shards for this process alone.
+    """
+    if users_collection is None:
+        return None
+    import sharded_matcher
+    if FACE_MATCH_SHARD_ADDRESSES:
+        return sharded_matcher.host_matcher(FACE_MATCH_SHARD_ADDRESSES, FACE_MATCH_SHARD_AUTHKEY)
+    if FACE_MATCH_SHARDS <= 0:
+        return None
+    return sharded_matcher.process_matcher(FACE_MATCH_SHARDS)
+
+def find_similar_faces(face_encoding, threshold=5000, exact=False):
+    """
+    Find all similar faces in database
+    By default only LSH candidates (faces sharing a band signature, plus
+    legacy faces that were never signed) are considered; exact=True
+    considers every stored face. Candidates are first checked against
+    their 25x25 thumbnail, and only those the thumbnail cannot rule out
+    have their full encoding loaded and compared. With FACE_MATCH_SHARDS
+    set, the sharded in-memory matcher is scanned instead.
+    """
     if users_collection is None or face_encoding is None:
         return []
     try:
-        all_users = users_collection.find({'face_encoding': {'$exists': True, '$ne': None}})
+        matcher = None if exact else get_face_matcher()
+        if matcher is not None:
+            matches = matcher.search(face_encoding, threshold)
+            users = users_collection.find(
+                {'username': {'$in': [username for username, _ in matches]}},
+                {'username': 1, 'face_id': 1, 'created_at': 1}
+            )
+            by_name = {user['username']: user for user in users}
+            return [{
+                'username': username,
+                'face_id': by_name[username].get('face_id', 'N/A'),
+                'created_at': by_name[username].get('created_at', 'N/A')
+            } for username, _ in matches if username in by_name]
+        if exact:
+            query = {'face_encoding': {'$exists': True, '$ne': None}}
+        else:
+            query = {'$or': [
+                {'lsh_bands': {'$in': lsh.lsh_bands(face_encoding)}},
+                {'lsh_bands': None, 'face_encoding': {'$ne': None}}
+            ]}
+        candidates = list(users_collection.find(
+            query, {'username': 1, 'face_id': 1, 'created_at': 1, 'face_thumb': 1}))
+        survivors, pruned = prefilter(face_thumbnail(face_encoding), candidates, threshold)
+        encodings = {}
+        for start in range(0, len(survivors), 500):
+            ids = [user['_id'] for user in survivors[start:start + 500]]
+            for user in users_collection.find({'_id': {'$in': ids}}, {'face_encoding': 1}):
+                encodings[user['_id']] = user.get('face_encoding')
         similar_faces = []
-        for user in all_users:
-            if compare_faces(face_encoding, user.get('face_encoding'), threshold):
+        for user in survivors:
+            if compare_faces(face_encoding, encodings.get(user['_id']), threshold):
                 similar_faces.append({
                     'username': user['username'],
                     'face_id': user.get('face_id', 'N/A'),
                     'created_at': user.get('created_at', 'N/A')
                 })
+        prefilter_stats.add(
+            candidates=len(candidates),
+            pruned=pruned,
+            unsigned=sum(1 for user in candidates if user.get('face_thumb') is None),
+            compared=len(survivors),
+            matched=len(similar_faces)
+        )
         return similar_faces
     except Exception as e:
         print(f"Error finding similar faces: {e}")
@@ -110,6 +238,22 @@ def face_exists(face_encoding):
         print(f"Error checking face: {e}")
         return None
 
+def build_user_document(username, password_hash, face_encoding=None):
+    """Build the stored user document from an already hashed password"""
+    face_id = generate_face_id() if face_encoding else None
+    
+    user_data = {
+        'username': username,
+        'password': password_hash,
+        'face_encoding': face_encoding,
+        'face_id': face_id,
+        'has_face': face_encoding is not None,
+        'created_at': datetime.utcnow(),
+        'updated_at': datetime.utcnow()
+    }
+    user_data.update(face_signature_fields(face_encoding))
+    return user_data
+
 def add_user(username, password, face_encoding=None):
     """Add new user to database"""
     if users_collection is None:
@@ -131,21 +275,11 @@ def add_user(username, password, face_encoding=None):
             return False, f"Similar face found! Already registered to: {usernames}"
     
     try:
-        face_hash = hash_face_encoding(face_encoding) if face_encoding else None
-        face_id = generate_face_id() if face_encoding else None
-        
-        user_data = {
-            'username': username,
-            'password': hash_password(password),
-            'face_encoding': face_encoding,
-            'face_hash': face_hash,
-            'face_id': face_id,
-            'has_face': face_encoding is not None,
-            'created_at': datetime.utcnow(),
-            'updated_at': datetime.utcnow()
-        }
-        
+        user_data = build_user_document(username, hash_password(password), face_encoding)
         result = users_collection.insert_one(user_data)
+        matcher = get_face_matcher() if face_encoding is not None else None
+        if matcher is not None:
+            matcher.add(username, face_encoding)
         return True, "User created successfully"
     except DuplicateKeyError:
         return False, "Username already exists"
@@ -166,18 +300,52 @@ def verify_password(username, password):
         return False
 
 def get_user_face_encoding(username):
-    """Get face encoding for user"""
+    """
+    Get face encoding for user
+    With the gallery cache enabled (GALLERY_CACHE_BYTES) encodings come back
+    as read-only float64 arrays rather than lists. A cache hit still costs
+    one database round trip for the user's face_hash unless
+    GALLERY_CACHE_TRUST is set; it saves transferring and decoding the
+    30000-value encoding, not the query. Meant for logins, where the same
+    users come back: bulk or one-off reads should use load_face_encoding.
+    """
     if users_collection is None:
         return None
     try:
-        user = users_collection.find_one({'username': username})
-        if user is None:
+        gallery = process_gallery()
+        if gallery is None:
+            return load_face_encoding(username)
+
+        def current_hash():
+            user = users_collection.find_one({'username': username}, {'face_hash': 1})
+            return user.get('face_hash') if user else None
+
+        encoding = gallery.get(username, current_hash)
+        if encoding is not None:
+            return encoding
+        user = users_collection.find_one({'username': username}, {'face_encoding': 1, 'face_hash': 1})
+        if user is None or user.get('face_encoding') is None:
             return None
-        return user.get('face_encoding')
+        return gallery.put(username, user['face_encoding'], user.get('face_hash'))
     except Exception as e:
         print(f"Error getting face encoding: {e}")
         return None
 
+def load_face_encoding(username):
+    """
+    Stored face encoding of a user, always read from the database
+    Used by the matchers' exact re-ranking, whose borderline candidates are
+    arbitrary users that would only flush the gallery cache.
+    """
+    if users_collection is None:
+        return None
+    try:
+        user = users_collection.find_one({'username': username}, {'face_encoding': 1})
+        return user.get('face_encoding') if user else None
+    except Exception as e:
+        print(f"Error loading face encoding: {e}")
+        return None
+
 def update_face_encoding(username, face_encoding):
     """Update face encoding for user"""
     if users_collection is None:
@@ -190,19 +358,23 @@ def update_face_encoding(username, face_encoding):
         return False
     
     try:
-        face_hash = hash_face_encoding(face_encoding)
+        fields = {
+            'face_encoding': face_encoding,
+            'has_face': True,
+            'updated_at': datetime.utcnow()
+        }
+        fields.update(face_signature_fields(face_encoding))
         
         result = users_collection.update_one(
             {'username': username},
-            {
-                '$set': {
-                    'face_encoding': face_encoding,
-                    'face_hash': face_hash,
-                    'has_face': True,
-                    'updated_at': datetime.utcnow()
-                }
-            }
+            {'$set': fields}
         )
+        matcher = get_face_matcher()
+        if matcher is not None and result.matched_count:
+            matcher.add(username, face_encoding)
+        gallery = process_gallery()
+        if gallery is not None:
+            gallery.discard(username)
         return result.modified_count > 0
     except Exception as e:
         print(f"Error updating face encoding: {e}")
@@ -246,17 +418,211 @@ def get_all_users():
     if users_collection is None:
         return []
     try:
-        return list(users_collection.find({}, {'password': 0, 'face_encoding': 0}))
+        return list(users_collection.find({}, {'password': 0, 'face_encoding': 0, 'face_thumb': 0}))
     except Exception as e:
         print(f"Error getting users: {e}")
         return []
 
+PAGE_SORT_FIELDS = ('username', 'created_at', 'updated_at')
+USER_COUNTS_TTL = float(os.getenv('ADMIN_COUNTS_TTL', '30'))
+_user_counts_cache = {'value': None, 'expires': 0.0}
+
+def encode_page_cursor(user, sort_field):
+    """Encode the position of a user row as an opaque page cursor"""
+    value = user.get(sort_field)
+    if isinstance(value, datetime):
+        value = {'$date': value.isoformat()}
+    raw = json.dumps([value, user['username']]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_page_cursor(cursor):
+    """Decode a page cursor, returns (sort_value, username) or None"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, username = json.loads(raw)
+        if isinstance(value, dict) and '$date' in value:
+            value = datetime.fromisoformat(value['$date'])
+        return value, username
+    except (ValueError, TypeError):
+        return None
+
+def build_users_page_query(sort='username', descending=False, prefix=None, after=None, before=None):
+    """
+    Build the find() filter and sort for one page of users
+    Returns (query, sort_spec, sort, backwards, has_position).
+    """
+    if sort not in PAGE_SORT_FIELDS:
+        sort = 'username'
+    
+    query = {}
+    if prefix:
+        # Anchored, case-sensitive prefix regexes can use the username index
+        query['username'] = {'$regex': '^' + re.escape(prefix)}
+    
+    # Paging backwards walks the index in the opposite direction
+    backwards = before is not None and after is None
+    position = decode_page_cursor(before if backwards else after) if (after or before) else None
+    ascending = descending == backwards
+    op = '$gt' if ascending else '$lt'
+    
+    conditions = [query] if query else []
+    if position is not None:
+        value, username = position
+        if sort == 'username':
+            conditions.append({'username': {op: username}})
+        else:
+            conditions.append({'$or': [
+                {sort: {op: value}},
+                {sort: value, 'username': {op: username}}
+            ]})
+    if len(conditions) > 1:
+        query = {'$and': conditions}
+    elif conditions:
+        query = conditions[0]
+    
+    direction = ASCENDING if ascending else DESCENDING
+    sort_spec = [('username', direction)] if sort == 'username' else [(sort, direction), ('username', direction)]
+    return query, sort_spec, sort, backwards, position is not None
+
+def finish_users_page(users, limit, sort, backwards, has_position):
+    """Trim a fetched page (limit + 1 rows) and compute its cursors"""
+    has_more = len(users) > limit
+    users = users[:limit]
+    if backwards:
+        users.reverse()
+    if not users:
+        return [], None, None
+    
+    first_cursor = encode_page_cursor(users[0], sort)
+    last_cursor = encode_page_cursor(users[-1], sort)
+    if backwards:
+        prev_cursor = first_cursor if has_more else None
+        next_cursor = last_cursor
+    else:
+        prev_cursor = first_cursor if has_position else None
+        next_cursor = last_cursor if has_more else None
+    return users, prev_cursor, next_cursor
+
+def get_users_page(sort='username', descending=False, prefix=None, after=None, before=None, limit=25):
+    """
+    Get one page of users using keyset (cursor) pagination
+    Returns (users, prev_cursor, next_cursor); the cursors are None when
+    there is no page in that direction. Each page is an index range scan,
+    so cost does not grow with how deep the page is.
+    """
+    if users_collection is None:
+        return [], None, None
+    query, sort_spec, sort, backwards, has_position = build_users_page_query(
+        sort, descending, prefix, after, before)
+    try:
+        users = list(users_collection.find(query, {'password': 0, 'face_encoding': 0, 'face_thumb': 0})
+                     .sort(sort_spec).limit(limit + 1))
+    except Exception as e:
+        print(f"Error getting users page: {e}")
+        return [], None, None
+    return finish_users_page(users, limit, sort, backwards, has_position)
+
+def get_user_counts(use_cache=True):
+    """Get total users and users with face, cached for ADMIN_COUNTS_TTL seconds"""
+    if users_collection is None:
+        return {'total': 0, 'with_face': 0}
+    now = time.monotonic()
+    if use_cache and _user_counts_cache['value'] is not None and now < _user_counts_cache['expires']:
+        return _user_counts_cache['value']
+    try:
+        counts = {
+            'total': users_collection.estimated_document_count(),
+            'with_face': users_collection.count_documents({'has_face': True})
+        }
+    except Exception as e:
+        print(f"Error counting users: {e}")
+        return {'total': 0, 'with_face': 0}
+    _user_counts_cache['value'] = counts
+    _user_counts_cache['expires'] = now + USER_COUNTS_TTL
+    return counts
+
+def iter_face_encodings(batch_size=500):
+    """Yield (username, face_encoding) for every user with a stored face"""
+    if users_collection is None:
+        return
+    try:
+        cursor = users_collection.find({'has_face': True}, {'username': 1, 'face_encoding': 1}, batch_size=batch_size)
+        for user in cursor:
+            if user.get('face_encoding'):
+                yield user['username'], user['face_encoding']
+    except Exception as e:
+        print(f"Error reading face encodings: {e}")
+
+def iter_faces_changed_since(since, batch_size=500):
+    """
+    Yield (username, face_encoding or None) for users written after since
+    None means the user no longer has a face. Used by the sharded matcher
+    to pick up changes made by other processes; errors are raised rather
+    than ending the iteration early, so the caller retries the same window.
+    """
+    if users_collection is None:
+        return
+    cursor = users_collection.find({'updated_at': {'$gt': since}},
+                                   {'username': 1, 'has_face': 1, 'face_encoding': 1}, batch_size=batch_size)
+    for user in cursor:
+        encoding = user.get('face_encoding') if user.get('has_face') else None
+        yield user['username'], encoding or None
+
+def count_faces():
+    """Number of users with a face, or None when it cannot be read"""
+    if users_collection is None:
+        return None
+    try:
+        return users_collection.count_documents({'has_face': True})
+    except Exception as e:
+        print(f"Error counting faces: {e}")
+        return None
+
+def iter_face_usernames(batch_size=5000):
+    """Yield the username of every user with a face (errors are raised, a partial list is never returned)"""
+    if users_collection is None:
+        return
+    cursor = users_collection.find({'has_face': True}, {'username': 1, '_id': 0}, batch_size=batch_size)
+    for user in cursor:
+        yield user['username']
+
+def backfill_face_signatures(batch_size=200, resign=False):
+    """
+    Compute face_hash, lsh_bands and face_thumb for stored faces that lack them
+    resign=True recomputes every face, e.g. after changing LSH parameters.
+    Returns the number of users updated.
+    """
+    if users_collection is None:
+        return 0
+    query = {'face_encoding': {'$ne': None}}
+    if not resign:
+        query['$or'] = [{'lsh_bands': None}, {'face_thumb': None}]
+    updated = 0
+    batch = []
+    try:
+        for user in users_collection.find(query, {'username': 1, 'face_encoding': 1}, batch_size=batch_size):
+            batch.append(UpdateOne({'_id': user['_id']}, {'$set': face_signature_fields(user['face_encoding'])}))
+            if len(batch) >= batch_size:
+                updated += users_collection.bulk_write(batch, ordered=False).modified_count
+                batch = []
+        if batch:
+            updated += users_collection.bulk_write(batch, ordered=False).modified_count
+    except Exception as e:
+        print(f"Error backfilling face signatures: {e}")
+    return updated
+
 def delete_user(username):
     """Delete a user (for testing)"""
     if users_collection is None:
         return False
     try:
         result = users_collection.delete_one({'username': username})
+        matcher = get_face_matcher()
+        if matcher is not None:
+            matcher.remove(username)
+        gallery = process_gallery()
+        if gallery is not None:
+            gallery.discard(username)
         return result.deleted_count > 0
     except Exception as e:
         print(f"Error deleting user: {e}")
@@ -0,0 +1,165 @@
+import itertools
+import os
+import threading
+import time
+
+CASCADE_NAMES = (
+    'haarcascade_frontalface_default.xml',
+    'haarcascade_frontalface_alt.xml',
+    'haarcascade_frontalface_alt2.xml',
+)
+SCALE_FACTORS = (1.1, 1.05, 1.2)
+MIN_NEIGHBORS = (5, 3, 4)
+
+# Total detectMultiScale time allowed per frame, 0 disables the budget
+DETECT_BUDGET_MS = float(os.getenv('DETECT_BUDGET_MS', '250'))
+# Weight of older observations after each new one, so the order follows
+# changes in lighting, cameras or clients
+STATS_DECAY = 0.995
+# Every Nth frame one untried-lately combination is moved to the front
+EXPLORE_EVERY = 50
+
+
+class ComboStats:
+    """Decayed attempt/success counts and latency of one parameter combination"""
+
+    __slots__ = ('cascade', 'scale', 'neighbors', 'rank', 'attempts', 'successes', 'seconds', 'total_attempts')
+
+    def __init__(self, cascade, scale, neighbors, rank):
+        self.cascade = cascade
+        self.scale = scale
+        self.neighbors = neighbors
+        # Position in the original fixed order, used to break ties
+        self.rank = rank
+        self.attempts = 0.0
+        self.successes = 0.0
+        self.seconds = 0.0
+        self.total_attempts = 0
+
+    def mean_seconds(self, fallback):
+        return self.seconds / self.attempts if self.attempts else fallback
+
+    def success_rate(self):
+        # Laplace smoothing: untried combinations start at 50%
+        return (self.successes + 1.0) / (self.attempts + 2.0)
+
+    def expected_cost(self, fallback):
+        """Expected detection time spent per successful detection"""
+        return self.mean_seconds(fallback) / self.success_rate()
+
+    def as_dict(self, fallback):
+        return {
+            'cascade': self.cascade,
+            'scale': self.scale,
+            'neighbors': self.neighbors,
+            'attempts': self.total_attempts,
+            'success_rate': round(self.success_rate(), 3),
+            'mean_ms': round(self.mean_seconds(fallback) * 1000, 2),
+            'expected_cost_ms': round(self.expected_cost(fallback) * 1000, 2)
+        }
+
+
+class DetectionStrategy:
+    """
+    Orders the cascade x scale x minNeighbors combinations by expected cost
+    Every detection pass updates the statistics of its combination, and
+    frames try combinations in increasing order of mean latency divided by
+    success rate, so the cheapest reliable one usually finds the face
+    first. A pass is skipped once it would overrun budget_ms; the first
+    pass of a frame always runs. adaptive=False keeps the fixed order
+    (still recording statistics), for comparison in evaluations.
+    """
+
+    def __init__(self, budget_ms=DETECT_BUDGET_MS, decay=STATS_DECAY, explore_every=EXPLORE_EVERY,
+                 cascades=CASCADE_NAMES, scales=SCALE_FACTORS, neighbors=MIN_NEIGHBORS, adaptive=True):
+        self.budget = budget_ms / 1000.0 if budget_ms else None
+        self.adaptive = adaptive
+        self.decay = decay
+        self.explore_every = explore_every
+        self.lock = threading.Lock()
+        self.combos = [ComboStats(c, s, n, rank)
+                       for rank, (c, s, n) in enumerate(itertools.product(cascades, scales, neighbors))]
+        self.order = list(self.combos)
+        self.frames = 0
+        self.counters = {'frames': 0, 'detected': 0, 'passes': 0, 'budget_exhausted': 0, 'seconds': 0.0}
+
+    def _fallback_seconds(self):
+        timed = [c for c in self.combos if c.attempts]
+        if not timed:
+            return 0.01
+        return sum(c.mean_seconds(0) for c in timed) / len(timed)
+
+    def _reorder(self):
+        fallback = self._fallback_seconds()
+        self.order = sorted(self.combos, key=lambda c: (c.expected_cost(fallback), c.rank))
+
+    def plan(self):
+        """Combinations to try for the next frame, best first"""
+        with self.lock:
+            self.frames += 1
+            order = list(self.order)
+            if self.adaptive and self.explore_every and self.frames % self.explore_every == 0:
+                # Refresh the estimate of the least recently measured one
+                stale = min(order[1:], key=lambda c: c.attempts)
+                order.remove(stale)
+                order.insert(0, stale)
+            return order
+
+    def record(self, combo, seconds, found):
+        with self.lock:
+            for c in self.combos:
+                c.attempts *= self.decay
+                c.successes *= self.decay
+                c.seconds *= self.decay
+            combo.attempts += 1
+            combo.successes += 1 if found else 0
+            combo.seconds += seconds
+            combo.total_attempts += 1
+            self.counters['passes'] += 1
+            if self.adaptive:
+                self._reorder()
+
+    def detect(self, get_cascade, detect):
+        """
+        Run detection passes on one frame until one finds a face
+        detect(cascade, scale, neighbors) runs a single pass; returns the
+        first non-empty result or [].
+        """
+        start = time.perf_counter()
+        result = []
+        exhausted = False
+        fallback = self._fallback_seconds()
+        for index, combo in enumerate(self.plan()):
+            elapsed = time.perf_counter() - start
+            if self.budget is not None and index > 0 and \
+                    elapsed + combo.mean_seconds(fallback) > self.budget:
+                exhausted = True
+                break
+            pass_start = time.perf_counter()
+            detected = detect(get_cascade(combo.cascade), combo.scale, combo.neighbors)
+            found = len(detected) > 0
+            self.record(combo, time.perf_counter() - pass_start, found)
+            if found:
+                result = detected
+                break
+        with self.lock:
+            self.counters['frames'] += 1
+            self.counters['detected'] += 1 if len(result) else 0
+            self.counters['budget_exhausted'] += 1 if exhausted else 0
+            self.counters['seconds'] += time.perf_counter() - start
+        return result
+
+    def snapshot(self):
+        """Counters and the current order with per-combination statistics"""
+        with self.lock:
+            fallback = self._fallback_seconds()
+            frames = self.counters['frames']
+            return {
+                'frames': frames,
+                'detection_rate': round(self.counters['detected'] / frames, 3) if frames else None,
+                'mean_passes': round(self.counters['passes'] / frames, 2) if frames else None,
+                'mean_ms': round(self.counters['seconds'] / frames * 1000, 2) if frames else None,
+                'budget_ms': self.budget * 1000 if self.budget is not None else None,
+                'budget_exhausted': self.counters['budget_exhausted'],
+                'order': [c.as_dict(fallback) for c in self.order]
+            }
@@ -0,0 +1,319 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import face_recognition_module as frm
+from detection_strategy import DETECT_BUDGET_MS, DetectionStrategy
+from frame_sources import IMAGE_EXTENSIONS
+from synthetic_faces import synthetic_face
+
+# Encodings of the production pipeline: 100x100 color crops
+REFERENCE_VALUES = 100 * 100 * 3
+
+
+def load_dataset(path):
+    """
+    Labeled images from a directory with one subdirectory per person
+    Returns [(person, name, encoded image bytes)]; files are decoded later
+    so decoding is timed like an upload.
+    """
+    samples = []
+    for person in sorted(os.listdir(path)):
+        folder = os.path.join(path, person)
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                with open(os.path.join(folder, name), 'rb') as f:
+                    samples.append((person, name, f.read()))
+    return samples
+
+
+def synthetic_dataset(people, shots, width=1280, height=720, seed=0):
+    """Several shots of each synthetic face, shifted, scaled and relit a little"""
+    rng = np.random.default_rng(seed)
+    samples = []
+    for person in range(people):
+        base = synthetic_face(seed + person, width, height)
+        for shot in range(shots):
+            scale = rng.uniform(0.95, 1.05)
+            matrix = cv2.getRotationMatrix2D((width / 2, height / 2), rng.uniform(-3, 3), scale)
+            matrix[:, 2] += rng.integers(-20, 21, 2)
+            img = cv2.warpAffine(base, matrix, (width, height), borderMode=cv2.BORDER_REPLICATE)
+            img = img.astype(np.int16) + int(rng.integers(-15, 16)) + rng.integers(-6, 7, img.shape)
+            _, jpg = cv2.imencode('.jpg', np.clip(img, 0, 255).astype(np.uint8), [cv2.IMWRITE_JPEG_QUALITY, 90])
+            samples.append((f'person{person:03d}', f'shot{shot}.jpg', jpg.tobytes()))
+    return samples
+
+
+def parse_list(kind):
+    def parse(value):
+        return [kind(item) for item in value.split(',') if item.strip()]
+    return parse
+
+
+def detect_samples(samples, width, order):
+    """
+    Decode, resize and detect every sample for one detection setting
+    Returns per-sample (person, face crop or None, timings) where the crop
+    is the 100x100 color face extract_face produces.
+    """
+    # The fixed order is the one used before adaptive ordering, without a budget
+    adaptive = order == 'adaptive'
+    strategy = DetectionStrategy(budget_ms=DETECT_BUDGET_MS if adaptive else 0, adaptive=adaptive)
+    results = []
+    for person, _, data in samples:
+        timings = {}
+        start = time.perf_counter()
+        frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        timings['decode'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if width and frame.shape[1] > width:
+            height = max(1, int(frame.shape[0] * width / float(frame.shape[1])))
+            frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+        timings['resize'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        gray = cv2.equalizeHist(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+        faces = frm.detect_faces(gray, strategy=strategy)
+        timings['detect'] = time.perf_counter() - start
+
+        crop = None
+        start = time.perf_counter()
+        if len(faces):
+            x, y, w, h = sorted(faces, key=lambda f: f[2] * f[3], reverse=True)[0]
+            min_face_size = min(frame.shape[0], frame.shape[1]) * 0.1
+            if w >= min_face_size and h >= min_face_size:
+                crop, _ = frm.extract_face(frame, (x, y, w, h))
+        timings['crop'] = time.perf_counter() - start
+        results.append((person, crop, timings))
+    return results
+
+
+def encode(crop, size, gray, bits):
+    """Encoding of a 100x100 crop under one encoding setting, as float64"""
+    if size != 100:
+        crop = cv2.resize(crop, (size, size), interpolation=cv2.INTER_AREA)
+    if gray:
+        crop = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    return quantize(crop.astype(np.float64).reshape(-1), bits)
+
+
+def quantize(values, bits):
+    """
+    Keep the top bits of each 0-255 value, at the middle of its bucket
+    bits >= 8 leaves values untouched: the pipeline as it runs today, with
+    float templates compared exactly by verify_face.
+    """
+    if bits >= 8:
+        return values
+    step = 2 ** (8 - bits)
+    return np.floor(values / step) * step + step / 2.0
+
+
+def error_curve(genuine, impostor, genuine_failures, impostor_failures):
+    """
+    False accept and false reject rates at every candidate threshold
+    A comparison accepts when distance < threshold, as in verify_face.
+    Probes without an encoding reject: a false reject for their own
+    template, a correct reject for every other one.
+    """
+    genuine = np.sort(np.asarray(genuine, dtype=np.float64))
+    impostor = np.sort(np.asarray(impostor, dtype=np.float64))
+    genuine_total = len(genuine) + genuine_failures
+    impostor_total = len(impostor) + impostor_failures
+    # Accept sets only change just above an observed distance
+    thresholds = np.unique(np.concatenate(([0.0], np.nextafter(np.concatenate((genuine, impostor)), np.inf))))
+    far = np.searchsorted(impostor, thresholds, side='left') / max(1, impostor_total)
+    frr = 1.0 - np.searchsorted(genuine, thresholds, side='left') / max(1, genuine_total)
+    return thresholds, far, frr
+
+
+def rates_at(thresholds, far, frr, threshold):
+    index = max(0, np.searchsorted(thresholds, threshold, side='right') - 1)
+    return float(far[index]), float(frr[index])
+
+
+def summarize_errors(thresholds, far, frr, max_far=None):
+    """Best threshold (least FAR + FRR, or least FRR within max_far) and the equal error rate"""
+    if max_far is not None:
+        allowed = np.nonzero(far <= max_far)[0]
+        best = allowed[np.argmin(frr[allowed])] if len(allowed) else 0
+    else:
+        best = int(np.argmin(far + frr))
+    eer_index = int(np.argmin(np.abs(far - frr)))
+    return {
+        'best_threshold': round(float(thresholds[best]), 1),
+        'far': round(float(far[best]), 4),
+        'frr': round(float(frr[best]), 4),
+        'eer': round(float((far[eer_index] + frr[eer_index]) / 2), 4)
+    }
+
+
+def evaluate(detected, size, gray, bits, enroll, max_far=None):
+    """Enroll the first shots of each person, score the rest against every template"""
+    encode_seconds = []
+    encodings = {}
+    for person, crop, _ in detected:
+        if crop is None:
+            encodings.setdefault(person, []).append(None)
+            continue
+        start = time.perf_counter()
+        encodings.setdefault(person, []).append(encode(crop, size, gray, bits))
+        encode_seconds.append(time.perf_counter() - start)
+
+    templates = {}
+    probes = []
+    for person, values in encodings.items():
+        enrolled = [v for v in values[:enroll] if v is not None]
+        if enrolled:
+            # Registration stores the float mean of its frames; only a
+            # reduced-bit gallery quantizes the template as well
+            templates[person] = quantize(np.mean(enrolled, axis=0), bits)
+        probes.extend((person, v) for v in values[enroll:])
+
+    genuine, impostor = [], []
+    genuine_failures = impostor_failures = 0
+    compare_seconds = 0.0
+    comparisons = 0
+    for person, probe in probes:
+        for owner, template in templates.items():
+            if probe is None:
+                if owner == person:
+                    genuine_failures += 1
+                else:
+                    impostor_failures += 1
+                continue
+            start = time.perf_counter()
+            distance = float(np.linalg.norm(template - probe))
+            compare_seconds += time.perf_counter() - start
+            comparisons += 1
+            (genuine if owner == person else impostor).append(distance)
+
+    thresholds, far, frr = error_curve(genuine, impostor, genuine_failures, impostor_failures)
+    # verify_face's threshold, scaled with the encoding length
+    values = (size * size) * (1 if gray else 3)
+    production = frm.FACE_MATCH_THRESHOLD * (values / float(REFERENCE_VALUES)) ** 0.5
+    prod_far, prod_frr = rates_at(thresholds, far, frr, production)
+    summary = summarize_errors(thresholds, far, frr, max_far)
+    summary.update({
+        'enrolled': len(templates),
+        'genuine': len(genuine) + genuine_failures,
+        'impostor': len(impostor) + impostor_failures,
+        'production_threshold': round(production, 1),
+        'production_far': round(prod_far, 4),
+        'production_frr': round(prod_frr, 4),
+        'encode_ms': 1000 * float(np.mean(encode_seconds)) if encode_seconds else 0.0,
+        'compare_us': 1e6 * compare_seconds / comparisons if comparisons else 0.0
+    })
+    return summary, (thresholds, far, frr)
+
+
+def pareto_frontier(rows, cost='total_ms', error='error'):
+    """Rows no other row beats on both latency and error"""
+    frontier = []
+    for row in rows:
+        dominated = any(
+            other[cost] <= row[cost] and other[error] <= row[error] and
+            (other[cost] < row[cost] or other[error] < row[error])
+            for other in rows
+        )
+        if not dominated:
+            frontier.append(row)
+    return sorted(frontier, key=lambda r: r[cost])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Replay labeled face images through pipeline configurations and compare accuracy with latency")
+    parser.add_argument('dataset', nargs='?',
+                        help="Directory with one subdirectory of images per person (default: synthetic faces)")
+    parser.add_argument('--people', type=int, default=12, help="Synthetic people")
+    parser.add_argument('--shots', type=int, default=4, help="Synthetic images per person")
+    parser.add_argument('--enroll', type=int, default=1, help="Images per person averaged into the template")
+    parser.add_argument('--widths', type=parse_list(int), default=[0, 640, 320],
+                        help="Detection widths to try, 0 keeps the original size")
+    parser.add_argument('--orders', type=parse_list(str), default=['adaptive', 'fixed'],
+                        help="Cascade orders: adaptive and/or fixed")
+    parser.add_argument('--sizes', type=parse_list(int), default=[100, 50, 25], help="Encoded face sizes")
+    parser.add_argument('--gray', type=parse_list(int), default=[0, 1], help="0 keeps color, 1 encodes gray")
+    parser.add_argument('--bits', type=parse_list(int), default=[8, 4],
+                        help="Bits kept per value of templates and probes; 8 is today's float comparison")
+    parser.add_argument('--max-far', type=float, help="Pick the threshold with the least FRR within this FAR")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="Write every configuration, the frontier and the FAR/FRR curves here")
+    args = parser.parse_args(argv)
+
+    if any(order not in ('adaptive', 'fixed') for order in args.orders):
+        parser.error("--orders takes adaptive and/or fixed")
+    if args.dataset:
+        if not os.path.isdir(args.dataset):
+            print(f"Error: {args.dataset} is not a directory")
+            return 1
+        samples = load_dataset(args.dataset)
+        source = args.dataset
+    else:
+        samples = synthetic_dataset(args.people, args.shots, seed=args.seed)
+        source = f'synthetic ({args.people} people x {args.shots} shots)'
+    if not samples:
+        print(f"Error: no images found in {args.dataset}")
+        return 1
+    frm.preload_cascades()
+
+    rows = []
+    curves = {}
+    for width, order in itertools.product(args.widths, args.orders):
+        detected = detect_samples(samples, width, order)
+        found = sum(1 for _, crop, _ in detected if crop is not None)
+        stage_ms = {stage: 1000 * float(np.mean([t[stage] for _, _, t in detected]))
+                    for stage in ('decode', 'resize', 'detect', 'crop')}
+        for size, gray, bits in itertools.product(args.sizes, args.gray, args.bits):
+            summary, curve = evaluate(detected, size, gray, bits, max(1, args.enroll), args.max_far)
+            name = f"w={width or 'orig'} {order} {size}px{' gray' if gray else ''} {'float' if bits >= 8 else f'{bits}bit'}"
+            row = dict(summary, config=name, width=width, order=order, size=size, gray=bool(gray), bits=bits,
+                       detect_rate=round(found / len(detected), 3), stages_ms={k: round(v, 2) for k, v in stage_ms.items()})
+            row['total_ms'] = round(sum(stage_ms.values()) + summary['encode_ms'], 2)
+            row['error'] = round(row['far'] + row['frr'], 4)
+            rows.append(row)
+            curves[name] = [[round(float(t), 1), round(float(a), 4), round(float(r), 4)] for t, a, r in zip(*curve)]
+
+    frontier = pareto_frontier(rows)
+    on_frontier = {row['config'] for row in frontier}
+
+    print(f"\n{'='*115}")
+    print(f"dataset: {source}, {len(samples)} images, enroll {args.enroll} per person")
+    print(f"{'configuration':<33}{'found':>7}{'decode':>8}{'resize':>8}{'detect':>8}{'encode':>8}"
+          f"{'total':>8}{'best thr':>10}{'FAR':>7}{'FRR':>7}{'EER':>7}{'prod FAR/FRR':>14}")
+    print(f"{'':<33}{'':>7}{'ms':>8}{'ms':>8}{'ms':>8}{'ms':>8}{'ms':>8}")
+    print('-' * 115)
+    for row in sorted(rows, key=lambda r: r['total_ms']):
+        stages = row['stages_ms']
+        mark = '*' if row['config'] in on_frontier else ' '
+        print(f"{mark}{row['config']:<32}{row['detect_rate']:>7.0%}{stages['decode']:>8.2f}{stages['resize']:>8.2f}"
+              f"{stages['detect']:>8.1f}{stages['crop'] + row['encode_ms']:>8.2f}{row['total_ms']:>8.1f}"
+              f"{row['best_threshold']:>10.0f}{row['far']:>7.3f}{row['frr']:>7.3f}{row['eer']:>7.3f}"
+              f"{row['production_far']:>7.3f}/{row['production_frr']:<6.3f}")
+    print('-' * 115)
+    print("* Pareto frontier (no configuration is both faster and more accurate):")
+    for row in frontier:
+        print(f"  {row['config']:<32} {row['total_ms']:>8.1f} ms/image  FAR+FRR {row['error']:.3f}"
+              f"  threshold {row['best_threshold']:.0f}")
+    print(f"{'='*115}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'dataset': source, 'configurations': rows,
+                       'frontier': [row['config'] for row in frontier], 'curves': curves}, f, indent=2)
+        print(f"wrote {args.json}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
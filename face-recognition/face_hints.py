@@ -0,0 +1,61 @@
+import threading
+import time
+
+# A box older than this is unlikely to still frame the face
+HINT_TTL = 5.0
+
+
+def parse_face_bounds(value):
+    """Validate a client-sent face_bounds dict, returns (x, y, w, h) or None"""
+    if not isinstance(value, dict):
+        return None
+    try:
+        box = tuple(int(value[k]) for k in ('x', 'y', 'w', 'h'))
+    except (KeyError, TypeError, ValueError):
+        return None
+    x, y, w, h = box
+    if x < 0 or y < 0 or w <= 0 or h <= 0:
+        return None
+    return box
+
+
+class FaceBoxHints:
+    """
+    Last face box found for each capture session
+    Consecutive auto-captured frames from one browser show the face in
+    nearly the same place, so the previous box tells detection where to
+    look first. State is per process, like CaptureAdmission.
+    """
+
+    def __init__(self, ttl=HINT_TTL, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.boxes = {}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.boxes.get(key)
+            if entry is None:
+                return None
+            box, stamp = entry
+            if time.monotonic() - stamp > self.ttl:
+                del self.boxes[key]
+                return None
+            return box
+
+    def put(self, key, bounds):
+        box = parse_face_bounds(bounds)
+        if box is None:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if len(self.boxes) >= self.max_entries and key not in self.boxes:
+                expired = [k for k, (_, stamp) in self.boxes.items() if now - stamp > self.ttl]
+                for k in expired or [min(self.boxes, key=lambda k: self.boxes[k][1])]:
+                    del self.boxes[k]
+            self.boxes[key] = (box, now)
+
+    def discard(self, key):
+        with self.lock:
+            self.boxes.pop(key, None)
@@ -0,0 +1,197 @@
+import threading
+
+import numpy as np
+
+DEFAULT_THRESHOLD = 5000
+BLOCK_SIZE = 32
+
+
+def quantize(face_encoding):
+    """
+    Round an encoding to uint8
+    Returns (quantized vector, norm of the rounding error). Encodings are
+    averages of 8-bit pixels, so the error is at most 0.5 per value.
+    """
+    vector = np.asarray(face_encoding, dtype=np.float64)
+    quantized = np.clip(np.rint(vector), 0, 255).astype(np.uint8)
+    error = float(np.linalg.norm(vector - quantized))
+    return quantized, error
+
+
+class QuantizedGallery:
+    """
+    In-memory gallery of face encodings stored as uint8
+    Squared L2 distances are accumulated in int32 over blocks of rows small
+    enough to stay in cache. Every vector keeps the norm of its rounding
+    error, so by the triangle inequality the exact distance lies within
+    quantized distance +/- (error_a + error_b). Only pairs whose bound
+    straddles the threshold are re-ranked with the exact float encoding
+    from exact_loader(key), which keeps match decisions identical to
+    comparing the original float64 encodings.
+    """
+
+    def __init__(self, dimension=None, block_size=BLOCK_SIZE, exact_loader=None, capacity=64):
+        self.dimension = dimension
+        self.block_size = block_size
+        self.exact_loader = exact_loader
+        self.lock = threading.RLock()
+        self.keys = []
+        self.rows = {}
+        self.count = 0
+        self.vectors = None
+        self.errors = None
+        self.capacity = capacity
+        self.stats = {'searches': 0, 'compared': 0, 'reranked': 0}
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def nbytes(self):
+        """Resident bytes of the quantized vectors and error norms"""
+        if self.vectors is None:
+            return 0
+        return self.count * (self.dimension + 8)
+
+    def _ensure_capacity(self, needed):
+        if self.vectors is None:
+            self.capacity = max(self.capacity, needed)
+            self.vectors = np.empty((self.capacity, self.dimension), dtype=np.uint8)
+            self.errors = np.empty(self.capacity, dtype=np.float64)
+        elif needed > self.capacity:
+            self.capacity = max(needed, self.capacity * 2)
+            vectors = np.empty((self.capacity, self.dimension), dtype=np.uint8)
+            vectors[:self.count] = self.vectors[:self.count]
+            errors = np.empty(self.capacity, dtype=np.float64)
+            errors[:self.count] = self.errors[:self.count]
+            self.vectors, self.errors = vectors, errors
+
+    def add(self, key, face_encoding):
+        """Add or replace the encoding stored under key"""
+        quantized, error = quantize(face_encoding)
+        self.add_quantized(key, quantized, error)
+
+    def add_quantized(self, key, quantized, error):
+        """Add or replace an already quantized row"""
+        with self.lock:
+            if self.dimension is None:
+                self.dimension = quantized.shape[0]
+            elif quantized.shape[0] != self.dimension:
+                raise ValueError(f"Expected encoding of length {self.dimension}, got {quantized.shape[0]}")
+            row = self.rows.get(key)
+            if row is None:
+                self._ensure_capacity(self.count + 1)
+                row = self.count
+                self.rows[key] = row
+                self.keys.append(key)
+                self.count += 1
+            self.vectors[row] = quantized
+            self.errors[row] = error
+
+    def export_rows(self, keys):
+        """Copy out the quantized rows of keys, returns (keys, vectors, errors)"""
+        with self.lock:
+            found = [key for key in keys if key in self.rows]
+            rows = [self.rows[key] for key in found]
+            if not rows:
+                return [], np.empty((0, self.dimension or 0), dtype=np.uint8), np.empty(0)
+            return found, self.vectors[rows].copy(), self.errors[rows].copy()
+
+    def import_rows(self, keys, vectors, errors):
+        """Add rows produced by export_rows"""
+        for key, quantized, error in zip(keys, vectors, errors):
+            self.add_quantized(key, quantized, float(error))
+
+    def remove(self, key):
+        """Remove key, moving the last row into its slot"""
+        with self.lock:
+            row = self.rows.pop(key, None)
+            if row is None:
+                return False
+            last = self.count - 1
+            if row != last:
+                moved = self.keys[last]
+                self.vectors[row] = self.vectors[last]
+                self.errors[row] = self.errors[last]
+                self.keys[row] = moved
+                self.rows[moved] = row
+            self.keys.pop()
+            self.count -= 1
+            return True
+
+    def squared_distances(self, quantized):
+        """Integer squared L2 distance from a uint8 query to every row"""
+        count = self.count
+        out = np.empty(count, dtype=np.int64)
+        # 30000 dims * 255**2 fits in int32; longer vectors need int64
+        acc = np.int32 if self.dimension * 255 * 255 < 2 ** 31 else np.int64
+        query = quantized.astype(np.int16)
+        for start in range(0, count, self.block_size):
+            end = min(start + self.block_size, count)
+            diff = self.vectors[start:end].astype(np.int16) - query
+            out[start:end] = np.einsum('ij,ij->i', diff, diff, dtype=acc)
+        return out
+
+    def exact_distance(self, key, query):
+        """Exact float distance to the original encoding of key"""
+        loader = self.exact_loader
+        if loader is None:
+            import database as db
+            loader = db.load_face_encoding
+        stored = loader(key)
+        if stored is None:
+            return None
+        return float(np.linalg.norm(np.asarray(stored, dtype=np.float64) - query))
+
+    def candidates(self, quantized, query_error, threshold=DEFAULT_THRESHOLD, limit=None):
+        """
+        Classify rows against a quantized query without touching exact encodings
+        Returns (sure, borderline) lists of (key, quantized distance): sure
+        rows match whatever their exact distance, borderline rows need
+        exact_distance to decide. limit keeps only the closest sure rows.
+        """
+        with self.lock:
+            if self.count == 0 or quantized.shape[0] != self.dimension:
+                return [], []
+            distances = np.sqrt(self.squared_distances(quantized))
+            bounds = self.errors[:self.count] + query_error
+            keys = list(self.keys)
+            self.stats['searches'] += 1
+            self.stats['compared'] += self.count
+
+        # Tiny slack covers float rounding in the bounds themselves
+        slack = threshold * 1e-9
+        sure = np.nonzero(distances + bounds < threshold - slack)[0]
+        borderline = np.nonzero((distances + bounds >= threshold - slack) &
+                                (distances - bounds < threshold + slack))[0]
+        if limit is not None and len(sure) > limit:
+            sure = sure[np.argsort(distances[sure], kind='stable')[:limit]]
+        return ([(keys[i], float(distances[i])) for i in sure],
+                [(keys[i], float(distances[i])) for i in borderline])
+
+    def search(self, face_encoding, threshold=DEFAULT_THRESHOLD):
+        """
+        Find every key whose encoding is closer than threshold
+        Returns [(key, distance)] sorted by distance; distances are exact for
+        re-ranked rows and quantized approximations otherwise.
+        """
+        query = np.asarray(face_encoding, dtype=np.float64)
+        quantized, query_error = quantize(query)
+        sure, borderline = self.candidates(quantized, query_error, threshold)
+
+        matches = list(sure)
+        for key, _ in borderline:
+            exact = self.exact_distance(key, query)
+            if exact is not None and exact < threshold:
+                matches.append((key, exact))
+        with self.lock:
+            self.stats['reranked'] += len(borderline)
+        matches.sort(key=lambda m: m[1])
+        return matches
+
+    def snapshot(self):
+        """Counters and memory use for monitoring"""
+        with self.lock:
+            return dict(self.stats, size=self.count, resident_bytes=self.nbytes())
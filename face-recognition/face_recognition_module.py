@@ -1,30 +1,74 @@
 import cv2
 import numpy as np
+import base64
 import pickle
 import os
+import threading
+import profiling
+from frame_sources import CameraSource, open_source
+from detection_strategy import CASCADE_NAMES, DetectionStrategy
+from capture_cache import difference_hash
+from capture_profile import fit_frame, scale_box
+
+# Skip all preview windows (servers, replay and benchmarks)
+HEADLESS = os.getenv('FACE_HEADLESS', '0') == '1'
+
+# Maximum Euclidean distance between encodings of the same person
+FACE_MATCH_THRESHOLD = 5000
 
 # Haarcascade for face detection
 face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
 
-def capture_face_encoding(username, mode='register'):
+# Loaded classifiers, kept per thread since detectMultiScale is not
+# guaranteed to be thread-safe on a shared CascadeClassifier
+_cascades = threading.local()
+# Classifiers loaded ahead of use by preload_cascades, handed out to the
+# first threads that need them (each one is then owned by that thread)
+_spare_cascades = {}
+_spare_lock = threading.Lock()
+
+def load_cascade(name):
+    cascade = cv2.CascadeClassifier(cv2.data.haarcascades + name)
+    if cascade.empty():
+        raise RuntimeError(f"Failed to load cascade {name}")
+    return cascade
+
+def get_cascade(name):
+    """Return a loaded Haar cascade by file name, loading it once per thread"""
+    cache = getattr(_cascades, 'cache', None)
+    if cache is None:
+        cache = _cascades.cache = {}
+    cascade = cache.get(name)
+    if cascade is None:
+        with _spare_lock:
+            spares = _spare_cascades.get(name)
+            cascade = spares.pop() if spares else None
+        if cascade is None:
+            cascade = load_cascade(name)
+        cache[name] = cascade
+    return cascade
+
+def preload_cascades(copies=1):
+    """
+    Load the cascades used by the web app before the first request
+    Threads cannot share a classifier, so copies sets are parked in a
+    process-wide pool and the first threads to detect a face each take one
+    (serve.py preloads one set per request thread).
+    """
+    with _spare_lock:
+        for name in CASCADE_NAMES:
+            spares = _spare_cascades.setdefault(name, [])
+            while len(spares) < copies:
+                spares.append(load_cascade(name))
+
+@profiling.profiled('capture_session')
+def capture_face_encoding(username, mode='register', source=None, headless=None):
     """
     Capture face images and create encoding for user
     mode: 'register' for new face, 'login' for verification
+    source: frame source or spec (see frame_sources.open_source), camera 0 by default
+    headless: skip all preview windows, defaults to FACE_HEADLESS
     """
-    cap = cv2.VideoCapture(0)
-    
-    if not cap.isOpened():
-        return None, "Camera not found"
-    
-    # Set higher resolution
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
-    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-    
-    face_encodings = []
-    frame_count = 0
-    required_frames = 5
-    
     print(f"\n{'='*50}")
     if mode == 'register':
         print(f"REGISTERING FACE FOR: {username}")
@@ -35,66 +79,95 @@ def capture_face_encoding(username, mode='register'):
     print(f"{'='*50}")
     print("Press 'q' to quit\n")
     
-    while True:
-        ret, frame = cap.read()
-        
-        if not ret:
-            return None, "Failed to read camera"
-        
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        # Equalize histogram for better detection
-        gray = cv2.equalizeHist(gray)
-        
-        # Try primary cascade with more sensitive settings
-        faces = face_cascade.detectMultiScale(gray, scaleFactor=1.05, minNeighbors=3, minSize=(30, 30))
-        
-        # If no faces found, try alternative cascade
-        if len(faces) == 0:
-            faces = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_alt.xml').detectMultiScale(
-                gray, scaleFactor=1.05, minNeighbors=3, minSize=(30, 30))
-        
-        frame_with_text = frame.copy()
-        
-        if len(faces) > 0:
-            # Get largest face
-            faces = sorted(faces, key=lambda x: x[2] * x[3], reverse=True)
-            x, y, w, h = faces[0]
+    return run_capture_session(
+        source,
+        required_frames=5 if mode == 'register' else 3,
+        window_name='Face Capture',
+        no_face_message="No face detected - Move closer or check lighting",
+        cancel_message="Capture cancelled",
+        headless=headless
+    )
+
+def run_capture_session(source, required_frames, window_name, no_face_message, cancel_message, headless=None):
+    """
+    Read frames until required_frames faces were captured, then average them
+    Returns (encoding, message) like capture_face_encoding.
+    """
+    if headless is None:
+        headless = HEADLESS
+    source = open_source(source)
+    
+    if not source.open():
+        source.release()
+        return None, f"{source.name} not found"
+    
+    face_encodings = []
+    frame_count = 0
+    
+    try:
+        while True:
+            ret, frame = source.read()
             
-            cv2.rectangle(frame_with_text, (x, y), (x + w, y + h), (0, 255, 0), 2)
-            cv2.putText(frame_with_text, f"Frames: {frame_count}/{required_frames}", 
-                       (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+            if not ret:
+                if face_encodings and not isinstance(source, CameraSource):
+                    # A finite source ran out; use what was captured
+                    break
+                return None, "Failed to read camera" if isinstance(source, CameraSource) else "No face captured"
             
-            # Extract face region with padding and create encoding
-            padding = 20
-            x = max(0, x - padding)
-            y = max(0, y - padding)
-            w = min(frame.shape[1] - x, w + 2 * padding)
-            h = min(frame.shape[0] - y, h + 2 * padding)
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            # Equalize histogram for better detection
+            gray = cv2.equalizeHist(gray)
             
-            face_roi = frame[y:y+h, x:x+w]
-            face_data = cv2.resize(face_roi, (100, 100))
-            encoding = face_data.flatten().tolist()
-            face_encodings.append(encoding)
-            frame_count += 1
-        else:
-            cv2.putText(frame_with_text, "No face detected - Move closer or check lighting", 
-                       (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-        
-        cv2.imshow('Face Capture', frame_with_text)
-        
-        key = cv2.waitKey(1) & 0xFF
-        if key == ord('q'):
-            cap.release()
+            # Try primary cascade with more sensitive settings
+            faces = face_cascade.detectMultiScale(gray, scaleFactor=1.05, minNeighbors=3, minSize=(30, 30))
+            
+            # If no faces found, try alternative cascade
+            if len(faces) == 0:
+                faces = get_cascade('haarcascade_frontalface_alt.xml').detectMultiScale(
+                    gray, scaleFactor=1.05, minNeighbors=3, minSize=(30, 30))
+            
+            if not headless:
+                frame_with_text = frame.copy()
+            
+            if len(faces) > 0:
+                # Get largest face
+                faces = sorted(faces, key=lambda x: x[2] * x[3], reverse=True)
+                x, y, w, h = faces[0]
+                
+                if not headless:
+                    cv2.rectangle(frame_with_text, (x, y), (x + w, y + h), (0, 255, 0), 2)
+                    cv2.putText(frame_with_text, f"Frames: {frame_count}/{required_frames}", 
+                               (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+                
+                # Extract face region with padding and create encoding
+                padding = 20
+                x = max(0, x - padding)
+                y = max(0, y - padding)
+                w = min(frame.shape[1] - x, w + 2 * padding)
+                h = min(frame.shape[0] - y, h + 2 * padding)
+                
+                face_roi = frame[y:y+h, x:x+w]
+                face_data = cv2.resize(face_roi, (100, 100))
+                encoding = face_data.flatten().tolist()
+                face_encodings.append(encoding)
+                frame_count += 1
+            elif not headless:
+                cv2.putText(frame_with_text, no_face_message, 
+                           (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+            
+            if not headless:
+                cv2.imshow(window_name, frame_with_text)
+                
+                key = cv2.waitKey(1) & 0xFF
+                if key == ord('q'):
+                    return None, cancel_message
+            
+            if frame_count >= required_frames:
+                break
+    finally:
+        source.release()
+        if not headless:
             cv2.destroyAllWindows()
-            return None, "Capture cancelled"
-        
-        if mode == 'register' and frame_count >= required_frames:
-            break
-        elif mode == 'login' and frame_count >= 3:
-            break
-    
-    cap.release()
-    cv2.destroyAllWindows()
     
     if len(face_encodings) == 0:
         return None, "No face captured"
@@ -108,101 +181,195 @@ def verify_face(stored_encoding, current_encoding):
     Verify if current face matches stored face
     Returns True if match, False otherwise
     """
+    return verify_face_distance(stored_encoding, current_encoding)[0]
+
+def verify_face_distance(stored_encoding, current_encoding):
+    """Like verify_face, but returns (matched, distance); distance is None without both faces"""
     if stored_encoding is None or current_encoding is None:
-        return False
+        return False, None
     
     stored = np.array(stored_encoding)
     current = np.array(current_encoding)
     
     # Calculate Euclidean distance
-    distance = np.linalg.norm(stored - current)
+    distance = float(np.linalg.norm(stored - current))
     
     # Threshold for face matching (lower is better match)
-    threshold = 5000
-    
-    return distance < threshold
+    return distance < FACE_MATCH_THRESHOLD, distance
 
-def get_face_encoding_from_camera():
-    """Capture face encoding from camera for login verification"""
-    cap = cv2.VideoCapture(0)
-    
-    if not cap.isOpened():
-        return None, "Camera not found"
-    
-    # Set higher resolution
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
-    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-    
-    face_encodings = []
-    frame_count = 0
-    
+@profiling.profiled('login_capture_session')
+def get_face_encoding_from_camera(source=None, headless=None):
+    """Capture face encoding from camera (or another frame source) for login verification"""
     print("\n" + "="*50)
     print("FACE LOGIN VERIFICATION")
     print("Position your face in the camera")
     print("="*50)
     print("Press 'q' to quit\n")
     
-    while True:
-        ret, frame = cap.read()
+    return run_capture_session(
+        source,
+        required_frames=3,
+        window_name='Face Login',
+        no_face_message="No face detected - Move closer",
+        cancel_message="Verification cancelled",
+        headless=headless
+    )
+
+# Shared by all threads of the process, see detection_strategy.py.
+# Region searches get their own statistics since they cost far less.
+detection_strategy = DetectionStrategy()
+roi_strategy = DetectionStrategy()
+
+# Margin searched around a previous face box, as a fraction of its size
+ROI_PADDING = 0.5
+
+def detect_faces(gray, min_size=(60, 60), strategy=None):
+    """
+    Find faces in an equalized grayscale image
+    Tries cascade/parameter combinations in the strategy's adaptive order
+    within its time budget and returns the first non-empty result as an
+    array of (x, y, w, h) boxes.
+    """
+    def detect(face_cascade, scale, neighbors):
+        return face_cascade.detectMultiScale(
+            gray, 
+            scaleFactor=scale, 
+            minNeighbors=neighbors, 
+            minSize=min_size,
+            flags=cv2.CASCADE_SCALE_IMAGE
+        )
+    return (strategy or detection_strategy).detect(get_cascade, detect)
+
+def detect_faces_near(gray, box, padding=ROI_PADDING):
+    """
+    Search only a padded region around a previous face box
+    Returns boxes in full-image coordinates, or [] when the region holds
+    no face (callers then fall back to detect_faces on the whole image).
+    """
+    x, y, w, h = box
+    x0 = max(0, x - int(w * padding))
+    y0 = max(0, y - int(h * padding))
+    x1 = min(gray.shape[1], x + w + int(w * padding))
+    y1 = min(gray.shape[0], y + h + int(h * padding))
+    if x1 - x0 < 60 or y1 - y0 < 60:
+        return []
+    # A face that filled the box before cannot have shrunk much since
+    min_side = max(60, int(min(w, h) * 0.5))
+    detected = detect_faces(gray[y0:y1, x0:x1], min_size=(min_side, min_side), strategy=roi_strategy)
+    return [(fx + x0, fy + y0, fw, fh) for fx, fy, fw, fh in detected]
+
+def detection_snapshot():
+    """Statistics of full-frame and region detection"""
+    return dict(detection_strategy.snapshot(), roi=roi_strategy.snapshot())
+
+def extract_face(frame, box):
+    """
+    Crop a detected face with 20% padding and resize it to 100x100
+    Returns (face_data, padded box), face_data is None for an empty crop.
+    """
+    x, y, w, h = box
+    padding = int(min(w, h) * 0.2)
+    x = max(0, x - padding)
+    y = max(0, y - padding)
+    w = min(frame.shape[1] - x, w + 2 * padding)
+    h = min(frame.shape[0] - y, h + 2 * padding)
+    
+    face_roi = frame[y:y+h, x:x+w]
+    if face_roi.size == 0:
+        return None, (x, y, w, h)
+    return cv2.resize(face_roi, (100, 100)), (x, y, w, h)
+
+def process_capture_image(image_data_url, hint=None, cache=None, cache_scope=None):
+    """
+    Decode a browser-uploaded frame (data URL) and extract the face encoding
+    hint: (x, y, w, h) face box of the previous frame, searched first.
+    Face boxes, the hint and the returned face_bounds, are in the
+    coordinates of the uploaded image even when it is downscaled here.
+    cache: CaptureCache that successful results are stored in, cache_scope
+    the capture session near-identical frames may be matched within.
+    Returns (payload, http_status) for /api/capture-face.
+    """
+    try:
+        # Decode base64 image
+        try:
+            image_data = image_data_url.split(',')[1]
+            image_bytes = base64.b64decode(image_data)
+            nparr = np.frombuffer(image_bytes, np.uint8)
+            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        except Exception as e:
+            return {'error': f'Failed to decode image: {str(e)}', 'success': False}, 400
+        
+        if frame is None:
+            return {'error': 'Failed to decode image', 'success': False}, 400
         
-        if not ret:
-            return None, "Failed to read camera"
+        # Old clients may still upload full resolution frames
+        upload_height, upload_width = frame.shape[:2]
+        frame = fit_frame(frame)
+        scale_x = frame.shape[1] / float(upload_width)
+        scale_y = frame.shape[0] / float(upload_height)
+        if hint:
+            hint = scale_box(hint, scale_x, scale_y)
         
+        # Detect face and create encoding
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        # Equalize histogram
+        phash = None
+        if cache is not None and cache.perceptual:
+            phash = difference_hash(gray)
+            cached = cache.get_near(phash, cache_scope)
+            if cached is not None:
+                return cached, 200
         gray = cv2.equalizeHist(gray)
-        
-        # More sensitive face detection
-        faces = face_cascade.detectMultiScale(gray, scaleFactor=1.05, minNeighbors=3, minSize=(30, 30))
+        faces = detect_faces_near(gray, hint) if hint else []
+        detect_mode = 'roi' if len(faces) else 'full'
+        if len(faces) == 0:
+            faces = detect_faces(gray)
         
         if len(faces) == 0:
-            faces = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_alt.xml').detectMultiScale(
-                gray, scaleFactor=1.05, minNeighbors=3, minSize=(30, 30))
+            return {
+                'error': 'No face detected. Please ensure good lighting and face the camera directly.',
+                'success': False
+            }, 400
         
-        frame_with_text = frame.copy()
+        # Get largest face (most likely the main subject)
+        faces = sorted(faces, key=lambda x: x[2] * x[3], reverse=True)
+        x, y, w, h = faces[0]
         
-        if len(faces) > 0:
-            # Get largest face
-            faces = sorted(faces, key=lambda x: x[2] * x[3], reverse=True)
-            x, y, w, h = faces[0]
-            
-            cv2.rectangle(frame_with_text, (x, y), (x + w, y + h), (0, 255, 0), 2)
-            cv2.putText(frame_with_text, f"Frames: {frame_count}/3", 
-                       (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-            
-            # Extract face region with padding
-            padding = 20
-            x = max(0, x - padding)
-            y = max(0, y - padding)
-            w = min(frame.shape[1] - x, w + 2 * padding)
-            h = min(frame.shape[0] - y, h + 2 * padding)
-            
-            face_roi = frame[y:y+h, x:x+w]
-            face_data = cv2.resize(face_roi, (100, 100))
-            encoding = face_data.flatten().tolist()
-            face_encodings.append(encoding)
-            frame_count += 1
-        else:
-            cv2.putText(frame_with_text, "No face detected - Move closer", 
-                       (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+        # Validate face size (must be reasonably large)
+        min_face_size = min(frame.shape[0], frame.shape[1]) * 0.1
+        if w < min_face_size or h < min_face_size:
+            return {
+                'error': 'Face too small. Please move closer to the camera.',
+                'success': False
+            }, 400
         
-        cv2.imshow('Face Login', frame_with_text)
+        face_data, (x, y, w, h) = extract_face(frame, (x, y, w, h))
         
-        key = cv2.waitKey(1) & 0xFF
-        if key == ord('q'):
-            cap.release()
-            cv2.destroyAllWindows()
-            return None, "Verification cancelled"
+        if face_data is None:
+            return {'error': 'Failed to extract face region', 'success': False}, 400
+        x, y, w, h = scale_box((x, y, w, h), 1 / scale_x, 1 / scale_y)
+        w = min(w, upload_width - x)
+        h = min(h, upload_height - y)
         
-        if frame_count >= 3:
-            break
-    
-    cap.release()
-    cv2.destroyAllWindows()
-    
-    if len(face_encodings) == 0:
-        return None, "No face captured"
+        encoding = face_data.flatten().tolist()
+
+        # Create preview image
+        try:
+            _, jpg = cv2.imencode('.jpg', face_data)
+            preview_b64 = base64.b64encode(jpg.tobytes()).decode('utf-8')
+            preview_dataurl = f'data:image/jpeg;base64,{preview_b64}'
+        except Exception:
+            preview_dataurl = None
+
+        payload = {
+            'success': True, 
+            'encoding': encoding, 
+            'preview': preview_dataurl,
+            'face_bounds': {'x': int(x), 'y': int(y), 'w': int(w), 'h': int(h)},
+            'detect_mode': detect_mode
+        }
+        if cache is not None:
+            cache.put(image_data_url, payload, phash, cache_scope)
+        return payload, 200
     
-    average_encoding = np.mean(face_encodings, axis=0).tolist()
-    return average_encoding, "Face captured successfully"
+    except Exception as e:
+        return {'error': str(e), 'success': False}, 500
@@ -0,0 +1,153 @@
+import os
+
+import cv2
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+class FrameSource:
+    """
+    Source of BGR frames for the capture pipeline
+    Subclasses implement open() and read(); read() returns (ok, frame)
+    like cv2.VideoCapture.read and (False, None) once the source ends.
+    """
+
+    name = 'Frame source'
+
+    def open(self):
+        return True
+
+    def read(self):
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+    def __iter__(self):
+        while True:
+            ok, frame = self.read()
+            if not ok:
+                return
+            yield frame
+
+
+class CameraSource(FrameSource):
+    """Live camera via cv2.VideoCapture(index)"""
+
+    name = 'Camera'
+
+    def __init__(self, index=0, width=1280, height=720):
+        self.index = index
+        self.width = width
+        self.height = height
+        self.cap = None
+
+    def open(self):
+        self.cap = cv2.VideoCapture(self.index)
+        if not self.cap.isOpened():
+            return False
+        # Set higher resolution
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return True
+
+    def read(self):
+        if self.cap is None:
+            return False, None
+        return self.cap.read()
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+
+class VideoSource(FrameSource):
+    """Video file or stream URL (rtsp://, http://) decoded by OpenCV"""
+
+    name = 'Video'
+
+    def __init__(self, path, loop=False):
+        self.path = path
+        self.loop = loop
+        self.cap = None
+
+    def open(self):
+        self.cap = cv2.VideoCapture(self.path)
+        return self.cap.isOpened()
+
+    def read(self):
+        if self.cap is None:
+            return False, None
+        ok, frame = self.cap.read()
+        if not ok and self.loop and '://' not in str(self.path):
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.cap.read()
+        return ok, frame
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+
+class ImageDirectorySource(FrameSource):
+    """Images in a directory, read in file name order"""
+
+    name = 'Image directory'
+
+    def __init__(self, path, loop=False):
+        self.path = path
+        self.loop = loop
+        self.files = []
+        self.position = 0
+
+    def open(self):
+        if not os.path.isdir(self.path):
+            return False
+        self.files = sorted(
+            os.path.join(self.path, f) for f in os.listdir(self.path)
+            if f.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        self.position = 0
+        return bool(self.files)
+
+    def read(self):
+        while self.files:
+            if self.position >= len(self.files):
+                if not self.loop:
+                    return False, None
+                self.position = 0
+            path = self.files[self.position]
+            self.position += 1
+            frame = cv2.imread(path, cv2.IMREAD_COLOR)
+            if frame is not None:
+                return True, frame
+        return False, None
+
+
+def open_source(spec, loop=False):
+    """
+    Build a frame source from a spec
+    An integer (or digit string) is a camera index, a directory is an image
+    sequence, anything else is a video file or stream URL. FrameSource
+    instances are returned unchanged.
+    """
+    if isinstance(spec, FrameSource):
+        return spec
+    if spec is None:
+        return CameraSource(0)
+    if isinstance(spec, int) or (isinstance(spec, str) and spec.isdigit()):
+        return CameraSource(int(spec))
+    if os.path.isdir(spec):
+        return ImageDirectorySource(spec, loop=loop)
+    return VideoSource(spec, loop=loop)
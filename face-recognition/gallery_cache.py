@@ -0,0 +1,378 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Decoded encodings kept in memory; 0 disables the cache. A float64
+# 100x100x3 encoding takes 240 KB, so the default holds ~270 users.
+GALLERY_CACHE_BYTES = int(os.getenv('GALLERY_CACHE_BYTES', str(64 * 2**20)))
+# Compact copies of encodings evicted from memory; 0 disables the disk tier
+GALLERY_DISK_BYTES = int(os.getenv('GALLERY_DISK_BYTES', str(512 * 2**20)))
+GALLERY_CACHE_DIR = os.getenv('GALLERY_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gallery_cache'))
+# Seconds an entry is used without checking its face_hash against the
+# database. Updates made by this process invalidate entries right away;
+# other workers' updates are only seen once this expires, so leave it at 0
+# when several processes serve logins.
+GALLERY_CACHE_TRUST = float(os.getenv('GALLERY_CACHE_TRUST', '0'))
+# Share of the memory budget for users verified more than once
+PROTECTED_SHARE = 0.8
+# The disk directory is swept against its budget each time this process
+# has written this share of it (and on its first write)
+SWEEP_SHARE = 1 / 32
+
+# Exact compact forms tried in order: whole values, averages of a few
+# uint8 frames (value * divisor is whole), then floats
+COMPACT_FORMATS = [('uint8', 1)] + [('uint16', d) for d in range(2, 11)] + [('float32', 1), ('float64', 1)]
+
+
+def compact_encoding(vector):
+    """
+    Smallest exact representation of an encoding: (dtype, divisor, array)
+    Decoding with expand_encoding gives back the identical float64 values.
+    """
+    for dtype, divisor in COMPACT_FORMATS:
+        if dtype.startswith('uint'):
+            scaled = np.rint(vector * divisor)
+            if scaled.size and (scaled.min() < 0 or scaled.max() > np.iinfo(dtype).max):
+                continue
+            packed = scaled.astype(dtype)
+        else:
+            packed = vector.astype(dtype)
+        if np.array_equal(expand_encoding(packed, divisor), vector):
+            return dtype, divisor, packed
+    return 'float64', 1, vector
+
+
+def expand_encoding(packed, divisor):
+    vector = packed.astype(np.float64)
+    if divisor != 1:
+        vector /= divisor
+    return vector
+
+
+class GalleryEntry:
+    __slots__ = ('vector', 'face_hash', 'validated')
+
+    def __init__(self, vector, face_hash, validated):
+        self.vector = vector
+        self.face_hash = face_hash
+        self.validated = validated
+
+
+class GalleryCache:
+    """
+    Face encodings of recently and frequently verified users, in two tiers
+    Memory holds decoded float64 arrays under a segmented LRU: new entries
+    start in a probation segment and move to a protected one (up to
+    protected_share of the budget) when verified again, so a burst of
+    one-off logins cannot flush the regular users. Entries evicted from
+    memory are written to disk in their smallest exact form, one file per
+    user. The directory is shared by every worker on the host: lookups open
+    the user's file directly, hits refresh its mtime, and the budget is
+    enforced by sweeping the least recently used files of the whole
+    directory, so it holds for all workers together. Disk evictions simply
+    fall back to the database.
+
+    Entries carry the face_hash they were stored with. get() checks it
+    against the current one (a tiny projection rather than the 30000-value
+    encoding) unless the entry was validated within trust_seconds.
+    """
+
+    def __init__(self, memory_bytes=GALLERY_CACHE_BYTES, disk_bytes=GALLERY_DISK_BYTES, disk_dir=GALLERY_CACHE_DIR,
+                 trust_seconds=GALLERY_CACHE_TRUST, protected_share=PROTECTED_SHARE):
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes if disk_dir else 0
+        self.disk_dir = disk_dir
+        self.trust_seconds = trust_seconds
+        self.protected_bytes = int(memory_bytes * protected_share)
+        self.lock = threading.Lock()
+        self.probation = OrderedDict()
+        self.protected = OrderedDict()
+        self.memory_used = 0
+        self.protected_used = 0
+        # Directory contents as of the last sweep, plus this process's writes since
+        self.disk_entries = 0
+        self.disk_used = 0
+        self.written_since_sweep = None
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stale': 0, 'validations': 0,
+                      'stored': 0, 'demoted': 0, 'memory_evictions': 0, 'disk_evictions': 0}
+
+    def _trusted(self, validated, now):
+        return self.trust_seconds > 0 and now - validated < self.trust_seconds
+
+    def _path(self, username):
+        return os.path.join(self.disk_dir, hashlib.blake2b(username.encode('utf-8'), digest_size=16).hexdigest() + '.enc')
+
+    def get(self, username, current_hash):
+        """
+        Cached encoding of username as a read-only float64 array, or None
+        current_hash() returns the face_hash now stored for the user (None
+        without a face); it is only called when the entry needs checking.
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.protected.get(username) or self.probation.get(username)
+            trusted = entry is not None and self._trusted(entry.validated, now)
+            if trusted:
+                self._touch(username, entry)
+                self.stats['memory_hits'] += 1
+                return entry.vector
+        if entry is not None:
+            stored = current_hash()
+            with self.lock:
+                self.stats['validations'] += 1
+                if stored is not None and stored == entry.face_hash:
+                    entry.validated = now
+                    if username in self.probation or username in self.protected:
+                        self._touch(username, entry)
+                    self.stats['memory_hits'] += 1
+                    return entry.vector
+                self.stats['stale'] += 1
+            self.discard(username)
+            return self._miss()
+
+        entry = self._read_disk(username)
+        if entry is None:
+            return self._miss()
+        if not self._trusted(entry.validated, now):
+            stored = current_hash()
+            with self.lock:
+                self.stats['validations'] += 1
+            if stored is None or stored != entry.face_hash:
+                with self.lock:
+                    self.stats['stale'] += 1
+                self.discard(username)
+                return self._miss()
+            entry.validated = now
+        with self.lock:
+            self.stats['disk_hits'] += 1
+            victims = self._insert(username, entry)
+        self._demote(victims)
+        return entry.vector
+
+    def _miss(self):
+        with self.lock:
+            self.stats['misses'] += 1
+        return None
+
+    def put(self, username, face_encoding, face_hash):
+        """
+        Cache an encoding just loaded from the database
+        Returns it as the read-only float64 array later hits return, so
+        callers get the same type either way. Encodings without a face_hash
+        (stored before hashes existed) are returned but not cached.
+        """
+        vector = np.array(face_encoding, dtype=np.float64)
+        vector.flags.writeable = False
+        if face_hash is None or vector.nbytes > self.memory_bytes:
+            return vector
+        with self.lock:
+            self.stats['stored'] += 1
+            victims = self._insert(username, GalleryEntry(vector, face_hash, time.time()))
+        self._demote(victims)
+        return vector
+
+    def discard(self, username):
+        """Forget a user in both tiers, after their face changed or they were deleted"""
+        with self.lock:
+            self._remove_memory(username)
+        if self.disk_bytes:
+            try:
+                os.remove(self._path(username))
+            except OSError:
+                pass
+
+    def _remove_memory(self, username):
+        for segment in (self.probation, self.protected):
+            entry = segment.pop(username, None)
+            if entry is not None:
+                self.memory_used -= entry.vector.nbytes
+                if segment is self.protected:
+                    self.protected_used -= entry.vector.nbytes
+                return entry
+        return None
+
+    def _touch(self, username, entry):
+        """A repeat verification: probation entries are promoted to protected"""
+        if username in self.protected:
+            self.protected.move_to_end(username)
+            return
+        del self.probation[username]
+        self.protected[username] = entry
+        self.protected_used += entry.vector.nbytes
+        # Protected overflow goes back to probation rather than out of memory
+        while self.protected_used > self.protected_bytes and len(self.protected) > 1:
+            name, demoted = self.protected.popitem(last=False)
+            self.protected_used -= demoted.vector.nbytes
+            self.probation[name] = demoted
+
+    def _insert(self, username, entry):
+        """Add to probation and return the entries evicted to make room"""
+        self._remove_memory(username)
+        self.probation[username] = entry
+        self.memory_used += entry.vector.nbytes
+        victims = []
+        while self.memory_used > self.memory_bytes:
+            # Never the entry just added (the last one in probation)
+            segment = self.probation if len(self.probation) > 1 or not self.protected else self.protected
+            name, victim = segment.popitem(last=False)
+            self.memory_used -= victim.vector.nbytes
+            if segment is self.protected:
+                self.protected_used -= victim.vector.nbytes
+            self.stats['memory_evictions'] += 1
+            victims.append((name, victim))
+        return victims
+
+    def _read_header(self, f, username):
+        header = json.loads(f.readline())
+        if header['username'] != username:
+            raise ValueError('entry of another user')
+        return header
+
+    def _read_disk(self, username):
+        if not self.disk_bytes:
+            return None
+        path = self._path(username)
+        try:
+            with open(path, 'rb') as f:
+                header = self._read_header(f, username)
+                packed = np.frombuffer(f.read(), dtype=header['dtype'])
+            if packed.size != header['size']:
+                raise ValueError('truncated entry')
+            # The sweep evicts by mtime, so a hit keeps the file
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError):
+            self.discard(username)
+            return None
+        vector = expand_encoding(packed, header['divisor'])
+        vector.flags.writeable = False
+        return GalleryEntry(vector, header['face_hash'], header['validated'])
+
+    def _on_disk(self, path, username, face_hash):
+        """Whether path already holds this face, refreshing its mtime if so"""
+        try:
+            with open(path, 'rb') as f:
+                if self._read_header(f, username)['face_hash'] != face_hash:
+                    return False
+            os.utime(path)
+            return True
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+
+    def _demote(self, victims):
+        """Write entries evicted from memory to the disk tier"""
+        if not self.disk_bytes:
+            return
+        for username, entry in victims:
+            path = self._path(username)
+            # Already on disk from an earlier demotion, here or in another worker
+            if self._on_disk(path, username, entry.face_hash):
+                continue
+            dtype, divisor, packed = compact_encoding(entry.vector)
+            header = {'username': username, 'face_hash': entry.face_hash, 'validated': entry.validated,
+                      'dtype': dtype, 'divisor': divisor, 'size': int(packed.size)}
+            try:
+                os.makedirs(self.disk_dir, exist_ok=True)
+                temp = f'{path}.{os.getpid()}.tmp'
+                with open(temp, 'wb') as f:
+                    f.write(json.dumps(header).encode('utf-8') + b'\n')
+                    f.write(packed.tobytes())
+                os.replace(temp, path)
+                size = os.path.getsize(path)
+            except OSError as e:
+                print(f"Error writing gallery cache: {e}")
+                continue
+            with self.lock:
+                self.stats['demoted'] += 1
+                self.disk_used += size
+                self.disk_entries += 1
+                due = self.written_since_sweep is None or self.written_since_sweep + size > self.disk_bytes * SWEEP_SHARE
+                self.written_since_sweep = 0 if due else self.written_since_sweep + size
+            if due:
+                self._sweep()
+
+    def _sweep(self):
+        """Delete the least recently used files until the directory fits the disk budget"""
+        files = []
+        try:
+            names = os.listdir(self.disk_dir)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith('.enc'):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        used = sum(size for _, size, _ in files)
+        evicted = 0
+        for _, size, path in sorted(files):
+            if used <= self.disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Already evicted by another worker
+                pass
+            used -= size
+            evicted += 1
+        with self.lock:
+            self.stats['disk_evictions'] += evicted
+            self.disk_used = used
+            self.disk_entries = len(files) - evicted
+
+    def snapshot(self):
+        """Hit rates and resident bytes of each tier"""
+        with self.lock:
+            stats = dict(self.stats)
+            lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+
+            def rate(count):
+                return round(count / lookups, 3) if lookups else None
+
+            return dict(
+                stats,
+                lookups=lookups,
+                hit_rate=rate(stats['memory_hits'] + stats['disk_hits']),
+                trust_seconds=self.trust_seconds,
+                memory={'entries': len(self.probation) + len(self.protected), 'protected': len(self.protected),
+                        'resident_bytes': self.memory_used, 'budget_bytes': self.memory_bytes,
+                        'hit_rate': rate(stats['memory_hits'])},
+                disk={'entries': self.disk_entries, 'resident_bytes': self.disk_used, 'budget_bytes': self.disk_bytes,
+                      'hit_rate': rate(stats['disk_hits'])}
+            )
+
+
+_process_gallery = None
+_process_pid = None
+_process_lock = threading.Lock()
+
+
+def process_gallery():
+    """
+    The gallery cache of this process, or None when GALLERY_CACHE_BYTES is 0
+    Created lazily per process, so preforked web workers do not inherit
+    the master's lock or index.
+    """
+    global _process_gallery, _process_pid
+    if _process_pid == os.getpid():
+        return _process_gallery
+    with _process_lock:
+        if _process_pid != os.getpid():
+            _process_gallery = GalleryCache() if GALLERY_CACHE_BYTES > 0 else None
+            _process_pid = os.getpid()
+    return _process_gallery
+
+
+def gallery_snapshot():
+    gallery = process_gallery()
+    return gallery.snapshot() if gallery is not None else {'enabled': False}
@@ -0,0 +1,432 @@
+import argparse
+import base64
+import http.client
+import itertools
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlparse
+
+import cv2
+import numpy as np
+
+import database as db
+from synthetic_faces import synthetic_face
+
+SCENARIOS = ('capture', 'login_face', 'register', 'duplicates')
+
+
+def to_data_url(img, quality=90):
+    """Encode an image the way the browser templates upload it"""
+    _, jpg = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return 'data:image/jpeg;base64,' + base64.b64encode(jpg.tobytes()).decode('utf-8')
+
+
+class OfflineStore:
+    """
+    In-memory stand-in for the MongoDB backed functions in database.py
+    install() swaps the module functions used by the routes so the app can
+    be load tested without a database; uninstall() restores them.
+    """
+
+    PATCHED = (
+        'user_exists', 'user_has_face', 'get_user_face_encoding', 'verify_password',
+        'add_user', 'face_exists', 'find_similar_faces', 'update_face_encoding',
+        'update_password', 'get_all_users', 'iter_face_encodings', 'delete_user', 'load_face_encoding',
+    )
+
+    def __init__(self):
+        self.users = {}
+        self.lock = threading.Lock()
+        self.originals = {}
+
+    def install(self):
+        for name in self.PATCHED:
+            self.originals[name] = getattr(db, name)
+            setattr(db, name, getattr(self, name))
+
+    def uninstall(self):
+        for name, func in self.originals.items():
+            setattr(db, name, func)
+        self.originals = {}
+
+    def user_exists(self, username):
+        return username in self.users
+
+    def user_has_face(self, username):
+        user = self.users.get(username)
+        return bool(user and user.get('has_face'))
+
+    def get_user_face_encoding(self, username):
+        user = self.users.get(username)
+        return user.get('face_encoding') if user else None
+
+    load_face_encoding = get_user_face_encoding
+
+    def verify_password(self, username, password):
+        user = self.users.get(username)
+        return user is not None and user['password'] == db.hash_password(password)
+
+    def face_exists(self, face_encoding):
+        face_hash = db.hash_face_encoding(face_encoding)
+        for user in list(self.users.values()):
+            if user.get('face_hash') == face_hash:
+                return user['username']
+        return None
+
+    def find_similar_faces(self, face_encoding, threshold=5000):
+        return [
+            {'username': u['username'], 'face_id': u.get('face_id', 'N/A'), 'created_at': u.get('created_at', 'N/A')}
+            for u in list(self.users.values())
+            if u.get('face_encoding') is not None and db.compare_faces(face_encoding, u['face_encoding'], threshold)
+        ]
+
+    def add_user(self, username, password, face_encoding=None, check_faces=True):
+        if username in self.users:
+            return False, "Username already exists"
+        if face_encoding is not None and check_faces:
+            existing_user = self.face_exists(face_encoding)
+            if existing_user:
+                return False, f"This face is already registered with username: {existing_user}"
+            similar_faces = self.find_similar_faces(face_encoding)
+            if similar_faces:
+                usernames = ', '.join(f['username'] for f in similar_faces)
+                return False, f"Similar face found! Already registered to: {usernames}"
+        with self.lock:
+            if username in self.users:
+                return False, "Username already exists"
+            self.users[username] = db.build_user_document(username, db.hash_password(password), face_encoding)
+        return True, "User created successfully"
+
+    def update_face_encoding(self, username, face_encoding):
+        user = self.users.get(username)
+        if user is None:
+            return False
+        user.update({'face_encoding': face_encoding, 'has_face': True})
+        user.update(db.face_signature_fields(face_encoding))
+        return True
+
+    def update_password(self, username, new_password):
+        user = self.users.get(username)
+        if user is None:
+            return False
+        user['password'] = db.hash_password(new_password)
+        return True
+
+    def get_all_users(self):
+        return [
+            {k: v for k, v in u.items() if k not in ('password', 'face_encoding')}
+            for u in list(self.users.values())
+        ]
+
+    def iter_face_encodings(self, batch_size=500):
+        for u in list(self.users.values()):
+            if u.get('face_encoding') is not None:
+                yield u['username'], u['face_encoding']
+
+    def delete_user(self, username):
+        with self.lock:
+            return self.users.pop(username, None) is not None
+
+
+class InProcessClient:
+    """Send requests through the Flask test client (one per thread)"""
+
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def request(self, method, path, json_body=None, form=None):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        response = client.open(path, method=method, json=json_body, data=form)
+        body = response.get_data()
+        return response.status_code, body
+
+
+class HttpClient:
+    """Send requests over HTTP with a keep-alive connection per thread"""
+
+    def __init__(self, base_url, timeout=30):
+        parsed = urlparse(base_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def request(self, method, path, json_body=None, form=None):
+        headers = {}
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body)
+            headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        for attempt in range(2):
+            conn = getattr(self.local, 'conn', None)
+            if conn is None:
+                conn = self.local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, ConnectionError):
+                conn.close()
+                self.local.conn = None
+                if attempt:
+                    raise
+
+
+def start_local_server(app):
+    """Serve the app on an ephemeral localhost port in a background thread"""
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+class Workload:
+    """Builds the request for each scenario from a pool of synthetic faces"""
+
+    def __init__(self, client, faces=20, users=20, no_face_ratio=0.0, width=640, height=480, seed=0):
+        self.client = client
+        self.no_face_ratio = no_face_ratio
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.counter = itertools.count()
+        self.run_id = f'{int(time.time()) % 100000:05d}'
+        self.images = [to_data_url(synthetic_face(seed + i, width, height)) for i in range(faces)]
+        self.blank_images = [to_data_url(synthetic_face(seed + i, width, height, with_face=False)) for i in range(3)]
+        self.encodings = []
+        self.users = []
+        self.users_count = users
+
+    def prepare(self, store=None):
+        """
+        Compute encodings through the API and enroll the login users
+        With an OfflineStore users are seeded directly; synthetic faces are
+        too alike for /register's similar-face check to accept many of them.
+        """
+        for image in self.images:
+            status, body = self.client.request('POST', '/api/capture-face', json_body={'image': image})
+            data = json.loads(body)
+            if status != 200 or not data.get('success'):
+                raise RuntimeError(f"Synthetic face was not detected: {data.get('error')}")
+            self.encodings.append(data['encoding'])
+        for i in range(self.users_count):
+            username = f'load_{self.run_id}_{i}'
+            encoding = self.encodings[i % len(self.encodings)]
+            if store is not None:
+                ok, _ = store.add_user(username, 'load-test', encoding, check_faces=False)
+            else:
+                status, _ = self.client.request('POST', '/register', form={
+                    'username': username, 'password': 'load-test', 'confirm_password': 'load-test',
+                    'register_face': 'on', 'face_encoding': json.dumps(encoding),
+                })
+                ok = status == 302
+            if ok:
+                self.users.append((username, encoding))
+        if not self.users:
+            print("⚠️  No login users could be enrolled, login_face requests will be rejected")
+
+    def choice(self, seq):
+        with self.rng_lock:
+            return self.rng.choice(seq)
+
+    def call(self, scenario):
+        """Issue one request, returns the HTTP status"""
+        if scenario == 'capture':
+            with self.rng_lock:
+                blank = self.rng.random() < self.no_face_ratio
+            image = self.choice(self.blank_images if blank else self.images)
+            status, _ = self.client.request('POST', '/api/capture-face', json_body={'image': image})
+        elif scenario == 'login_face':
+            username, encoding = self.choice(self.users) if self.users else ('missing', self.encodings[0])
+            status, body = self.client.request('POST', '/login-face', form={
+                'username': username, 'face_encoding': json.dumps(encoding),
+            })
+            # A failed match re-renders the page with 200
+            if status == 200 and b'class="error"' in body:
+                status = 401
+        elif scenario == 'register':
+            username = f'load_{self.run_id}_r{next(self.counter)}'
+            status, _ = self.client.request('POST', '/register', form={
+                'username': username, 'password': 'load-test', 'confirm_password': 'load-test',
+            })
+        elif scenario == 'duplicates':
+            status, _ = self.client.request('GET', '/admin/find-duplicates')
+        else:
+            raise ValueError(f"Unknown scenario: {scenario}")
+        return status
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def run(workload, mix, concurrency=8, rate=0.0, duration=10.0, requests=None, seed=0):
+    """
+    Drive the workload and collect per-scenario results
+    rate > 0 gives open-loop Poisson arrivals (latency includes queueing
+    delay from the intended start time); rate == 0 runs closed-loop with
+    `concurrency` back-to-back workers.
+    """
+    scenarios = list(mix)
+    weights = [mix[s] for s in scenarios]
+    rng = random.Random(seed)
+    results = {s: {'latencies': [], 'ok': 0, 'rejected': 0, 'errors': 0} for s in scenarios}
+    results_lock = threading.Lock()
+
+    def record(scenario, started):
+        try:
+            status = workload.call(scenario)
+        except Exception:
+            status = None
+        latency = time.perf_counter() - started
+        with results_lock:
+            entry = results[scenario]
+            entry['latencies'].append(latency)
+            if status is None or (status >= 500 and status != 503):
+                entry['errors'] += 1
+            elif status >= 400:
+                entry['rejected'] += 1
+            else:
+                entry['ok'] += 1
+
+    start = time.perf_counter()
+    deadline = start + duration
+    issued = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        if rate > 0:
+            next_at = start
+            while (requests is None and next_at < deadline) or (requests is not None and issued < requests):
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(record, rng.choices(scenarios, weights)[0], next_at)
+                issued += 1
+                next_at += rng.expovariate(rate)
+        else:
+            counter = itertools.count()
+            counter_lock = threading.Lock()
+
+            def worker(worker_seed):
+                worker_rng = random.Random(worker_seed)
+                while True:
+                    with counter_lock:
+                        n = next(counter)
+                    if requests is not None and n >= requests:
+                        return
+                    if requests is None and time.perf_counter() >= deadline:
+                        return
+                    record(worker_rng.choices(scenarios, weights)[0], time.perf_counter())
+
+            for i in range(concurrency):
+                pool.submit(worker, seed + i + 1)
+    elapsed = time.perf_counter() - start
+    return results, elapsed
+
+
+def report(results, elapsed):
+    """Print throughput, latency percentiles and error/rejection rates"""
+    print(f"\n{'='*78}")
+    print(f"{'scenario':<12}{'count':>7}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'reject%':>10}{'error%':>9}")
+    print(f"{'-'*78}")
+    total = 0
+    for scenario, entry in results.items():
+        latencies = sorted(entry['latencies'])
+        count = len(latencies)
+        total += count
+        if not count:
+            continue
+        print(f"{scenario:<12}{count:>7}{count / elapsed:>9.1f}"
+              f"{percentile(latencies, 50) * 1000:>9.1f}{percentile(latencies, 95) * 1000:>9.1f}"
+              f"{percentile(latencies, 99) * 1000:>9.1f}"
+              f"{entry['rejected'] * 100.0 / count:>10.1f}{entry['errors'] * 100.0 / count:>9.1f}")
+    print(f"{'-'*78}")
+    print(f"total {total} requests in {elapsed:.2f}s ({total / max(elapsed, 1e-9):.1f} req/s)")
+    print(f"{'='*78}")
+
+
+def parse_mix(value):
+    """Parse 'capture=4,login_face=2' into a weight dict"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Unknown scenario '{name}', choose from {', '.join(SCENARIOS)}")
+        mix[name] = float(weight) if weight else 1.0
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the face recognition web endpoints")
+    parser.add_argument('--target', choices=('inprocess', 'local'), default='inprocess',
+                        help="Test client in this process, or a localhost server (offline store)")
+    parser.add_argument('--url', help="Drive an already running server instead (uses its database)")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('capture=6,login_face=3,register=1'),
+                        help="Weighted scenarios, e.g. capture=6,login_face=3,register=1,duplicates=0.1")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=0.0, help="Arrivals per second (0 = closed loop)")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds to run")
+    parser.add_argument('--requests', type=int, help="Stop after this many requests instead")
+    parser.add_argument('--faces', type=int, default=20, help="Distinct synthetic faces")
+    parser.add_argument('--users', type=int, default=20, help="Users enrolled for login_face")
+    parser.add_argument('--no-face-ratio', type=float, default=0.1, help="Share of capture frames without a face")
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep-capture-limits', action='store_true',
+                        help="Keep the capture result cache and per-session frame interval guard")
+    args = parser.parse_args(argv)
+
+    store = None
+    server = None
+    if args.url:
+        client = HttpClient(args.url)
+    else:
+        import app as webapp
+        from app import app
+        store = OfflineStore()
+        store.install()
+        if not args.keep_capture_limits:
+            # A small pool of frames sent back to back would otherwise
+            # measure the result cache and the interval guard, not detection
+            webapp.capture_cache.max_entries = 0
+            webapp.frame_guard.min_interval = 0
+        if args.target == 'local':
+            server, url = start_local_server(app)
+            client = HttpClient(url)
+        else:
+            client = InProcessClient(app)
+
+    try:
+        workload = Workload(client, faces=args.faces, users=args.users, no_face_ratio=args.no_face_ratio,
+                            width=args.width, height=args.height, seed=args.seed)
+        workload.prepare(store)
+        print(f"Running {', '.join(args.mix)} at concurrency {args.concurrency}"
+              + (f", {args.rate:.1f} req/s" if args.rate > 0 else ", closed loop"))
+        results, elapsed = run(workload, args.mix, concurrency=max(1, args.concurrency), rate=args.rate,
+                               duration=args.duration, requests=args.requests, seed=args.seed)
+        report(results, elapsed)
+    finally:
+        if server is not None:
+            server.shutdown()
+        if store is not None:
+            store.uninstall()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+# Random-projection (p-stable) LSH for Euclidean distance.
+# Each band hashes BAND_WIDTH projections floor((a.v + b) / BUCKET_WIDTH);
+# two faces are candidates when any band matches. With the defaults a pair
+# at distance 5000 collides in a band with p ~= 0.8**6, so it shares at
+# least one of 12 bands ~97% of the time, while faces 30000 apart almost
+# never do. Changing any of these values requires re-signing stored faces
+# (python migrate_users.py --backfill-signatures).
+LSH_SEED = int(os.getenv('FACE_LSH_SEED', '20240601'))
+LSH_BANDS = int(os.getenv('FACE_LSH_BANDS', '12'))
+LSH_BAND_WIDTH = int(os.getenv('FACE_LSH_BAND_WIDTH', '6'))
+LSH_BUCKET_WIDTH = float(os.getenv('FACE_LSH_BUCKET_WIDTH', '20000'))
+
+_projections = {}
+_projections_lock = threading.Lock()
+
+
+def get_projection(dimension):
+    """Return the (projection matrix, offsets) pair for a vector dimension"""
+    projection = _projections.get(dimension)
+    if projection is None:
+        with _projections_lock:
+            projection = _projections.get(dimension)
+            if projection is None:
+                rng = np.random.default_rng(LSH_SEED)
+                count = LSH_BANDS * LSH_BAND_WIDTH
+                matrix = rng.standard_normal((dimension, count)).astype(np.float32)
+                offsets = rng.uniform(0, LSH_BUCKET_WIDTH, count)
+                projection = _projections[dimension] = (matrix, offsets)
+    return projection
+
+
+def content_hash(face_encoding):
+    """Fast exact-content hash of an encoding (binary, not its text form)"""
+    data = np.ascontiguousarray(face_encoding, dtype=np.float64).tobytes()
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def lsh_bands(face_encoding):
+    """Return the band signatures of an encoding, e.g. ['0:9f3a...', ...]"""
+    vector = np.asarray(face_encoding, dtype=np.float32)
+    matrix, offsets = get_projection(vector.shape[0])
+    buckets = np.floor((vector @ matrix + offsets) / LSH_BUCKET_WIDTH).astype(np.int64)
+    bands = []
+    for band, values in enumerate(buckets.reshape(LSH_BANDS, LSH_BAND_WIDTH)):
+        digest = hashlib.blake2b(values.tobytes(), digest_size=8).hexdigest()
+        bands.append(f'{band}:{digest}')
+    return bands
@@ -0,0 +1,256 @@
+import argparse
+import json
+import os
+import sys
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import database as db
+
+DEFAULT_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'users.json')
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = ' \t\n\r'
+
+_decoder = json.JSONDecoder()
+
+
+class LegacyUserReader:
+    """
+    Incrementally read a legacy users.json file ({username: {...}, ...})
+    Only one user record is held in memory at a time, so memory use does
+    not grow with the size of the file.
+    """
+
+    def __init__(self, path, offset=0, chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.file = open(path, 'r', encoding='utf-8', newline='')
+        self.buffer = ''
+        self.eof = False
+        # Absolute position in the file of self.buffer[0]
+        self.buffer_offset = 0
+        # Position just after the last complete record that was yielded
+        self.offset = offset
+        self.resuming = offset > 0
+        if self.resuming:
+            self.file.seek(offset)
+            self.buffer_offset = offset
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _fill(self, min_size=None):
+        """Read more data into the buffer, returns False at end of file"""
+        if self.eof:
+            return False
+        size = max(self.chunk_size, min_size or 0)
+        chunk = self.file.read(size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer += chunk
+        return True
+
+    def _skip_whitespace(self, pos):
+        while True:
+            while pos < len(self.buffer) and self.buffer[pos] in WHITESPACE:
+                pos += 1
+            if pos < len(self.buffer) or not self._fill():
+                return pos
+
+    def _expect(self, pos, chars):
+        pos = self._skip_whitespace(pos)
+        if pos >= len(self.buffer):
+            raise ValueError(f"Unexpected end of file, expected one of {chars!r}")
+        char = self.buffer[pos]
+        if char not in chars:
+            raise ValueError(f"Unexpected {char!r} at byte {self.buffer_offset + pos}, expected one of {chars!r}")
+        return char, pos + 1
+
+    def _decode(self, pos):
+        """Decode one JSON value starting at pos, reading more data as needed"""
+        pos = self._skip_whitespace(pos)
+        while True:
+            try:
+                return _decoder.raw_decode(self.buffer, pos)
+            except json.JSONDecodeError:
+                # The value may simply be cut off at the end of the buffer;
+                # grow the read size with the buffer so large values stay linear
+                if not self._fill(len(self.buffer)):
+                    raise
+
+    def _discard(self, pos):
+        """Drop consumed data from the front of the buffer"""
+        self.buffer_offset += len(self.buffer[:pos].encode('utf-8'))
+        self.buffer = self.buffer[pos:]
+
+    def __iter__(self):
+        pos = 0
+        if not self.resuming:
+            _, pos = self._expect(pos, '{')
+            pos = self._skip_whitespace(pos)
+            if pos < len(self.buffer) and self.buffer[pos] == '}':
+                return
+            first = True
+        else:
+            first = False
+
+        while True:
+            if not first:
+                char, pos = self._expect(pos, ',}')
+                if char == '}':
+                    return
+            first = False
+
+            username, pos = self._decode(pos)
+            if not isinstance(username, str):
+                raise ValueError(f"Expected username string at byte {self.buffer_offset + pos}")
+            _, pos = self._expect(pos, ':')
+            record, pos = self._decode(pos)
+
+            self._discard(pos)
+            pos = 0
+            self.offset = self.buffer_offset
+            yield username, record
+
+
+def convert_record(username, record):
+    """Convert a legacy users.json record into a database user document"""
+    if not isinstance(record, dict) or 'password' not in record:
+        raise ValueError(f"Invalid record for user {username}")
+    face_encoding = record.get('face_encoding') or None
+    if face_encoding is not None:
+        face_encoding = [float(v) for v in face_encoding]
+    return db.build_user_document(username, record['password'], face_encoding)
+
+
+def source_identity(source):
+    """What a checkpoint records about its source file, to refuse resuming on another one"""
+    stat = os.stat(source)
+    return {'source': os.path.abspath(source), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def load_checkpoint(path, source):
+    """
+    Load migration progress, returns (offset, migrated_count)
+    Raises ValueError when the checkpoint belongs to another file or the
+    file changed since: its byte offset would point into unrelated data.
+    """
+    if not path or not os.path.exists(path):
+        return 0, 0
+    with open(path, 'r') as f:
+        data = json.load(f)
+    for key, value in source_identity(source).items():
+        # Checkpoints written before size/mtime were recorded only have source
+        if (key in data or key == 'source') and data.get(key) != value:
+            raise ValueError(f"Checkpoint {path} was written for {data.get('source')} "
+                             f"({key} {data.get(key)!r}, now {value!r})")
+    return data.get('offset', 0), data.get('migrated', 0)
+
+
+def save_checkpoint(path, source, offset, migrated):
+    """Atomically save migration progress"""
+    if not path:
+        return
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(dict(source_identity(source), offset=offset, migrated=migrated), f)
+    os.replace(tmp_path, path)
+
+
+def write_batch(batch):
+    """Insert a batch of user documents, skipping users that already exist"""
+    if not batch:
+        return 0
+    operations = [
+        UpdateOne({'username': doc['username']}, {'$setOnInsert': doc}, upsert=True)
+        for doc in batch
+    ]
+    try:
+        result = db.users_collection.bulk_write(operations, ordered=False)
+        return result.upserted_count
+    except BulkWriteError as e:
+        # Face hash collisions etc. - report and keep the rest of the batch
+        for error in e.details.get('writeErrors', []):
+            print(f"⚠️  Skipped record: {error.get('errmsg')}")
+        return e.details.get('nUpserted', 0)
+
+
+def migrate(source, batch_size=200, checkpoint=None, resume=False):
+    """Stream users from a legacy JSON file into the database in batches"""
+    if db.users_collection is None:
+        print("❌ Database connection failed")
+        return False
+
+    try:
+        offset, migrated = load_checkpoint(checkpoint, source) if resume else (0, 0)
+    except ValueError as e:
+        print(f"❌ Cannot resume: {e}")
+        print("Run without --resume to start over (users already migrated are skipped)")
+        return False
+    total_bytes = os.path.getsize(source)
+    if offset:
+        print(f"Resuming from byte {offset} ({migrated} users already migrated)")
+
+    batch = []
+    seen = 0
+    skipped = 0
+    with LegacyUserReader(source, offset=offset) as reader:
+        for username, record in reader:
+            seen += 1
+            try:
+                batch.append(convert_record(username, record))
+            except (ValueError, TypeError) as e:
+                skipped += 1
+                print(f"⚠️  {e}")
+
+            if len(batch) >= batch_size:
+                migrated += write_batch(batch)
+                batch = []
+                save_checkpoint(checkpoint, source, reader.offset, migrated)
+                print(f"Progress: {reader.offset}/{total_bytes} bytes "
+                      f"({reader.offset * 100 // max(total_bytes, 1)}%), "
+                      f"{seen} read, {migrated} migrated")
+
+        migrated += write_batch(batch)
+        save_checkpoint(checkpoint, source, reader.offset, migrated)
+
+    print(f"✅ Migration finished: {seen} users read, {migrated} migrated, {skipped} invalid")
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate the legacy users.json store into MongoDB")
+    parser.add_argument('source', nargs='?', default=DEFAULT_SOURCE, help="Path to legacy users.json")
+    parser.add_argument('--batch-size', type=int, default=200, help="Users written per bulk write")
+    parser.add_argument('--checkpoint', default=None,
+                        help="Progress file (default: <source>.migration)")
+    parser.add_argument('--resume', action='store_true', help="Continue from the last checkpoint")
+    parser.add_argument('--backfill-signatures', action='store_true',
+                        help="Only compute face hashes, LSH bands and thumbnails for stored faces missing them")
+    parser.add_argument('--resign', action='store_true',
+                        help="With --backfill-signatures, recompute every face (after changing LSH settings)")
+    args = parser.parse_args(argv)
+
+    if args.backfill_signatures:
+        if db.users_collection is None:
+            print("❌ Database connection failed")
+            return 1
+        updated = db.backfill_face_signatures(batch_size=max(1, args.batch_size), resign=args.resign)
+        print(f"✅ Signed {updated} stored faces")
+        return 0
+
+    checkpoint = args.checkpoint or args.source + '.migration'
+    ok = migrate(args.source, batch_size=max(1, args.batch_size), checkpoint=checkpoint, resume=args.resume)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
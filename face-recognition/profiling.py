@@ -0,0 +1,174 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+
+# Profiling is off unless one of these is set:
+#   PROFILE_SAMPLE_RATE  fraction of requests/capture sessions to profile
+#   PROFILE_TOKEN        profile any request sent with "X-Profile: <token>"
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'))
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+PROFILE_HEADER = 'X-Profile'
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '200'))
+PROFILE_TOP = 40
+
+_retention_lock = threading.Lock()
+# One profile at a time per process: from Python 3.12 a second active
+# cProfile.Profile raises ValueError, and a sample is enough anyway
+_active_lock = threading.Lock()
+
+
+def should_profile(header_value=None):
+    """Decide whether to profile this unit of work"""
+    if PROFILE_TOKEN and header_value and header_value == PROFILE_TOKEN:
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def enforce_retention(directory=None, max_files=None):
+    """Delete the oldest profiles beyond the retention cap"""
+    directory = directory or PROFILE_DIR
+    max_files = PROFILE_MAX_FILES if max_files is None else max_files
+    with _retention_lock:
+        try:
+            names = [n for n in os.listdir(directory) if n.endswith('.prof')]
+        except FileNotFoundError:
+            return
+        if len(names) <= max_files:
+            return
+        names.sort()
+        for name in names[:len(names) - max_files]:
+            for path in (name, name[:-5] + '.txt'):
+                try:
+                    os.remove(os.path.join(directory, path))
+                except FileNotFoundError:
+                    pass
+
+
+class Profile:
+    """
+    Call-stack profile of one request or capture session
+    Writes <dir>/<time>_<label>_<id>.prof (load with pstats or snakeviz)
+    and a .txt summary of the top functions by cumulative time.
+    """
+
+    def __init__(self, label, directory=None):
+        self.label = ''.join(c if c.isalnum() or c in '-_' else '_' for c in label)[:60]
+        self.directory = directory or PROFILE_DIR
+        self.profile_id = uuid.uuid4().hex[:8]
+        self.profiler = cProfile.Profile()
+        self.started = None
+        self.running = False
+        self.path = None
+
+    def start(self):
+        """Start profiling; returns None (and profiles nothing) while another profile runs"""
+        if not _active_lock.acquire(blocking=False):
+            return None
+        try:
+            self.profiler.enable()
+        except ValueError:
+            # Another profiler (not started here) is active
+            _active_lock.release()
+            return None
+        self.started = time.time()
+        self.running = True
+        return self
+
+    def stop(self, note=None):
+        """Stop profiling and write the profile files, returns the .prof path"""
+        if not self.running:
+            return None
+        self.running = False
+        try:
+            self.profiler.disable()
+        finally:
+            _active_lock.release()
+        elapsed = time.time() - self.started
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started))
+            base = os.path.join(self.directory, f'{stamp}_{self.label}_{self.profile_id}')
+            self.profiler.dump_stats(base + '.prof')
+
+            summary = io.StringIO()
+            summary.write(f'{self.label} took {elapsed * 1000:.1f} ms')
+            summary.write(f' ({note})\n' if note else '\n')
+            stats = pstats.Stats(self.profiler, stream=summary)
+            stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+            with open(base + '.txt', 'w') as f:
+                f.write(summary.getvalue())
+            self.path = base + '.prof'
+        except OSError as e:
+            print(f"Error writing profile: {e}")
+            return None
+        enforce_retention(self.directory)
+        return self.path
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+def init_app(app):
+    """
+    Profile sampled Flask requests; unsampled requests only pay a coin flip
+    A request sampled while another one is being profiled is skipped, and
+    a failure to profile never fails the request.
+    """
+    from flask import g, request
+
+    @app.before_request
+    def start_request_profile():
+        if should_profile(request.headers.get(PROFILE_HEADER)):
+            try:
+                profile = Profile(f'{request.method}_{request.path.strip("/") or "index"}').start()
+            except Exception as e:
+                print(f"Error starting profile: {e}")
+                profile = None
+            if profile is not None:
+                g.profile = profile
+
+    @app.after_request
+    def tag_request_profile(response):
+        profile = g.pop('profile', None)
+        if profile is not None:
+            try:
+                profile.stop(note=f'status {response.status_code}')
+                response.headers['X-Profile-Id'] = profile.profile_id
+            except Exception as e:
+                print(f"Error stopping profile: {e}")
+        return response
+
+    @app.teardown_request
+    def stop_request_profile(exc):
+        # after_request is skipped when the view raised
+        profile = g.pop('profile', None)
+        if profile is not None:
+            try:
+                profile.stop(note=f'error {exc!r}' if exc else None)
+            except Exception as e:
+                print(f"Error stopping profile: {e}")
+
+
+def profiled(label):
+    """Decorator profiling sampled calls, e.g. CLI capture sessions"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not should_profile():
+                return func(*args, **kwargs)
+            # Runs unprofiled when another profile is active
+            with Profile(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,81 @@
+import argparse
+import json
+import sys
+import time
+
+import face_recognition_module as frm
+import lsh
+from frame_sources import FrameSource, open_source
+
+
+class CountingSource(FrameSource):
+    """Wraps a frame source and counts the frames read from it"""
+
+    def __init__(self, source):
+        self.source = source
+        self.name = source.name
+        self.frames = 0
+
+    def open(self):
+        return self.source.open()
+
+    def read(self):
+        ok, frame = self.source.read()
+        if ok:
+            self.frames += 1
+        return ok, frame
+
+    def release(self):
+        self.source.release()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Replay a capture or login session from a video file or image directory, headless")
+    parser.add_argument('source', help="Video file, image directory, stream URL or camera index")
+    parser.add_argument('--mode', choices=('register', 'login'), default='register',
+                        help="register captures 5 faces, login captures 3")
+    parser.add_argument('--repeat', type=int, default=1, help="Sessions to replay, for throughput")
+    parser.add_argument('--save', help="Write the resulting encoding to this JSON file")
+    parser.add_argument('--expect', help="JSON encoding to compare against with verify_face")
+    args = parser.parse_args(argv)
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    encoding = None
+    frames = 0
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        source = CountingSource(open_source(args.source))
+        if args.mode == 'register':
+            encoding, message = frm.capture_face_encoding('replay', mode='register', source=source, headless=True)
+        else:
+            encoding, message = frm.get_face_encoding_from_camera(source=source, headless=True)
+        frames += source.frames
+        if encoding is None:
+            print(f"Error: {message}")
+            return 1
+    elapsed = time.perf_counter() - start
+
+    print(f"\n{'='*50}")
+    print(f"sessions: {args.repeat}, frames read: {frames}")
+    print(f"elapsed: {elapsed:.3f}s, {frames / elapsed:.1f} frames/s, {elapsed / args.repeat * 1000:.1f} ms/session")
+    print(f"encoding hash: {lsh.content_hash(encoding)}")
+
+    status = 0
+    if args.expect:
+        with open(args.expect) as f:
+            expected = json.load(f)
+        matched = frm.verify_face(expected, encoding)
+        print(f"matches expected encoding: {matched}")
+        status = 0 if matched else 2
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(encoding, f)
+        print(f"saved encoding to {args.save}")
+    print(f"{'='*50}")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""
+Production server for the web app
+
+Loads the Flask app, Haar cascades and database settings once in the
+master process and then preforks worker processes that share that memory
+copy-on-write. Each worker opens its own MongoDB connection pool after the
+fork, since pymongo clients must not be shared across fork(). With
+FACE_MATCH_SHARDS set, the master also starts one matcher shard host that
+all workers connect to, so the gallery is held once per machine.
+
+    python serve.py --workers 4 --threads 2 --bind 0.0.0.0:8000
+
+Signals to the master process:
+    HUP   graceful reload: start new workers, then retire the old ones
+    TTIN  add one worker, TTOU remove one worker
+    TERM  graceful shutdown, INT/QUIT immediate shutdown
+
+Settings can also come from the environment (WEB_BIND, WEB_WORKERS,
+WEB_THREADS, WEB_CV_THREADS, WEB_MAX_REQUESTS, WEB_MAX_REQUESTS_JITTER,
+WEB_TIMEOUT, WEB_GRACEFUL_TIMEOUT). Requires gunicorn (Linux/macOS).
+"""
+import argparse
+import os
+import sys
+
+from gunicorn.app.base import BaseApplication
+
+
+def env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def post_fork(server, worker):
+    """Give each worker its own database connection"""
+    import database as db
+    db.reconnect()
+
+
+def post_worker_init(worker):
+    """Limit OpenCV threads, warm the cascade cache and load the face matcher in the worker"""
+    import cv2
+    import database as db
+    import face_recognition_module as frm
+    # Workers already use every core; letting each one also fan detection
+    # out over all cores oversubscribes the CPU
+    cv2.setNumThreads(env_int('WEB_CV_THREADS', 1))
+    # One set of classifiers per request thread; sets loaded by the master
+    # before fork are inherited, so this only tops up
+    frm.preload_cascades(copies=worker.cfg.threads)
+    # With FACE_MATCH_SHARDS set, connect to the master's shard host now
+    # rather than inside the first request that needs it
+    db.get_face_matcher()
+
+
+class FaceRecognitionServer(BaseApplication):
+    """Gunicorn application that preloads the Flask app in the master"""
+
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if value is not None and key in self.cfg.settings:
+                self.cfg.set(key, value)
+
+    def load(self):
+        from app import app
+        import database as db
+        import face_recognition_module as frm
+        frm.preload_cascades(copies=self.options.get('threads') or 1)
+        if db.FACE_MATCH_SHARDS > 0 and not db.FACE_MATCH_SHARD_ADDRESSES:
+            # One set of shards for the whole host, started before fork;
+            # workers inherit the addresses and only connect
+            import sharded_matcher
+            db.FACE_MATCH_SHARD_ADDRESSES, db.FACE_MATCH_SHARD_AUTHKEY = sharded_matcher.start_host(db.FACE_MATCH_SHARDS)
+        return app
+
+
+def build_options(args):
+    threads = max(1, args.threads)
+    return {
+        'bind': args.bind,
+        'workers': max(1, args.workers),
+        'threads': threads,
+        'worker_class': 'gthread' if threads > 1 else 'sync',
+        # Recycle workers periodically to bound memory growth; the jitter
+        # keeps them from all restarting at the same moment
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests_jitter,
+        'timeout': args.timeout,
+        'graceful_timeout': args.graceful_timeout,
+        'keepalive': 5,
+        'preload_app': True,
+        'post_fork': post_fork,
+        'post_worker_init': post_worker_init,
+        'accesslog': args.access_log,
+        'proc_name': 'face-recognition',
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the face recognition web app with preforked workers")
+    parser.add_argument('--bind', default=os.getenv('WEB_BIND', '0.0.0.0:5000'))
+    parser.add_argument('--workers', type=int, default=env_int('WEB_WORKERS', default_workers()),
+                        help="Worker processes (default: one per core)")
+    parser.add_argument('--threads', type=int, default=env_int('WEB_THREADS', 1),
+                        help="Request threads per worker")
+    parser.add_argument('--cv-threads', type=int, default=env_int('WEB_CV_THREADS', 1),
+                        help="OpenCV threads per worker")
+    parser.add_argument('--max-requests', type=int, default=env_int('WEB_MAX_REQUESTS', 2000),
+                        help="Recycle a worker after this many requests (0 disables)")
+    parser.add_argument('--max-requests-jitter', type=int, default=env_int('WEB_MAX_REQUESTS_JITTER', 200))
+    parser.add_argument('--timeout', type=int, default=env_int('WEB_TIMEOUT', 60),
+                        help="Seconds before a silent worker is killed and replaced")
+    parser.add_argument('--graceful-timeout', type=int, default=env_int('WEB_GRACEFUL_TIMEOUT', 30),
+                        help="Seconds workers get to finish requests on reload/shutdown")
+    parser.add_argument('--access-log', default=None, help="Access log file ('-' for stdout)")
+    args = parser.parse_args(argv)
+    # Read by the worker hooks after fork
+    os.environ['WEB_CV_THREADS'] = str(max(1, args.cv_threads))
+
+    print("\n" + "="*60)
+    print("FACE RECOGNITION LOGIN SYSTEM - PRODUCTION SERVER")
+    print("="*60)
+    print(f"Binding {args.bind} with {args.workers} workers x {args.threads} threads")
+    print("="*60 + "\n")
+
+    FaceRecognitionServer(build_options(args)).run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,731 @@
+"""
+Sharded scatter-gather face matcher
+
+The enrolled gallery is partitioned over K shards by consistent hashing of
+the username. Each local shard is a separate process, pinned to one core,
+holding a QuantizedGallery of its partition. A query is quantized once,
+sent to every shard, and the per-shard top-k results are merged; borderline
+candidates are re-ranked against the exact stored encoding in the calling
+process, so shards never talk to MongoDB. Adding or removing a shard only
+moves the keys whose ring position changes owner.
+
+Shards are reached through the Shard interface (submit/collect), so a shard
+running on another machine can be plugged in behind the same calls.
+
+Preforked web servers share one set of shards per host: run as a script,
+this module serves the shards on sockets, loads them from MongoDB and keeps
+them in sync, and each worker reaches them through RemoteShard. serve.py
+starts it before forking (start_host); it can also run on its own:
+
+    FACE_MATCH_SHARD_AUTHKEY=secret python sharded_matcher.py --shards 4
+
+and the printed FACE_MATCH_SHARD_ADDRESSES is set for the web workers.
+"""
+import argparse
+import atexit
+import hashlib
+import heapq
+import multiprocessing
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from bisect import bisect
+from datetime import datetime, timedelta
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+from face_matcher import DEFAULT_THRESHOLD, QuantizedGallery, quantize
+
+VIRTUAL_NODES = 64
+LOAD_BATCH = 256
+# Seconds between checks for faces other processes added, changed or
+# deleted; this bounds how long a face registered on another host (or by
+# a script) stays invisible to the matcher
+SYNC_INTERVAL = float(os.getenv('FACE_MATCH_SYNC_INTERVAL', '2'))
+# Successive change queries overlap by this much, covering clock skew
+# between hosts and writes that committed while the previous query ran
+SYNC_OVERLAP = timedelta(seconds=5)
+# Seconds a shard host waits for its shards to start listening
+CONNECT_TIMEOUT = 30
+
+
+class ShardError(RuntimeError):
+    """A shard failed to execute a request"""
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes"""
+
+    def __init__(self, virtual_nodes=VIRTUAL_NODES):
+        self.virtual_nodes = virtual_nodes
+        self.points = []
+        self.owners = []
+
+    @staticmethod
+    def position(value):
+        return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+    def add(self, node):
+        for i in range(self.virtual_nodes):
+            point = self.position(f'{node}#{i}')
+            index = bisect(self.points, point)
+            self.points.insert(index, point)
+            self.owners.insert(index, node)
+
+    def remove(self, node):
+        kept = [(p, o) for p, o in zip(self.points, self.owners) if o != node]
+        self.points = [p for p, _ in kept]
+        self.owners = [o for _, o in kept]
+
+    def owner(self, key):
+        if not self.points:
+            return None
+        index = bisect(self.points, self.position(str(key))) % len(self.points)
+        return self.owners[index]
+
+
+class Shard:
+    """
+    One partition of the gallery
+    submit() sends a request without waiting and collect() returns its
+    result, so a caller can fan a query out to every shard before waiting
+    on any of them. Operations: import (keys, vectors, errors), export
+    (keys), remove (keys), search (quantized, error, threshold, limit),
+    snapshot ().
+    """
+
+    name = None
+
+    def submit(self, op, *args):
+        raise NotImplementedError
+
+    def collect(self):
+        raise NotImplementedError
+
+    def call(self, op, *args):
+        self.submit(op, *args)
+        return self.collect()
+
+    def close(self):
+        pass
+
+
+def _pin(cpu):
+    if cpu is not None and hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(0, {cpu})
+        except OSError:
+            pass
+
+
+def _exit_with_parent():
+    """Exit once the process that started this one is gone"""
+    parent = os.getppid()
+
+    def watch():
+        while os.getppid() == parent:
+            time.sleep(1)
+        os._exit(0)
+    threading.Thread(target=watch, name='parent-watch', daemon=True).start()
+
+
+def apply_op(gallery, op, args):
+    if op == 'import':
+        gallery.import_rows(*args)
+        return len(gallery)
+    if op == 'export':
+        return gallery.export_rows(*args)
+    if op == 'remove':
+        return sum(1 for key in args[0] if gallery.remove(key))
+    if op == 'search':
+        return gallery.candidates(*args)
+    if op == 'snapshot':
+        return gallery.snapshot()
+    raise ValueError(f"Unknown shard operation {op!r}")
+
+
+def serve_connection(conn, gallery):
+    """Serve requests from conn until it closes or sends 'stop'"""
+    while True:
+        try:
+            op, args = conn.recv()
+        except (EOFError, OSError, KeyboardInterrupt):
+            return
+        if op == 'stop':
+            conn.send(('ok', None))
+            return
+        try:
+            result = ('ok', apply_op(gallery, op, args))
+        except Exception as e:
+            result = ('error', f'{type(e).__name__}: {e}')
+        try:
+            conn.send(result)
+        except OSError:
+            return
+
+
+def run_shard(conn, cpu=None):
+    """Shard process main loop: serve requests from conn until 'stop'"""
+    _pin(cpu)
+    serve_connection(conn, QuantizedGallery())
+
+
+def serve_shard(address, authkey, cpu=None):
+    """
+    Shard process main loop for a shard host: serve every connection
+    Each web worker connects once and is served on its own thread against
+    the same gallery, which does its own locking. 'stop' only ends that
+    worker's connection; the shard lives as long as its host.
+    """
+    _pin(cpu)
+    _exit_with_parent()
+    if isinstance(address, str) and os.path.exists(address):
+        os.remove(address)
+    gallery = QuantizedGallery()
+    listener = Listener(address, authkey=authkey)
+    while True:
+        try:
+            conn = listener.accept()
+        except (OSError, multiprocessing.AuthenticationError) as e:
+            print(f"Shard connection refused: {e}")
+            continue
+        threading.Thread(target=serve_connection, args=(conn, gallery), daemon=True).start()
+
+
+class ConnectionShard(Shard):
+    """Shard answering over a multiprocessing connection"""
+
+    def __init__(self, name):
+        self.name = name
+        # Held from submit() until collect() so requests and replies pair up
+        self.lock = threading.Lock()
+
+    def connection(self):
+        raise NotImplementedError
+
+    def disconnected(self):
+        pass
+
+    def submit(self, op, *args):
+        self.lock.acquire()
+        try:
+            self.connection().send((op, args))
+        except Exception as e:
+            self.disconnected()
+            self.lock.release()
+            if isinstance(e, OSError):
+                raise ShardError(f"Shard {self.name} unreachable: {e}")
+            raise
+
+    def collect(self):
+        try:
+            status, result = self.connection().recv()
+        except (EOFError, OSError):
+            self.disconnected()
+            raise ShardError(f"Shard {self.name} exited")
+        finally:
+            self.lock.release()
+        if status != 'ok':
+            raise ShardError(f"Shard {self.name}: {result}")
+        return result
+
+
+class ProcessShard(ConnectionShard):
+    """Shard served by a local worker process over a pipe"""
+
+    def __init__(self, name, cpu=None, context=None):
+        super().__init__(name)
+        context = context or multiprocessing.get_context('spawn')
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=run_shard, args=(child, cpu),
+                                       name=f'face-shard-{name}', daemon=True)
+        self.process.start()
+        child.close()
+
+    def connection(self):
+        return self.conn
+
+    def close(self):
+        if self.process.is_alive():
+            try:
+                self.call('stop')
+            except Exception:
+                pass
+            self.process.join(2)
+            if self.process.is_alive():
+                self.process.terminate()
+        self.conn.close()
+
+
+class RemoteShard(ConnectionShard):
+    """
+    Shard served by a shard host (serve_shard) and shared with other processes
+    Connects on first use in each process, and again after an error.
+    """
+
+    def __init__(self, name, address, authkey):
+        super().__init__(name)
+        self.address = address
+        self.authkey = authkey
+        self.conn = None
+        self.pid = None
+
+    def connection(self):
+        if self.conn is None or self.pid != os.getpid():
+            self.conn = Client(self.address, authkey=self.authkey)
+            self.pid = os.getpid()
+        return self.conn
+
+    def disconnected(self):
+        if self.conn is not None and self.pid == os.getpid():
+            self.conn.close()
+        self.conn = None
+
+    def close(self):
+        with self.lock:
+            self.disconnected()
+
+
+class ShardedMatcher:
+    """
+    Scatter-gather matcher over a set of shards
+    Same search() contract as QuantizedGallery: [(key, distance)] sorted by
+    distance, with exact distances for re-ranked rows. exact_loader(key)
+    returns the stored float encoding (default: database lookup).
+    """
+
+    def __init__(self, shards=None, exact_loader=None, virtual_nodes=VIRTUAL_NODES):
+        self.exact_loader = exact_loader
+        self.ring = HashRing(virtual_nodes)
+        self.shards = {}
+        self.owner = {}
+        # Guards the topology and the key -> shard map; searches only
+        # take it to copy the shard list
+        self.lock = threading.RLock()
+        self.stats = {'searches': 0, 'reranked': 0, 'moved': 0}
+        if isinstance(shards, int):
+            shards = [ProcessShard(f'shard{i}', cpu=i % (os.cpu_count() or 1)) for i in range(shards)]
+        for shard in shards or []:
+            self.add_shard(shard)
+
+    def __len__(self):
+        return len(self.owner)
+
+    def __contains__(self, key):
+        return key in self.owner
+
+    def add_shard(self, shard):
+        """Add a shard and move over the keys it now owns"""
+        with self.lock:
+            self.shards[shard.name] = shard
+            self.ring.add(shard.name)
+            moves = {}
+            for key, current in self.owner.items():
+                if self.ring.owner(key) == shard.name:
+                    moves.setdefault(current, []).append(key)
+            for source, keys in moves.items():
+                self._move(self.shards[source], shard, keys)
+
+    def remove_shard(self, name):
+        """Drain a shard into the remaining ones and close it"""
+        with self.lock:
+            shard = self.shards[name]
+            if len(self.shards) == 1:
+                raise ValueError("Cannot remove the last shard")
+            self.ring.remove(name)
+            moves = {}
+            for key, current in self.owner.items():
+                if current == name:
+                    moves.setdefault(self.ring.owner(key), []).append(key)
+            for target, keys in moves.items():
+                self._move(shard, self.shards[target], keys)
+            del self.shards[name]
+            shard.close()
+
+    def _move(self, source, target, keys):
+        # Copy first and remove after, so a concurrent search sees the key
+        # on at least one shard; duplicates are merged away
+        for start in range(0, len(keys), LOAD_BATCH):
+            batch = keys[start:start + LOAD_BATCH]
+            rows = source.call('export', batch)
+            target.call('import', *rows)
+            for key in rows[0]:
+                self.owner[key] = target.name
+            source.call('remove', rows[0])
+            self.stats['moved'] += len(rows[0])
+
+    def add(self, key, face_encoding):
+        """Add or replace the encoding of key"""
+        self.add_many([(key, face_encoding)])
+
+    def add_many(self, items):
+        """Add (key, face_encoding) pairs, quantized here and sent per shard"""
+        with self.lock:
+            grouped = {}
+            for key, face_encoding in items:
+                quantized, error = quantize(face_encoding)
+                grouped.setdefault(self.ring.owner(key), []).append((key, quantized, error))
+            for name, rows in grouped.items():
+                for start in range(0, len(rows), LOAD_BATCH):
+                    batch = rows[start:start + LOAD_BATCH]
+                    keys = [key for key, _, _ in batch]
+                    self.shards[name].call('import', keys, np.stack([q for _, q, _ in batch]),
+                                           np.array([e for _, _, e in batch]))
+                    for key in keys:
+                        previous = self.owner.get(key)
+                        if previous is not None and previous != name:
+                            self.shards[previous].call('remove', [key])
+                        self.owner[key] = name
+
+    def remove(self, key):
+        with self.lock:
+            # Shards shared with other processes may hold keys this one
+            # never added, so fall back to the ring owner
+            name = self.owner.pop(key, None) or self.ring.owner(key)
+            if name is None:
+                return False
+            return self.shards[name].call('remove', [key]) > 0
+
+    def _exact_distance(self, key, query):
+        loader = self.exact_loader
+        if loader is None:
+            import database as db
+            loader = db.load_face_encoding
+        stored = loader(key)
+        if stored is None:
+            return None
+        return float(np.linalg.norm(np.asarray(stored, dtype=np.float64) - query))
+
+    def search(self, face_encoding, threshold=DEFAULT_THRESHOLD, k=None):
+        """Fan the query out to every shard and merge the k closest matches"""
+        query = np.asarray(face_encoding, dtype=np.float64)
+        quantized, query_error = quantize(query)
+        with self.lock:
+            shards = list(self.shards.values())
+
+        # Scatter to all shards before gathering, so they scan in parallel.
+        # Shards are always visited in the same order, which keeps their
+        # per-request locks deadlock free across threads.
+        submitted = []
+        try:
+            for shard in shards:
+                shard.submit('search', quantized, query_error, threshold, k)
+                submitted.append(shard)
+        finally:
+            replies = []
+            errors = []
+            for shard in submitted:
+                try:
+                    replies.append(shard.collect())
+                except ShardError as e:
+                    errors.append(e)
+        if errors:
+            raise errors[0]
+
+        sure = [sorted(s, key=lambda m: m[1]) for s, _ in replies]
+        reranked = []
+        borderline = {key for _, b in replies for key, _ in b}
+        for key in borderline:
+            exact = self._exact_distance(key, query)
+            if exact is not None and exact < threshold:
+                reranked.append((key, exact))
+        reranked.sort(key=lambda m: m[1])
+        self.stats['searches'] += 1
+        self.stats['reranked'] += len(borderline)
+
+        matches = []
+        seen = set()
+        for key, distance in heapq.merge(*sure, reranked, key=lambda m: m[1]):
+            if key in seen:
+                continue
+            seen.add(key)
+            matches.append((key, distance))
+            if k is not None and len(matches) >= k:
+                break
+        return matches
+
+    def snapshot(self):
+        """Per-shard sizes and counters"""
+        with self.lock:
+            shards = list(self.shards.values())
+        sizes = {shard.name: shard.call('snapshot') for shard in shards}
+        return dict(self.stats, size=sum(s['size'] for s in sizes.values()), shards=sizes)
+
+    def close(self):
+        with self.lock:
+            for shard in self.shards.values():
+                shard.close()
+            self.shards.clear()
+
+
+def load_from_database(matcher, batch_size=LOAD_BATCH):
+    """Fill a matcher with every enrolled face in MongoDB"""
+    import database as db
+    batch = []
+    for username, face_encoding in db.iter_face_encodings():
+        batch.append((username, face_encoding))
+        if len(batch) >= batch_size:
+            matcher.add_many(batch)
+            batch = []
+    if batch:
+        matcher.add_many(batch)
+    return matcher
+
+
+class DatabaseSync:
+    """
+    Keeps a matcher in step with faces written by other processes
+    Every interval seconds, users whose updated_at moved since the last
+    check are re-added (or removed once they have no face). Deletions leave
+    nothing to query, so the number of users with a face is compared with
+    the matcher size, and only a mismatch lists the stored usernames to
+    drop the deleted ones. A check runs inside the call that finds it due;
+    concurrent callers skip it rather than wait.
+    """
+
+    def __init__(self, matcher, interval=SYNC_INTERVAL):
+        self.matcher = matcher
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.since = None
+        self.next_check = 0.0
+        # Users with a face the matcher cannot hold (no stored encoding)
+        self.gap = 0
+        self.stats = {'checks': 0, 'updated': 0, 'removed': 0, 'reconciled': 0}
+
+    def load(self):
+        """Fill the matcher with every enrolled face"""
+        with self.lock:
+            started = datetime.utcnow()
+            load_from_database(self.matcher)
+            self.since = started
+            self.next_check = time.monotonic() + self.interval
+
+    def maybe_sync(self):
+        if time.monotonic() < self.next_check or not self.lock.acquire(blocking=False):
+            return
+        try:
+            self.sync()
+        except Exception as e:
+            print(f"Error syncing face matcher: {e}")
+        finally:
+            self.next_check = time.monotonic() + self.interval
+            self.lock.release()
+
+    def sync(self):
+        """Apply changes made since the last check (called with the lock held)"""
+        import database as db
+        started = datetime.utcnow()
+        batch = []
+        for username, face_encoding in db.iter_faces_changed_since(self.since - SYNC_OVERLAP):
+            if face_encoding is None:
+                self.stats['removed'] += 1 if self.matcher.remove(username) else 0
+                continue
+            batch.append((username, face_encoding))
+            if len(batch) >= LOAD_BATCH:
+                self.matcher.add_many(batch)
+                self.stats['updated'] += len(batch)
+                batch = []
+        if batch:
+            self.matcher.add_many(batch)
+            self.stats['updated'] += len(batch)
+        self.stats['checks'] += 1
+        self.since = started
+
+        count = db.count_faces()
+        if count is not None and count - len(self.matcher) != self.gap:
+            stored = set(db.iter_face_usernames())
+            for key in [key for key in list(self.matcher.owner) if key not in stored]:
+                self.stats['removed'] += 1 if self.matcher.remove(key) else 0
+            self.gap = count - len(self.matcher)
+            self.stats['reconciled'] += 1
+
+    def snapshot(self):
+        return dict(self.stats, interval=self.interval, since=self.since.isoformat() if self.since else None)
+
+
+_process_matcher = None
+_process_sync = None
+_process_pid = None
+_process_lock = threading.Lock()
+
+
+def process_matcher(shards):
+    """
+    The matcher of this process, started and loaded on first use
+    For single-process servers (python app.py, the CLI); preforked workers
+    use host_matcher instead. Created per process, so shards are never
+    shared through pipes inherited across fork(). Each call applies
+    changes other processes made once the DatabaseSync interval has passed.
+    """
+    global _process_matcher, _process_sync, _process_pid
+    if _process_pid != os.getpid():
+        with _process_lock:
+            if _process_pid != os.getpid():
+                matcher = ShardedMatcher(shards)
+                sync = DatabaseSync(matcher)
+                sync.load()
+                atexit.register(matcher.close)
+                _process_matcher, _process_sync = matcher, sync
+                _process_pid = os.getpid()
+    _process_sync.maybe_sync()
+    return _process_matcher
+
+
+_host_matcher = None
+_host_pid = None
+
+
+def format_address(address):
+    return address if isinstance(address, str) else f'{address[0]}:{address[1]}'
+
+
+def parse_addresses(value):
+    """Shard addresses from FACE_MATCH_SHARD_ADDRESSES: Unix socket paths or host:port, comma separated"""
+    addresses = []
+    for item in value.split(','):
+        item = item.strip()
+        host, _, port = item.rpartition(':')
+        addresses.append((host, int(port)) if host and port.isdigit() else item)
+    return [address for address in addresses if address]
+
+
+def host_shards(addresses, authkey):
+    """RemoteShards for a shard host, named by position like the host names them"""
+    return [RemoteShard(f'shard{i}', address, authkey) for i, address in enumerate(addresses)]
+
+
+def host_matcher(addresses, authkey):
+    """
+    This process's view of the shards of a shard host
+    Nothing is loaded here: the host keeps the shards filled and in sync,
+    and this process's own adds and removes reach every other one at once.
+    """
+    global _host_matcher, _host_pid
+    if _host_pid != os.getpid():
+        with _process_lock:
+            if _host_pid != os.getpid():
+                matcher = ShardedMatcher(host_shards(parse_addresses(addresses), authkey.encode()))
+                atexit.register(matcher.close)
+                _host_matcher = matcher
+                _host_pid = os.getpid()
+    return _host_matcher
+
+
+def wait_for_shards(shards, timeout=CONNECT_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    for shard in shards:
+        while True:
+            try:
+                shard.connection()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise ShardError(f"Shard {shard.name} did not start listening")
+                time.sleep(0.1)
+
+
+def run_host(addresses, authkey, interval=SYNC_INTERVAL, ready_fd=None):
+    """
+    Serve one shard process per address, load them and keep them in sync
+    Returns when a shard process exits, since its partition is then lost.
+    """
+    context = multiprocessing.get_context('spawn')
+    cpus = os.cpu_count() or 1
+    processes = []
+    for i, address in enumerate(addresses):
+        process = context.Process(target=serve_shard, args=(address, authkey, i % cpus),
+                                  name=f'face-shard-shard{i}', daemon=True)
+        process.start()
+        processes.append(process)
+    shards = host_shards(addresses, authkey)
+    wait_for_shards(shards)
+    matcher = ShardedMatcher(shards)
+    sync = DatabaseSync(matcher, interval)
+    sync.load()
+    print(f"✓ Face matcher shards loaded with {len(matcher)} faces")
+    if ready_fd is not None:
+        os.write(ready_fd, b'ready')
+        os.close(ready_fd)
+    while all(process.is_alive() for process in processes):
+        time.sleep(max(interval, 0.1))
+        sync.maybe_sync()
+    print("❌ A face matcher shard exited")
+    return 1
+
+
+def start_host(count):
+    """
+    Start a shard host for this machine and wait until its gallery is loaded
+    Returns (addresses, authkey) as FACE_MATCH_SHARD_ADDRESSES and
+    FACE_MATCH_SHARD_AUTHKEY take them. serve.py calls this in the master
+    before forking, so every worker shares one copy of the gallery. The
+    host is a plain subprocess rather than a multiprocessing child, so a
+    worker exiting never stops it; it exits with the process that started it.
+    """
+    authkey = os.urandom(16).hex()
+    socket_dir = tempfile.mkdtemp(prefix='face-shards-')
+    read_fd, write_fd = os.pipe()
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--shards', str(count), '--socket-dir', socket_dir,
+         '--ready-fd', str(write_fd)],
+        env=dict(os.environ, FACE_MATCH_SHARD_AUTHKEY=authkey), pass_fds=(write_fd,)
+    )
+    os.close(write_fd)
+    with os.fdopen(read_fd, 'rb') as ready:
+        if ready.read() != b'ready':
+            process.wait()
+            shutil.rmtree(socket_dir, ignore_errors=True)
+            raise ShardError("Face matcher shard host failed to start")
+    owner = os.getpid()
+
+    def stop():
+        # Forked workers inherit this handler; only the starter stops the host
+        if os.getpid() != owner:
+            return
+        process.terminate()
+        try:
+            process.wait(5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        shutil.rmtree(socket_dir, ignore_errors=True)
+    atexit.register(stop)
+    addresses = [os.path.join(socket_dir, f'shard{i}.sock') for i in range(count)]
+    return ','.join(addresses), authkey
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the sharded face matcher to every web worker on this host")
+    parser.add_argument('--shards', type=int, default=int(os.getenv('FACE_MATCH_SHARDS', '0')) or os.cpu_count() or 1)
+    parser.add_argument('--socket-dir', help="Directory for the Unix sockets (default: a new temporary one)")
+    parser.add_argument('--host', help="Listen on TCP at this address instead of Unix sockets")
+    parser.add_argument('--port', type=int, default=7300, help="First TCP port, one per shard (with --host)")
+    parser.add_argument('--interval', type=float, default=SYNC_INTERVAL, help="Seconds between database sync checks")
+    parser.add_argument('--ready-fd', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    authkey = os.getenv('FACE_MATCH_SHARD_AUTHKEY')
+    if not authkey:
+        parser.error("FACE_MATCH_SHARD_AUTHKEY must be set")
+    count = max(1, args.shards)
+    if args.host:
+        addresses = [(args.host, args.port + i) for i in range(count)]
+    else:
+        socket_dir = args.socket_dir or tempfile.mkdtemp(prefix='face-shards-')
+        os.makedirs(socket_dir, exist_ok=True)
+        addresses = [os.path.join(socket_dir, f'shard{i}.sock') for i in range(count)]
+    if args.ready_fd is not None:
+        _exit_with_parent()
+    # Exit through atexit on TERM, which also stops the shard processes
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"FACE_MATCH_SHARD_ADDRESSES={','.join(format_address(a) for a in addresses)}")
+    return run_host(addresses, authkey.encode(), args.interval, args.ready_fd)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
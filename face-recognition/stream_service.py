@@ -0,0 +1,305 @@
+"""
+Multi-stream face identification service
+
+Watches several video sources at once (camera indices, video files, image
+directories or network URLs such as rtsp://...). Each source is decoded on
+its own thread into a single-frame slot; the scheduler batches the
+freshest frame of every stream onto a shared worker pool, so a slow pool
+drops stale frames instead of building a backlog. Faces are identified against the enrolled
+gallery and written as JSON lines:
+
+    {"type": "faces", "stream": "0", "frame": 12, "faces": [{"box": [...], "username": "raj", ...}]}
+    {"type": "stats", "streams": {"0": {"decode_fps": 29.8, "processed_fps": 9.7, "dropped": 120, ...}}}
+
+Per stream, frames read = throttled (skipped by --max-fps) + decoded, and
+decoded frames are either processed or dropped (one may still be pending).
+
+    python stream_service.py 0 entrance.mp4 rtsp://cam2/stream --workers 4
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+import database as db
+import face_recognition_module as frm
+from frame_sources import open_source
+from face_matcher import DEFAULT_THRESHOLD, QuantizedGallery
+
+
+def load_gallery(legacy_json=None):
+    """Load enrolled faces from MongoDB, or from a legacy users.json file"""
+    stored = {}
+    if legacy_json:
+        from migrate_users import LegacyUserReader
+        with LegacyUserReader(legacy_json) as reader:
+            for username, record in reader:
+                if record.get('face_encoding'):
+                    stored[username] = record['face_encoding']
+    else:
+        for username, face_encoding in db.iter_face_encodings():
+            stored[username] = face_encoding
+    # Exact encodings are only needed to settle borderline matches
+    gallery = QuantizedGallery(exact_loader=stored.get if legacy_json else None)
+    for username, face_encoding in stored.items():
+        gallery.add(username, face_encoding)
+    if not legacy_json:
+        stored.clear()
+    return gallery
+
+
+class StreamReader(threading.Thread):
+    """Decodes one source, keeping only the newest frame"""
+
+    def __init__(self, name, source, loop=False, max_fps=0):
+        super().__init__(name=f'stream-{name}', daemon=True)
+        self.stream_name = name
+        self.source = source
+        self.loop = loop
+        self.min_interval = 1.0 / max_fps if max_fps else 0
+        self.lock = threading.Lock()
+        self.frame = None
+        self.frame_no = 0
+        self.frame_time = 0.0
+        self.running = True
+        self.finished = False
+        self.error = None
+        self.stats = {'read': 0, 'throttled': 0, 'decoded': 0, 'processed': 0, 'dropped': 0, 'faces': 0,
+                      'latency_total': 0.0}
+
+    def run(self):
+        source = open_source(self.source, loop=self.loop)
+        if not source.open():
+            source.release()
+            self.error = f"Cannot open source {self.source!r}"
+            self.finished = True
+            return
+        last = 0.0
+        try:
+            while self.running:
+                ret, frame = source.read()
+                if not ret:
+                    break
+                now = time.monotonic()
+                if self.min_interval and now - last < self.min_interval:
+                    with self.lock:
+                        self.stats['read'] += 1
+                        self.stats['throttled'] += 1
+                    continue
+                last = now
+                with self.lock:
+                    self.stats['read'] += 1
+                    if self.frame is not None:
+                        # The previous frame was never picked up
+                        self.stats['dropped'] += 1
+                    self.frame = frame
+                    self.frame_no += 1
+                    self.frame_time = now
+                    self.stats['decoded'] += 1
+        finally:
+            source.release()
+            self.finished = True
+
+    def take(self):
+        """Take the pending frame, returns (frame_no, frame, captured_at) or None"""
+        with self.lock:
+            if self.frame is None:
+                return None
+            item = (self.frame_no, self.frame, self.frame_time)
+            self.frame = None
+            return item
+
+    def stop(self):
+        self.running = False
+
+
+class IdentificationService:
+    """Schedules frames from all streams onto a shared detection pool"""
+
+    def __init__(self, sources, gallery, workers=4, batch_size=4, threshold=DEFAULT_THRESHOLD,
+                 emit=None, stats_interval=5.0, loop=False, max_fps=0):
+        self.readers = [StreamReader(str(name), source, loop=loop, max_fps=max_fps)
+                        for name, source in sources]
+        self.gallery = gallery
+        self.workers = workers
+        self.batch_size = batch_size
+        self.threshold = threshold
+        self.emit_event = emit or self.print_event
+        self.emit_lock = threading.Lock()
+        self.stats_interval = stats_interval
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='identify')
+        # At most one batch queued per worker beyond the running ones
+        self.slots = threading.Semaphore(workers * 2)
+        self.running = False
+        self.started = None
+
+    def print_event(self, event):
+        sys.stdout.write(json.dumps(event) + '\n')
+        sys.stdout.flush()
+
+    def emit(self, event):
+        with self.emit_lock:
+            self.emit_event(event)
+
+    def identify_frame(self, reader, frame_no, frame, captured_at):
+        gray = cv2.equalizeHist(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+        boxes = frm.detect_faces(gray)
+        faces = []
+        for box in boxes:
+            face_data, _ = frm.extract_face(frame, box)
+            if face_data is None:
+                continue
+            matches = self.gallery.search(face_data.reshape(-1), self.threshold)
+            best = matches[0] if matches else None
+            faces.append({
+                'box': [int(v) for v in box],
+                'username': best[0] if best else None,
+                'distance': round(best[1], 1) if best else None,
+                'candidates': len(matches)
+            })
+        latency = time.monotonic() - captured_at
+        with reader.lock:
+            reader.stats['processed'] += 1
+            reader.stats['faces'] += len(faces)
+            reader.stats['latency_total'] += latency
+        if faces:
+            self.emit({
+                'type': 'faces',
+                'stream': reader.stream_name,
+                'frame': frame_no,
+                'time': time.time(),
+                'latency_ms': round(latency * 1000, 1),
+                'faces': faces
+            })
+
+    def process_batch(self, batch):
+        try:
+            for reader, frame_no, frame, captured_at in batch:
+                try:
+                    self.identify_frame(reader, frame_no, frame, captured_at)
+                except Exception as e:
+                    self.emit({'type': 'error', 'stream': reader.stream_name, 'error': str(e)})
+        finally:
+            self.slots.release()
+
+    def stats_snapshot(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        streams = {}
+        for reader in self.readers:
+            with reader.lock:
+                stats = dict(reader.stats)
+            processed = stats['processed']
+            streams[reader.stream_name] = {
+                'read': stats['read'],
+                'throttled': stats['throttled'],
+                'decode_fps': round(stats['decoded'] / elapsed, 2),
+                'processed_fps': round(processed / elapsed, 2),
+                'dropped': stats['dropped'],
+                'drop_rate': round(stats['dropped'] / max(stats['decoded'], 1), 3),
+                'faces': stats['faces'],
+                'avg_latency_ms': round(stats['latency_total'] / processed * 1000, 1) if processed else None,
+                'finished': reader.finished,
+                'error': reader.error
+            }
+        return {'type': 'stats', 'time': time.time(), 'elapsed': round(elapsed, 1),
+                'gallery_size': len(self.gallery), 'streams': streams}
+
+    def run(self, duration=None):
+        """Run until every stream ends, duration passes or stop() is called"""
+        self.running = True
+        self.started = time.monotonic()
+        for reader in self.readers:
+            reader.start()
+        next_stats = self.started + self.stats_interval
+        index = 0
+        try:
+            while self.running:
+                now = time.monotonic()
+                if duration and now - self.started >= duration:
+                    break
+                if now >= next_stats:
+                    self.emit(self.stats_snapshot())
+                    next_stats = now + self.stats_interval
+
+                # Round-robin over streams so one fast source cannot starve others
+                batch = []
+                for offset in range(len(self.readers)):
+                    reader = self.readers[(index + offset) % len(self.readers)]
+                    item = reader.take()
+                    if item is not None:
+                        batch.append((reader,) + item)
+                        if len(batch) >= self.batch_size:
+                            break
+                index += 1
+
+                if batch:
+                    # Blocks while the pool is saturated; readers keep
+                    # replacing their frame meanwhile (counted as dropped)
+                    self.slots.acquire()
+                    self.pool.submit(self.process_batch, batch)
+                elif all(r.finished for r in self.readers):
+                    break
+                else:
+                    time.sleep(0.002)
+        finally:
+            self.stop()
+        self.emit(self.stats_snapshot())
+
+    def stop(self):
+        self.running = False
+        for reader in self.readers:
+            reader.stop()
+        self.pool.shutdown(wait=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Identify enrolled faces across several video streams")
+    parser.add_argument('sources', nargs='+', help="Camera index, video file, image directory or stream URL")
+    parser.add_argument('--workers', type=int, default=4, help="Shared detection threads")
+    parser.add_argument('--batch-size', type=int, default=4, help="Frames per pool task")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--max-fps', type=float, default=0, help="Cap decoded fps per stream (0 = source rate)")
+    parser.add_argument('--stats-interval', type=float, default=5.0)
+    parser.add_argument('--duration', type=float, help="Stop after this many seconds")
+    parser.add_argument('--loop', action='store_true', help="Restart video files and image directories at the end")
+    parser.add_argument('--gallery-json', help="Load the gallery from a legacy users.json instead of MongoDB")
+    parser.add_argument('--output', help="Write events to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    gallery = load_gallery(args.gallery_json)
+    print(f"Loaded {len(gallery)} enrolled faces", file=sys.stderr)
+
+    output = open(args.output, 'a') if args.output else None
+
+    def emit(event):
+        target = output or sys.stdout
+        target.write(json.dumps(event) + '\n')
+        target.flush()
+
+    service = IdentificationService(
+        list(enumerate(args.sources)),
+        gallery,
+        workers=max(1, args.workers),
+        batch_size=max(1, args.batch_size),
+        threshold=args.threshold,
+        emit=emit,
+        stats_interval=args.stats_interval,
+        loop=args.loop,
+        max_fps=args.max_fps
+    )
+    try:
+        service.run(duration=args.duration)
+    except KeyboardInterrupt:
+        service.stop()
+    finally:
+        if output:
+            output.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
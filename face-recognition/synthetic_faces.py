@@ -0,0 +1,25 @@
+import cv2
+import numpy as np
+
+# Test data for loadtest.py and evaluate_pipeline.py; not used by the app
+
+
+def synthetic_face(seed, width=640, height=480, with_face=True):
+    """Draw a synthetic face image that the Haar cascades detect"""
+    rng = np.random.default_rng(seed)
+    img = np.full((height, width, 3), int(rng.integers(70, 110)), np.uint8)
+    if with_face:
+        r = min(width, height) // 4
+        cx = width // 2 + int(rng.integers(-r // 6, r // 6 + 1))
+        cy = height // 2 + int(rng.integers(-r // 12, r // 12 + 1))
+        skin = tuple(int(v) for v in rng.integers(130, 210, 3))
+        cv2.ellipse(img, (cx, cy), (r * 3 // 4, r), 0, 0, 360, skin, -1)
+        for dx in (-r // 3, r // 3):
+            cv2.ellipse(img, (cx + dx, cy - r // 4), (r // 6, r // 12), 0, 0, 360, (255, 255, 255), -1)
+            cv2.circle(img, (cx + dx, cy - r // 4), r // 14, (30, 30, 30), -1)
+            cv2.line(img, (cx + dx - r // 6, cy - r // 2 + 5), (cx + dx + r // 6, cy - r // 2), (40, 40, 60), 6)
+        cv2.line(img, (cx, cy - r // 8), (cx, cy + r // 5), (110, 130, 170), 5)
+        cv2.ellipse(img, (cx, cy + r // 2), (r // 3, r // 10), 0, 0, 180, (60, 60, 140), 6)
+    img = cv2.GaussianBlur(img, (5, 5), 0)
+    noise = rng.integers(-8, 9, img.shape)
+    return np.clip(img.astype(np.int16) + noise, 0, 255).astype(np.uint8)